@@ -0,0 +1,56 @@
+"""Analisa com IA todas as conversas com mensagens num periodo (ou so as desatualizadas).
+
+Uso:
+    python -m scripts.analisar_lote                       # conversas de hoje, todas as empresas
+    python -m scripts.analisar_lote --empresa 1 --inicio 2026-02-01 --fim 2026-02-07
+    python -m scripts.analisar_lote --empresa 1 --concorrencia 16
+    python -m scripts.analisar_lote --empresa 1 --sem-cache   # reanalisa mesmo o que nao mudou
+    python -m scripts.analisar_lote --pendentes --limite 500  # so conversas com mensagens novas
+"""
+
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+# Fix path para imports
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.analysis.lote import analisar_lote, analisar_pendentes  # noqa: E402
+from src.database.connection import criar_tabelas  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analise em lote de conversas")
+    parser.add_argument("--empresa", type=int, default=None, help="ID da empresa (padrao: todas)")
+    parser.add_argument("--inicio", default=None, help="Data inicial YYYY-MM-DD (padrao: --fim)")
+    parser.add_argument("--fim", default=None, help="Data final YYYY-MM-DD (padrao: hoje)")
+    parser.add_argument("--concorrencia", type=int, default=None, help="Chamadas simultaneas a OpenAI")
+    parser.add_argument("--sem-cache", action="store_true", help="Ignora analises ja feitas do mesmo conteudo")
+    parser.add_argument(
+        "--pendentes", action="store_true",
+        help="So conversas com mensagens novas desde a ultima analise (ignora --inicio/--fim)",
+    )
+    parser.add_argument("--limite", type=int, default=None, help="Maximo de conversas com --pendentes")
+    args = parser.parse_args()
+
+    criar_tabelas()
+    if args.pendentes:
+        resumo = asyncio.run(analisar_pendentes(args.empresa, args.limite, args.concorrencia))
+    else:
+        resumo = asyncio.run(
+            analisar_lote(args.empresa, args.inicio, args.fim, args.concorrencia, not args.sem_cache)
+        )
+
+    print(
+        f"\nAnalise concluida: {resumo.analisadas}/{resumo.total} conversas ({resumo.em_cache} do cache), {resumo.falhas} falhas, "
+        f"{resumo.tokens} tokens em {resumo.segundos:.1f}s ({resumo.conversas_por_minuto} conversas/min)."
+    )
+    for erro in resumo.erros:
+        print(f"  conversa {erro['conversa_id']}: {erro['erro']}")
+    if resumo.falhas:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
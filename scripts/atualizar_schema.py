@@ -0,0 +1,46 @@
+"""Atualiza o schema de um banco existente aplicando as migracoes pendentes.
+
+criar_tabelas() (create_all) so cria tabelas que nao existem. Este script
+cria as tabelas novas e aplica as migracoes versionadas de
+src/database/migrations.py (colunas, backfills e indices), registrando cada
+uma em `schema_versao`. A API faz o mesmo no startup (MIGRAR_NA_INICIALIZACAO).
+
+Funciona em SQLite e PostgreSQL. Idempotente: pode rodar varias vezes.
+
+Uso:
+    python -m scripts.atualizar_schema
+    python -m scripts.atualizar_schema --status   # lista migracoes aplicadas/pendentes
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+# Fix path para imports
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.database.connection import criar_tabelas  # noqa: E402
+from src.database.migrations import MIGRACOES, aplicar_migracoes, versoes_aplicadas  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aplicar migracoes do schema")
+    parser.add_argument("--status", action="store_true", help="Apenas lista migracoes aplicadas e pendentes")
+    args = parser.parse_args()
+
+    if args.status:
+        aplicadas = versoes_aplicadas()
+        for migracao in MIGRACOES:
+            marca = "x" if migracao.versao in aplicadas else " "
+            print(f"[{marca}] {migracao.versao:03d} {migracao.descricao}")
+        return
+
+    criar_tabelas()
+    aplicadas = aplicar_migracoes()
+    for versao in aplicadas:
+        print(f"[OK] Migracao {versao:03d} aplicada.")
+    print("Schema atualizado." if aplicadas else "Schema ja estava atualizado.")
+
+
+if __name__ == "__main__":
+    main()
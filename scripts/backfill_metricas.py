@@ -0,0 +1,84 @@
+"""Recalcula o historico de metricas em paralelo (por empresa e dia).
+
+Use depois de mudar o prompt ou corrigir um bug no calculo. Retomavel: o
+checkpoint guarda as tarefas (empresa, dia) ja concluidas.
+
+Uso:
+    python -m scripts.backfill_metricas --inicio 2025-01-01 --fim 2025-12-31
+    python -m scripts.backfill_metricas --inicio 2026-02-01 --fim 2026-02-28 --empresa 1 --empresa 3
+    python -m scripts.backfill_metricas --inicio 2025-01-01 --fim 2025-12-31 --workers 8 --do-inicio
+"""
+
+import argparse
+import sys
+from datetime import date
+from pathlib import Path
+
+# Fix path para imports
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.database.connection import criar_tabelas  # noqa: E402
+from src.metrics.backfill import executar_backfill  # noqa: E402
+
+
+def _mostrar_progresso(resumo: dict) -> None:
+    feitas = resumo["concluidas"] + resumo["falhas"]
+    restantes = resumo["tarefas"] - resumo["puladas"] - feitas
+    segundos = resumo["segundos"] or 1e-9
+    por_seg = feitas / segundos
+    eta = restantes / por_seg if por_seg else 0
+    print(
+        f"\r  {feitas + resumo['puladas']}/{resumo['tarefas']} tarefas | "
+        f"{por_seg:.1f} tarefas/s | {resumo['vendedor_dias'] / segundos:.0f} vendedor-dias/s | "
+        f"falhas {resumo['falhas']} | ETA {eta:.0f}s   ",
+        end="",
+        flush=True,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill paralelo de metricas diarias")
+    parser.add_argument("--inicio", required=True, help="Data inicial YYYY-MM-DD")
+    parser.add_argument("--fim", default=date.today().isoformat(), help="Data final YYYY-MM-DD (padrao: hoje)")
+    parser.add_argument(
+        "--empresa", type=int, action="append", dest="empresas",
+        help="ID da empresa (repetivel; padrao: todas as ativas)",
+    )
+    parser.add_argument("--workers", type=int, default=None, help="Processos em paralelo (padrao: CPUs)")
+    parser.add_argument(
+        "--checkpoint", default="data/backfill_metricas.json", help="Arquivo de checkpoint das tarefas concluidas",
+    )
+    parser.add_argument("--do-inicio", action="store_true", help="Ignora o checkpoint e refaz todas as tarefas")
+    args = parser.parse_args()
+
+    if args.inicio > args.fim:
+        parser.error("--inicio deve ser anterior ou igual a --fim")
+
+    checkpoint = Path(args.checkpoint)
+    if args.do_inicio and checkpoint.exists():
+        checkpoint.unlink()
+
+    print(f"Periodo:    {args.inicio} a {args.fim}")
+    print(f"Empresas:   {', '.join(map(str, args.empresas)) if args.empresas else 'todas as ativas'}")
+    print(f"Checkpoint: {checkpoint}")
+
+    criar_tabelas()
+    resumo = executar_backfill(
+        args.inicio, args.fim,
+        empresa_ids=args.empresas,
+        workers=args.workers,
+        checkpoint=checkpoint,
+        ao_progredir=_mostrar_progresso,
+    )
+
+    print(
+        f"\n\nBackfill concluido: {resumo['concluidas']} tarefas ({resumo['puladas']} ja feitas), "
+        f"{resumo['vendedor_dias']} vendedor-dias, {resumo['falhas']} falhas em {resumo['segundos']:.1f}s."
+    )
+    if resumo["falhas"]:
+        print("Rode de novo para reprocessar as tarefas que falharam.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Micro-benchmark do estagio de parse do webhook (decode JSON + parsear_webhook_lote).
+
+Usa payloads realistas da Evolution API v2: texto, texto estendido, imagem com
+legenda, audio, grupo (descartado), evento de status (descartado) e um lote de
+sincronizacao de historico. Mede mensagens/segundo por cenario e no mix.
+
+Uso:
+    python -m scripts.benchmark_parser
+    python -m scripts.benchmark_parser --repeticoes 50000
+    python -m scripts.benchmark_parser --minimo 50000   # falha (exit 1) abaixo de 50k msg/s no mix
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+# Fix path para imports
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.whatsapp.parser import decodificar_json, orjson, parsear_webhook_lote  # noqa: E402
+
+_INSTANCIA = "agente-comercial"
+_SENDER = "5511988887777@s.whatsapp.net"
+
+
+def _evento(data: dict | list, evento: str = "messages.upsert") -> dict:
+    return {
+        "event": evento,
+        "instance": _INSTANCIA,
+        "data": data,
+        "destination": "http://agente-comercial:8000/webhook/messages",
+        "date_time": "2026-02-07T10:00:00.000Z",
+        "sender": _SENDER,
+        "server_url": "http://evolution-api:8080",
+        "apikey": "B6D711FCDE4D4FD5936544120E713976",
+    }
+
+
+def _data(msg_id: str, message: dict, from_me: bool = False, jid: str = "5511977776666@s.whatsapp.net") -> dict:
+    return {
+        "key": {"remoteJid": jid, "fromMe": from_me, "id": msg_id},
+        "pushName": "Joana Lead",
+        "status": "DELIVERY_ACK",
+        "message": {
+            **message,
+            "messageContextInfo": {
+                "deviceListMetadata": {"senderKeyHash": "k1ZbJ4xX", "senderTimestamp": "1707290000"},
+                "deviceListMetadataVersion": 2,
+            },
+        },
+        "messageType": next(iter(message)),
+        "messageTimestamp": 1707300000,
+        "instanceId": "3f1c2a5e-9b7d-4e0a-8c61-2d4b5f6a7e8c",
+        "source": "android",
+    }
+
+
+CENARIOS: dict[str, dict | list] = {
+    "texto": _evento(_data("3EB0A1", {"conversation": "Oi, quero saber o preco do plano anual"})),
+    "texto_estendido": _evento(_data("3EB0A2", {
+        "extendedTextMessage": {
+            "text": "Claro! O plano anual sai por R$ 1.990. Posso te enviar a proposta?",
+            "contextInfo": {"stanzaId": "3EB0A1", "participant": "5511977776666@s.whatsapp.net"},
+        },
+    }, from_me=True)),
+    "imagem_legenda": _evento(_data("3EB0A3", {
+        "imageMessage": {
+            "url": "https://mmg.whatsapp.net/v/t62.7118-24/abc.enc",
+            "mimetype": "image/jpeg",
+            "caption": "Segue o comprovante",
+            "fileLength": "182734",
+            "height": 1280,
+            "width": 960,
+            "jpegThumbnail": "/9j/4AAQSkZJRgABAQAAAQABAAD" * 20,
+        },
+    })),
+    "audio": _evento(_data("3EB0A4", {
+        "audioMessage": {
+            "url": "https://mmg.whatsapp.net/v/t62.7117-24/def.enc",
+            "mimetype": "audio/ogg; codecs=opus",
+            "seconds": 14,
+            "ptt": True,
+        },
+    })),
+    "grupo": _evento(_data("3EB0A5", {"conversation": "Bom dia grupo"}, jid="120363025246125486@g.us")),
+    "status": _evento({"remoteJid": "5511977776666@s.whatsapp.net", "status": "READ"}, evento="messages.update"),
+    "lote_historico_50": _evento([
+        _data(f"HIST{i:04d}", {"conversation": f"mensagem {i} do historico"}, from_me=i % 2 == 0)
+        for i in range(50)
+    ]),
+}
+
+
+def medir(corpo: bytes, repeticoes: int) -> tuple[float, int]:
+    """Roda decode + parse `repeticoes` vezes. Retorna (segundos, mensagens parseadas)."""
+    mensagens = 0
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        for _msg in parsear_webhook_lote(decodificar_json(corpo)):
+            mensagens += 1
+    return time.perf_counter() - inicio, mensagens
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do parse do webhook")
+    parser.add_argument("--repeticoes", type=int, default=20000, help="Payloads por cenario")
+    parser.add_argument("--minimo", type=float, default=None, help="Minimo de mensagens/s no mix (regressao)")
+    args = parser.parse_args()
+
+    print(f"Decoder JSON: {'orjson' if orjson is not None else 'json (stdlib)'}")
+    print(f"{'cenario':<20} {'payloads/s':>12} {'msgs/s':>12}")
+
+    corpos = {nome: json.dumps(payload).encode() for nome, payload in CENARIOS.items()}
+    for nome, corpo in corpos.items():
+        # Lotes tem N mensagens por payload: menos repeticoes para tempo parecido
+        repeticoes = max(1, args.repeticoes // 50) if nome.startswith("lote") else args.repeticoes
+        segundos, mensagens = medir(corpo, repeticoes)
+        print(f"{nome:<20} {repeticoes / segundos:>12,.0f} {mensagens / segundos:>12,.0f}")
+
+    # Mix sem o lote: o teto do caminho de mensagem unica
+    mix = [c for nome, c in corpos.items() if not nome.startswith("lote")]
+    total_seg, total_msgs = 0.0, 0
+    for corpo in mix:
+        segundos, mensagens = medir(corpo, args.repeticoes)
+        total_seg += segundos
+        total_msgs += mensagens
+    payloads_s = len(mix) * args.repeticoes / total_seg
+    msgs_s = total_msgs / total_seg
+    print(f"{'mix':<20} {payloads_s:>12,.0f} {msgs_s:>12,.0f}")
+
+    if args.minimo is not None and msgs_s < args.minimo:
+        print(f"[ERRO] {msgs_s:,.0f} msg/s abaixo do minimo de {args.minimo:,.0f}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,10 @@ from sqlalchemy import create_engine, text
 
 DUMP_FILE = os.path.join(os.path.dirname(__file__), "..", "dump_dados.sql")
 
+# Tabelas de chave composta (sem coluna id): fora do ajuste de sequences, pois
+# um SELECT com erro aborta a transacao inteira no PostgreSQL
+SEM_SEQUENCE = {"metricas_pendentes", "metricas_horarias"}
+
 
 def main():
     database_url = os.environ.get("DATABASE_URL")
@@ -38,7 +42,8 @@ def main():
     with engine.begin() as conn:
         # Limpar tabelas na ordem reversa (respeitar FKs)
         tabelas = [
-            "configuracoes", "configuracoes_prompt", "metricas_diarias",
+            "configuracoes", "configuracoes_prompt", "metricas_pendentes", "metricas_horarias",
+            "metricas_periodo", "metricas_diarias",
             "analises", "mensagens", "conversas", "vendedores",
             "instancias_evolution", "empresas"
         ]
@@ -64,6 +69,8 @@ def main():
     print("\nAjustando sequences...")
     with engine.begin() as conn:
         for tabela in reversed(tabelas):
+            if tabela in SEM_SEQUENCE:
+                continue
             try:
                 result = conn.execute(text(f"SELECT MAX(id) FROM {tabela}")).scalar()
                 if result:
@@ -0,0 +1,54 @@
+"""Reprocessa o journal de webhooks pelo caminho normal de ingestao.
+
+Use depois de uma queda do processo ou do banco. E idempotente: mensagens
+ja salvas sao ignoradas e o checkpoint guarda ate onde o replay chegou.
+
+Uso:
+    python -m scripts.replay_journal
+    python -m scripts.replay_journal --dir data/journal --checkpoint data/journal/checkpoint.json
+    python -m scripts.replay_journal --do-inicio   # ignora o checkpoint
+    python -m scripts.replay_journal --manter-segmentos   # nao apaga os segmentos ja reprocessados
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+# Fix path para imports
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.config import settings  # noqa: E402
+from src.database.connection import criar_tabelas  # noqa: E402
+from src.whatsapp.journal import reprocessar_journal  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reprocessar journal de webhooks")
+    parser.add_argument("--dir", default=settings.journal_dir, help="Diretorio do journal")
+    parser.add_argument("--checkpoint", default=None, help="Arquivo de checkpoint (padrao: <dir>/checkpoint.json)")
+    parser.add_argument("--do-inicio", action="store_true", help="Ignora o checkpoint e relê todos os segmentos")
+    parser.add_argument(
+        "--manter-segmentos", action="store_true", help="Nao apaga os segmentos lidos por inteiro",
+    )
+    args = parser.parse_args()
+
+    diretorio = Path(args.dir)
+    checkpoint = Path(args.checkpoint) if args.checkpoint else diretorio / "checkpoint.json"
+    if args.do_inicio and checkpoint.exists():
+        checkpoint.unlink()
+
+    print(f"Journal:    {diretorio}")
+    print(f"Checkpoint: {checkpoint}")
+
+    criar_tabelas()
+    resumo = reprocessar_journal(diretorio, checkpoint, compactar=not args.manter_segmentos)
+
+    print(
+        f"\nReplay concluido: {resumo['lidos']} lidos, {resumo['salvos']} salvos, "
+        f"{resumo['duplicados']} duplicados, {resumo['ignorados']} ignorados, "
+        f"{resumo['segmentos_apagados']} segmento(s) apagado(s)."
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -12,7 +12,16 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
 from src.database.connection import SessionLocal, criar_tabelas
-from src.database.models import Analise, Conversa, Mensagem, MetricaDiaria, Vendedor
+from src.database.models import (
+    Analise,
+    Conversa,
+    Mensagem,
+    MetricaDiaria,
+    MetricaHoraria,
+    MetricaPendente,
+    MetricaPeriodo,
+    Vendedor,
+)
 from src.database.queries import (
     buscar_ou_criar_conversa,
     criar_vendedor,
@@ -24,6 +33,9 @@ from src.metrics.calculator import calcular_metricas
 
 def limpar_banco(db):
     """Remove todos os dados existentes para seed limpo."""
+    db.query(MetricaPendente).delete()
+    db.query(MetricaHoraria).delete()
+    db.query(MetricaPeriodo).delete()
     db.query(MetricaDiaria).delete()
     db.query(Analise).delete()
     db.query(Mensagem).delete()
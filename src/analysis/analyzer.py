@@ -1,23 +1,82 @@
 """Motor de analise de conversas usando OpenAI — multi-tenant."""
 
+import asyncio
+import hashlib
 import json
 import logging
 from dataclasses import dataclass, field
 
-from openai import AsyncOpenAI
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
 from src.analysis.prompts import SYSTEM_PROMPT, TEMPLATE_ANALISE, formatar_transcricao
-from src.config_manager import get_config
+from src.config import settings
+from src.config_manager import get_config, get_prompt
 from src.database.connection import SessionLocal
-from src.database.queries import buscar_prompt_ativo
+from src.database.queries import buscar_analise_por_hash
 
 logger = logging.getLogger(__name__)
 
+MODELO = "gpt-4o-mini"
 CLASSIFICACOES_VALIDAS = {"frio", "mql", "sql", "cliente"}
 SENTIMENTOS_VALIDOS = {"positivo", "neutro", "negativo"}
 
 
+class ClientesOpenAI:
+    """Um AsyncOpenAI por (api_key, base_url, timeout), reaproveitado entre chamadas.
+
+    Cada cliente mantem o seu pool de conexoes HTTP (keep-alive): as analises
+    nao pagam um handshake TLS por chamada. Empresas com `openai_api_key`
+    propria ganham o seu cliente. Conexoes pertencem ao event loop em que
+    foram abertas; chamadas de outro loop (ex: asyncio.run de um script)
+    criam um cliente novo para a mesma chave.
+    """
+
+    def __init__(self, max_conexoes: int, max_conexoes_ociosas: int):
+        self.max_conexoes = max_conexoes
+        self.max_conexoes_ociosas = max_conexoes_ociosas
+        self._clientes: dict[tuple, tuple[asyncio.AbstractEventLoop, AsyncOpenAI]] = {}
+
+    def obter(self, api_key: str, base_url: str | None = None, timeout: float = 30.0) -> AsyncOpenAI:
+        loop = asyncio.get_running_loop()
+        chave = (api_key, base_url, timeout)
+        existente = self._clientes.get(chave)
+        if existente is not None and existente[0] is loop:
+            return existente[1]
+        cliente = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=timeout,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_conexoes,
+                    max_keepalive_connections=self.max_conexoes_ociosas,
+                ),
+            ),
+        )
+        self._clientes[chave] = (loop, cliente)
+        return cliente
+
+    async def fechar(self) -> None:
+        """Fecha os pools abertos no loop atual e esquece todos os clientes."""
+        loop = asyncio.get_running_loop()
+        for dono, cliente in self._clientes.values():
+            if dono is loop:
+                await cliente.close()
+        self._clientes.clear()
+
+    def descartar(self) -> None:
+        """Esquece os clientes sem fechar (ex: testes que trocam AsyncOpenAI por mock)."""
+        self._clientes.clear()
+
+
+clientes_openai = ClientesOpenAI(
+    max_conexoes=settings.openai_max_conexoes,
+    max_conexoes_ociosas=settings.openai_max_conexoes_ociosas,
+)
+
+
 @dataclass
 class ResultadoAnalise:
     score_qualidade: float
@@ -25,6 +84,23 @@ class ResultadoAnalise:
     erros: list[dict]
     sentimento_lead: str
     feedback_ia: str
+    tokens_usados: int = 0
+    hash_conteudo: str | None = None  # ver hash_analise()
+    # Preenchidos quando o resultado veio de uma analise ja gravada (cache)
+    cache_analise_id: int | None = None
+    cache_conversa_id: int | None = None
+
+    def campos_analise(self) -> dict:
+        """Campos gravados em Analise (salvar_analise / salvar_analises_lote)."""
+        return {
+            "score_qualidade": self.score_qualidade,
+            "classificacao": self.classificacao,
+            "erros": self.erros,
+            "sentimento_lead": self.sentimento_lead,
+            "feedback_ia": self.feedback_ia,
+            "tokens_usados": self.tokens_usados,
+            "hash_conteudo": self.hash_conteudo,
+        }
 
 
 def _validar_resultado(data: dict) -> ResultadoAnalise:
@@ -71,13 +147,36 @@ def _validar_resultado(data: dict) -> ResultadoAnalise:
 
 
 def _carregar_prompt_do_banco(empresa_id: int | None = None) -> str:
-    """Busca prompt ativo no banco (empresa first, global fallback)."""
+    """Busca prompt ativo (empresa first, global fallback), via cache de configuracoes."""
+    return get_prompt(empresa_id) or SYSTEM_PROMPT
+
+
+def hash_analise(transcricao: str, system_prompt: str, modelo: str = MODELO) -> str:
+    """Endereco da analise: sha256 da transcricao normalizada + versao do prompt + modelo.
+
+    A versao do prompt e o sha256 do proprio texto: editar o prompt muda o hash.
+    """
+    normalizada = "\n".join(linha.rstrip() for linha in transcricao.strip().splitlines())
+    versao_prompt = hashlib.sha256(system_prompt.encode()).hexdigest()[:16]
+    return hashlib.sha256(f"{modelo}\n{versao_prompt}\n{normalizada}".encode()).hexdigest()
+
+
+def _buscar_no_cache(hash_conteudo: str) -> ResultadoAnalise | None:
     db = SessionLocal()
     try:
-        config = buscar_prompt_ativo(db, empresa_id=empresa_id)
-        if config:
-            return config.conteudo
-        return SYSTEM_PROMPT
+        analise = buscar_analise_por_hash(db, hash_conteudo)
+        if analise is None:
+            return None
+        return ResultadoAnalise(
+            score_qualidade=analise.score_qualidade,
+            classificacao=analise.classificacao,
+            erros=json.loads(analise.erros) if analise.erros else [],
+            sentimento_lead=analise.sentimento_lead,
+            feedback_ia=analise.feedback_ia,
+            hash_conteudo=hash_conteudo,
+            cache_analise_id=analise.id,
+            cache_conversa_id=analise.conversa_id,
+        )
     finally:
         db.close()
 
@@ -86,13 +185,18 @@ async def analisar_conversa(
     mensagens: list[dict],
     system_prompt: str | None = None,
     empresa_id: int | None = None,
+    usar_cache: bool = True,
 ) -> ResultadoAnalise:
     """Envia a conversa para o GPT-4o-mini e retorna a analise estruturada.
 
+    Se ja existe uma analise com o mesmo hash (transcricao, prompt e modelo
+    iguais), devolve o resultado gravado sem chamar a OpenAI.
+
     Args:
         mensagens: lista de dicts com 'remetente', 'conteudo', 'enviada_em'
         system_prompt: prompt customizado (se None, carrega do banco ou usa padrao)
         empresa_id: se informado, carrega prompt e API key da empresa
+        usar_cache: False forca uma nova chamada mesmo com hash conhecido
 
     Raises:
         ValueError: se a conversa estiver vazia
@@ -101,18 +205,27 @@ async def analisar_conversa(
     if not mensagens:
         raise ValueError("Conversa sem mensagens para analisar.")
 
+    # Leituras de configuracao no banco sao bloqueantes: rodam fora do event loop
     if system_prompt is None:
-        system_prompt = _carregar_prompt_do_banco(empresa_id)
+        system_prompt = await asyncio.to_thread(_carregar_prompt_do_banco, empresa_id)
 
     transcricao = formatar_transcricao(mensagens)
+    hash_conteudo = hash_analise(transcricao, system_prompt)
+    if usar_cache:
+        em_cache = await asyncio.to_thread(_buscar_no_cache, hash_conteudo)
+        if em_cache is not None:
+            logger.info(f"Análise reaproveitada do cache (analise {em_cache.cache_analise_id}).")
+            return em_cache
+
     prompt_usuario = TEMPLATE_ANALISE.format(transcricao=transcricao)
 
-    client = AsyncOpenAI(
-        api_key=get_config("openai_api_key", empresa_id=empresa_id),
-        timeout=30.0,
+    api_key = await asyncio.to_thread(get_config, "openai_api_key", empresa_id=empresa_id)
+    client = clientes_openai.obter(
+        api_key, base_url=settings.openai_base_url or None, timeout=settings.openai_timeout_seg
     )
 
     resultado = await _chamar_openai(client, system_prompt, prompt_usuario)
+    resultado.hash_conteudo = hash_conteudo
     return resultado
 
 
@@ -128,7 +241,7 @@ async def _chamar_openai(
     """Chamada OpenAI com retry automático (3 tentativas, backoff exponencial)."""
     try:
         resposta = await client.chat.completions.create(
-            model="gpt-4o-mini",
+            model=MODELO,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": prompt_usuario},
@@ -140,7 +253,10 @@ async def _chamar_openai(
         conteudo = resposta.choices[0].message.content
         data = json.loads(conteudo)
         logger.info("Análise recebida da OpenAI com sucesso.")
-        return _validar_resultado(data)
+        resultado = _validar_resultado(data)
+        if resposta.usage is not None:
+            resultado.tokens_usados = int(resposta.usage.total_tokens)
+        return resultado
 
     except json.JSONDecodeError as e:
         logger.error(f"JSON inválido da OpenAI: {e}")
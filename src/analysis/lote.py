@@ -0,0 +1,228 @@
+"""Analise em lote das conversas de uma empresa num periodo.
+
+As conversas sao processadas em blocos (settings.analise_lote_tamanho): as
+mensagens do bloco vem num unico SELECT, as chamadas a OpenAI rodam em
+paralelo limitadas por um semaforo (settings.analise_lote_concorrencia) e
+as analises do bloco sao gravadas numa unica transacao. O prompt de cada
+empresa e resolvido uma vez por lote, nao por conversa. Conversas cujo
+conteudo ja foi analisado (mesmo hash) saem do cache, sem custo de tokens.
+
+analisar_pendentes() e o modo incremental: so conversas com mensagens
+novas desde a ultima analise, as mais defasadas primeiro, ate um orcamento
+por execucao (o job periodico do scheduler espalha a carga ao longo do dia).
+
+Pela API o lote roda em segundo plano: o endpoint registra uma ExecucaoLote,
+responde 202 com o id e o ResumoLote e consultado depois pelo id.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Awaitable
+from uuid import uuid4
+
+from src.analysis.analyzer import ResultadoAnalise, _carregar_prompt_do_banco, analisar_conversa
+from src.config import settings
+from src.database.connection import AsyncSessionLocal
+from src.database.queries_async import (
+    buscar_mensagens_para_analise,
+    listar_conversas_desatualizadas,
+    listar_conversas_para_analise,
+    salvar_analises_lote,
+)
+
+logger = logging.getLogger(__name__)
+
+_MAX_FALHAS_DETALHADAS = 20
+_MAX_EXECUCOES = 100  # execucoes guardadas em memoria para consulta
+
+
+@dataclass
+class ResumoLote:
+    total: int = 0
+    analisadas: int = 0
+    falhas: int = 0
+    em_cache: int = 0  # analisadas sem chamar a OpenAI (hash ja conhecido)
+    tokens: int = 0
+    segundos: float = 0.0
+    erros: list[dict] = field(default_factory=list)  # primeiras falhas: {conversa_id, erro}
+
+    @property
+    def conversas_por_minuto(self) -> float:
+        return round(self.analisadas / self.segundos * 60, 1) if self.segundos else 0.0
+
+    def para_dict(self) -> dict:
+        return {**asdict(self), "segundos": round(self.segundos, 1), "conversas_por_minuto": self.conversas_por_minuto}
+
+
+@dataclass
+class ExecucaoLote:
+    """Lote disparado pela API e executado em segundo plano."""
+
+    id: str
+    parametros: dict
+    status: str = "na_fila"  # na_fila, rodando, concluida, falhou
+    criada_em: datetime = field(default_factory=datetime.now)
+    concluida_em: datetime | None = None
+    resumo: ResumoLote | None = None
+    erro: str | None = None
+
+    def para_dict(self) -> dict:
+        return {
+            "execucao_id": self.id,
+            "status": self.status,
+            "parametros": self.parametros,
+            "criada_em": str(self.criada_em),
+            "concluida_em": str(self.concluida_em) if self.concluida_em else None,
+            "resumo": self.resumo.para_dict() if self.resumo else None,
+            "erro": self.erro,
+        }
+
+
+# id -> execucao, da mais antiga para a mais recente (por processo)
+execucoes: OrderedDict[str, ExecucaoLote] = OrderedDict()
+
+
+def registrar_execucao(parametros: dict) -> ExecucaoLote:
+    """Cria uma execucao na fila, descartando as mais antigas ja encerradas."""
+    execucao = ExecucaoLote(id=uuid4().hex, parametros=parametros)
+    execucoes[execucao.id] = execucao
+    encerradas = [e.id for e in execucoes.values() if e.status in ("concluida", "falhou")]
+    for id_ in encerradas[:max(0, len(execucoes) - _MAX_EXECUCOES)]:
+        del execucoes[id_]
+    return execucao
+
+
+async def rodar_execucao(execucao: ExecucaoLote, lote: Awaitable[ResumoLote]) -> None:
+    """Executa o lote e registra resumo ou erro na execucao."""
+    execucao.status = "rodando"
+    try:
+        execucao.resumo = await lote
+        execucao.status = "concluida"
+    except Exception as e:
+        execucao.status = "falhou"
+        execucao.erro = str(e)
+        logger.error(f"Analise em lote {execucao.id} falhou: {e}", exc_info=True)
+    finally:
+        execucao.concluida_em = datetime.now()
+
+
+async def _analisar_uma(
+    semaforo: asyncio.Semaphore,
+    mensagens: list[dict],
+    system_prompt: str,
+    empresa_id: int | None,
+    usar_cache: bool,
+) -> ResultadoAnalise:
+    async with semaforo:
+        return await analisar_conversa(
+            mensagens, system_prompt=system_prompt, empresa_id=empresa_id, usar_cache=usar_cache
+        )
+
+
+async def analisar_conversas(
+    conversas: list[tuple[int, int | None]], concorrencia: int | None = None, usar_cache: bool = True
+) -> ResumoLote:
+    """Analisa e grava as conversas (conversa_id, empresa_id) informadas.
+
+    Se o cache devolver a analise da propria conversa (nada mudou desde a
+    ultima), nao grava uma linha repetida.
+    """
+    concorrencia = concorrencia or settings.analise_lote_concorrencia
+    semaforo = asyncio.Semaphore(concorrencia)
+    resumo = ResumoLote(total=len(conversas))
+    prompts: dict[int | None, str] = {}
+    inicio = time.monotonic()
+
+    for pos in range(0, len(conversas), settings.analise_lote_tamanho):
+        bloco = conversas[pos:pos + settings.analise_lote_tamanho]
+        for _, empresa_id in bloco:
+            if empresa_id not in prompts:
+                prompts[empresa_id] = await asyncio.to_thread(_carregar_prompt_do_banco, empresa_id)
+
+        # Sessoes curtas: nenhuma conexao fica presa enquanto a OpenAI responde
+        async with AsyncSessionLocal() as db:
+            mensagens = await buscar_mensagens_para_analise(db, [cid for cid, _ in bloco])
+        com_mensagens = [(cid, eid) for cid, eid in bloco if mensagens[cid]]
+        resumo.total -= len(bloco) - len(com_mensagens)  # conversa sem mensagens nao entra
+
+        resultados = await asyncio.gather(
+            *(_analisar_uma(semaforo, mensagens[cid], prompts[eid], eid, usar_cache) for cid, eid in com_mensagens),
+            return_exceptions=True,
+        )
+
+        novas = []
+        for (conversa_id, _), resultado in zip(com_mensagens, resultados):
+            if isinstance(resultado, BaseException):
+                resumo.falhas += 1
+                if len(resumo.erros) < _MAX_FALHAS_DETALHADAS:
+                    resumo.erros.append({"conversa_id": conversa_id, "erro": str(resultado)})
+                logger.warning(f"Analise em lote: falha na conversa {conversa_id}: {resultado}")
+                continue
+            resumo.analisadas += 1
+            resumo.tokens += resultado.tokens_usados
+            if resultado.cache_analise_id is not None:
+                resumo.em_cache += 1
+                if resultado.cache_conversa_id == conversa_id:
+                    continue
+            novas.append({
+                "conversa_id": conversa_id,
+                **resultado.campos_analise(),
+                "mensagens_analisadas": len(mensagens[conversa_id]),
+            })
+        if novas:
+            async with AsyncSessionLocal() as db:
+                await salvar_analises_lote(db, novas)
+
+    resumo.segundos = time.monotonic() - inicio
+    logger.info(
+        f"Analise em lote: {resumo.analisadas}/{resumo.total} conversa(s) ({resumo.em_cache} do cache), "
+        f"{resumo.falhas} falha(s), {resumo.tokens} tokens em {resumo.segundos:.1f}s ({resumo.conversas_por_minuto}/min)"
+    )
+    return resumo
+
+
+async def analisar_lote(
+    empresa_id: int | None = None,
+    data_inicio: str | None = None,
+    data_fim: str | None = None,
+    concorrencia: int | None = None,
+    usar_cache: bool = True,
+) -> ResumoLote:
+    """Analisa todas as conversas com mensagens no periodo (padrao: hoje).
+
+    Args:
+        empresa_id: se informado, so conversas da empresa
+        data_inicio / data_fim: YYYY-MM-DD, inclusive
+        concorrencia: chamadas simultaneas a OpenAI (padrao: settings.analise_lote_concorrencia)
+        usar_cache: False reanalisa mesmo conversas com hash ja conhecido
+    """
+    data_fim = data_fim or date.today().isoformat()
+    data_inicio = data_inicio or data_fim
+    async with AsyncSessionLocal() as db:
+        conversas = await listar_conversas_para_analise(db, data_inicio, data_fim, empresa_id=empresa_id)
+    return await analisar_conversas(conversas, concorrencia, usar_cache)
+
+
+async def analisar_pendentes(
+    empresa_id: int | None = None,
+    limite: int | None = None,
+    concorrencia: int | None = None,
+) -> ResumoLote:
+    """Analisa as conversas com mensagens novas desde a ultima analise.
+
+    Args:
+        empresa_id: se informado, so conversas da empresa
+        limite: maximo de conversas nesta execucao (padrao: settings.analise_incremental_orcamento)
+        concorrencia: chamadas simultaneas a OpenAI (padrao: settings.analise_lote_concorrencia)
+    """
+    limite = limite or settings.analise_incremental_orcamento
+    mensagem_ate = datetime.now() - timedelta(minutes=settings.analise_incremental_quietude_min)
+    async with AsyncSessionLocal() as db:
+        conversas = await listar_conversas_desatualizadas(
+            db, limite, empresa_id=empresa_id, mensagem_ate=mensagem_ate
+        )
+    return await analisar_conversas(conversas, concorrencia)
@@ -2,13 +2,15 @@
 
 import json
 import logging
+from datetime import date
 
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.analysis.analyzer import analisar_conversa
-from src.database.connection import get_db
-from src.database.queries import (
+from src.analysis.lote import analisar_lote, analisar_pendentes, execucoes, registrar_execucao, rodar_execucao
+from src.database.connection import get_async_db
+from src.database.queries_async import (
     buscar_analises_por_conversa,
     buscar_conversa_com_mensagens,
     salvar_analise,
@@ -19,14 +21,70 @@ logger = logging.getLogger(__name__)
 router = APIRouter(tags=["analise"])
 
 
+# Registradas antes de /analisar/{conversa_id} para "lote"/"pendentes" nao cairem na rota com id
+@router.post("/analisar/lote", status_code=202)
+async def analisar_em_lote(
+    background_tasks: BackgroundTasks,
+    empresa_id: int | None = Query(default=None, description="ID da empresa (padrao: todas)"),
+    data_inicio: date | None = Query(default=None, description="Data inicial YYYY-MM-DD (padrao: data_fim)"),
+    data_fim: date | None = Query(default=None, description="Data final YYYY-MM-DD (padrao: hoje)"),
+    concorrencia: int | None = Query(default=None, ge=1, le=64, description="Chamadas simultaneas a OpenAI"),
+):
+    """Dispara a analise das conversas com mensagens no periodo em segundo plano.
+
+    Responde 202 com o id da execucao; o resumo sai em GET /analisar/lote/{execucao_id}.
+    """
+    if data_inicio and data_fim and data_inicio > data_fim:
+        raise HTTPException(status_code=422, detail="data_inicio deve ser anterior ou igual a data_fim.")
+    inicio = data_inicio.isoformat() if data_inicio else None
+    fim = data_fim.isoformat() if data_fim else None
+    execucao = registrar_execucao(
+        {"empresa_id": empresa_id, "data_inicio": inicio, "data_fim": fim, "concorrencia": concorrencia}
+    )
+    background_tasks.add_task(rodar_execucao, execucao, analisar_lote(empresa_id, inicio, fim, concorrencia))
+    return execucao.para_dict()
+
+
+@router.get("/analisar/lote/{execucao_id}")
+async def status_lote(execucao_id: str):
+    """Status e resumo de uma analise em lote disparada por POST /analisar/lote."""
+    execucao = execucoes.get(execucao_id)
+    if execucao is None:
+        raise HTTPException(status_code=404, detail="Execucao nao encontrada.")
+    return execucao.para_dict()
+
+
+@router.post("/analisar/pendentes", status_code=202)
+async def analisar_conversas_pendentes(
+    background_tasks: BackgroundTasks,
+    empresa_id: int | None = Query(default=None, description="ID da empresa (padrao: todas)"),
+    limite: int | None = Query(default=None, ge=1, description="Maximo de conversas nesta execucao"),
+    concorrencia: int | None = Query(default=None, ge=1, le=64, description="Chamadas simultaneas a OpenAI"),
+):
+    """Dispara em segundo plano a analise das conversas com mensagens novas, mais defasadas primeiro.
+
+    Mesmo contrato de POST /analisar/lote: 202 com o id, resumo em GET /analisar/lote/{execucao_id}.
+    """
+    execucao = registrar_execucao(
+        {"pendentes": True, "empresa_id": empresa_id, "limite": limite, "concorrencia": concorrencia}
+    )
+    background_tasks.add_task(rodar_execucao, execucao, analisar_pendentes(empresa_id, limite, concorrencia))
+    return execucao.para_dict()
+
+
 @router.post("/analisar/{conversa_id}")
 async def analisar(
     conversa_id: int,
     empresa_id: int | None = Query(default=None, description="ID da empresa"),
-    db: Session = Depends(get_db),
+    forcar: bool = Query(default=False, description="Chama a OpenAI mesmo se o conteudo ja foi analisado"),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    """Analisa uma conversa com IA e salva o resultado."""
-    conversa = buscar_conversa_com_mensagens(db, conversa_id)
+    """Analisa uma conversa com IA e salva o resultado.
+
+    Conteudo ja analisado (mesmo hash) reaproveita a analise gravada; se ela
+    for desta mesma conversa, nenhuma linha nova e criada.
+    """
+    conversa = await buscar_conversa_com_mensagens(db, conversa_id)
     if not conversa:
         raise HTTPException(status_code=404, detail="Conversa nao encontrada.")
 
@@ -46,34 +104,36 @@ async def analisar(
     ]
 
     try:
-        resultado = await analisar_conversa(mensagens, empresa_id=eid)
+        resultado = await analisar_conversa(mensagens, empresa_id=eid, usar_cache=not forcar)
     except (ValueError, RuntimeError) as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-    analise = salvar_analise(
-        db=db,
-        conversa_id=conversa_id,
-        score_qualidade=resultado.score_qualidade,
-        classificacao=resultado.classificacao,
-        erros=resultado.erros,
-        sentimento_lead=resultado.sentimento_lead,
-        feedback_ia=resultado.feedback_ia,
-    )
+    if resultado.cache_conversa_id == conversa_id:
+        analise_id = resultado.cache_analise_id
+    else:
+        analise = await salvar_analise(
+            db=db,
+            conversa_id=conversa_id,
+            mensagens_analisadas=len(conversa.mensagens),
+            **resultado.campos_analise(),
+        )
+        analise_id = analise.id
 
     return {
-        "analise_id": analise.id,
-        "score_qualidade": analise.score_qualidade,
-        "classificacao": analise.classificacao,
+        "analise_id": analise_id,
+        "score_qualidade": resultado.score_qualidade,
+        "classificacao": resultado.classificacao,
         "erros": resultado.erros,
-        "sentimento_lead": analise.sentimento_lead,
-        "feedback_ia": analise.feedback_ia,
+        "sentimento_lead": resultado.sentimento_lead,
+        "feedback_ia": resultado.feedback_ia,
+        "em_cache": resultado.cache_analise_id is not None,
     }
 
 
 @router.get("/analises/{conversa_id}")
-async def listar_analises(conversa_id: int, db: Session = Depends(get_db)):
+async def listar_analises(conversa_id: int, db: AsyncSession = Depends(get_async_db)):
     """Lista todas as analises de uma conversa."""
-    analises = buscar_analises_por_conversa(db, conversa_id)
+    analises = await buscar_analises_por_conversa(db, conversa_id)
     if not analises:
         raise HTTPException(
             status_code=404,
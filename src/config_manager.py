@@ -1,8 +1,18 @@
-"""Gerenciador de configuracoes: DB first (empresa → global), .env fallback."""
+"""Gerenciador de configuracoes: DB first (empresa → global), .env fallback.
+
+Leituras do banco (configuracoes e prompts) passam pelo cache versionado de
+src/database/cache.py: sem round trip por chamada, mudancas salvas em
+outro processo aparecem em ate settings.config_cache_verificacao_seg.
+"""
+
+from typing import Callable
+
+from sqlalchemy.orm import Session
 
 from src.config import settings
+from src.database import cache
 from src.database.connection import SessionLocal
-from src.database.queries import buscar_configuracao
+from src.database.queries import buscar_configuracao, buscar_prompt_ativo, versao_configuracoes
 
 # Mapa: chave no banco -> atributo do settings (.env)
 _SETTINGS_MAP = {
@@ -15,6 +25,27 @@ _SETTINGS_MAP = {
 }
 
 
+def _versao_banco():
+    db = SessionLocal()
+    try:
+        return versao_configuracoes(db)
+    finally:
+        db.close()
+
+
+def _do_banco(chave_cache: tuple, buscar: Callable[[Session], str | None]) -> str | None:
+    cache.configuracoes.verificar(_versao_banco)
+    valor = cache.configuracoes.get(chave_cache)
+    if valor is cache.AUSENTE:
+        db = SessionLocal()
+        try:
+            valor = buscar(db)
+        finally:
+            db.close()
+        cache.configuracoes.set(chave_cache, valor)
+    return valor
+
+
 def get_config(
     chave: str, empresa_id: int | None = None, default: str | None = None
 ) -> str | None:
@@ -26,13 +57,13 @@ def get_config(
         default: valor padrao caso nao encontre em nenhum lugar
     """
     # 1. Busca no banco (empresa first, global fallback via query)
-    db = SessionLocal()
-    try:
+    def buscar(db: Session) -> str | None:
         config = buscar_configuracao(db, chave, empresa_id=empresa_id)
-        if config and config.valor:
-            return config.valor
-    finally:
-        db.close()
+        return config.valor if config else None
+
+    valor = _do_banco(("config", empresa_id, chave), buscar)
+    if valor:
+        return valor
 
     # 2. Fallback para settings (.env)
     attr = _SETTINGS_MAP.get(chave)
@@ -43,3 +74,12 @@ def get_config(
 
     # 3. Fallback para default
     return default
+
+
+def get_prompt(empresa_id: int | None = None, nome: str = "prompt_analise") -> str | None:
+    """Conteudo do prompt ativo: empresa → global. None se nenhum foi salvo."""
+    def buscar(db: Session) -> str | None:
+        prompt = buscar_prompt_ativo(db, empresa_id=empresa_id, nome=nome)
+        return prompt.conteudo if prompt else None
+
+    return _do_banco(("prompt", empresa_id, nome), buscar)
@@ -1,7 +1,6 @@
 """Dashboard - Página 1: Visão Geral — multi-tenant."""
 
 import sys
-from collections import defaultdict
 from datetime import date, timedelta
 from pathlib import Path
 
@@ -24,11 +23,12 @@ from src.dashboard.theme import (  # noqa: E402
     COR_SENTIMENTO,
 )
 from src.database.queries import (  # noqa: E402
-    buscar_metricas_periodo,
     listar_vendedores,
     buscar_conversas_periodo,
 )
-from src.metrics.calculator import calcular_metricas  # noqa: E402
+from src.metrics.calculator import metricas_do_dia  # noqa: E402
+from src.metrics.rollups import agregar_periodo  # noqa: E402
+from src.metrics.sketch import percentis_por_vendedor  # noqa: E402
 from src.reports.daily import detectar_alertas  # noqa: E402
 from src.reports.templates import formatar_tempo  # noqa: E402
 
@@ -53,60 +53,28 @@ str_fim = data_fim.strftime("%Y-%m-%d")
 
 # --- Carregar dados (filtrado por empresa) ---
 with get_db() as db:
-    metricas_raw = buscar_metricas_periodo(db, str_inicio, str_fim, empresa_id=empresa_id)
-
-    # Auto-calcular métricas do dia atual se não existem
+    # Métricas de hoje: aplica só as pendências (o scheduler cuida do resto)
     hoje = date.today().isoformat()
-    if not metricas_raw or not any(m.data == hoje for m in metricas_raw):
-        if str_inicio <= hoje <= str_fim:
-            calcular_metricas(db, hoje, empresa_id=empresa_id)
-            metricas_raw = buscar_metricas_periodo(db, str_inicio, str_fim, empresa_id=empresa_id)
-
+    if str_inicio <= hoje <= str_fim:
+        metricas_do_dia(db, hoje, empresa_id=empresa_id)
+    # Rollups semanais/mensais cobrem o miolo do período; só as pontas vêm do diário
+    metricas = agregar_periodo(db, str_inicio, str_fim, empresa_id=empresa_id)
+    percentis = percentis_por_vendedor(
+        (m["vendedor_id"], m["sketch_primeira_resp"], m["sketch_resposta"]) for m in metricas
+    )
     vendedores_raw = listar_vendedores(db, empresa_id=empresa_id)
     conversas_raw = buscar_conversas_periodo(db, str_inicio, str_fim, empresa_id=empresa_id)
 
     nomes = {v.id: v.nome for v in vendedores_raw}
 
-    # Agregar métricas por vendedor (soma do período)
-    por_vendedor = defaultdict(lambda: {
-        "total_atendimentos": 0, "scores": [], "total_mql": 0, "total_sql": 0,
-        "total_conversoes": 0, "leads_sem_resposta": 0, "tempos": [],
-    })
-    for m in metricas_raw:
-        v = por_vendedor[m.vendedor_id]
-        v["total_atendimentos"] += m.total_atendimentos
-        v["total_mql"] += m.total_mql
-        v["total_sql"] += m.total_sql
-        v["total_conversoes"] += m.total_conversoes
-        v["leads_sem_resposta"] += m.leads_sem_resposta
-        if m.score_medio is not None:
-            v["scores"].append(m.score_medio)
-        if m.tempo_medio_resposta_seg is not None:
-            v["tempos"].append(m.tempo_medio_resposta_seg)
-
-    metricas = []
-    for vid, v in por_vendedor.items():
-        metricas.append({
-            "vendedor_id": vid,
-            "total_atendimentos": v["total_atendimentos"],
-            "score_medio": round(sum(v["scores"]) / len(v["scores"]), 1) if v["scores"] else None,
-            "total_mql": v["total_mql"],
-            "total_sql": v["total_sql"],
-            "total_conversoes": v["total_conversoes"],
-            "leads_sem_resposta": v["leads_sem_resposta"],
-            "tempo_medio_resposta_seg": round(sum(v["tempos"]) / len(v["tempos"])) if v["tempos"] else None,
-        })
-
     # Extrair análises para donuts
     sentimentos = []
     classificacoes = []
     for c in conversas_raw:
-        if c.analises:
-            a = max(c.analises, key=lambda x: x.analisada_em)
-            if a.sentimento_lead:
-                sentimentos.append(a.sentimento_lead)
-            if a.classificacao:
-                classificacoes.append(a.classificacao)
+        if c.ultimo_sentimento:
+            sentimentos.append(c.ultimo_sentimento)
+        if c.ultima_classificacao:
+            classificacoes.append(c.ultima_classificacao)
 
 if not metricas:
     render_alerta(
@@ -164,6 +132,22 @@ with c8:
 
 st.markdown("<br>", unsafe_allow_html=True)
 
+# --- Percentis de tempo de resposta (mescla dos sketches diarios) ---
+if percentis["geral"]["resposta"]["amostras"]:
+    st.subheader("Tempo de Resposta (percentis)")
+    linhas_percentis = []
+    grupos = [(nomes.get(p["vendedor_id"], f"ID {p['vendedor_id']}"), p) for p in percentis["vendedores"]]
+    grupos.append(("Equipe", percentis["geral"]))
+    for nome, p in grupos:
+        if not p["resposta"]["amostras"]:
+            continue
+        linha = {"Vendedor": nome}
+        for chave, rotulo in (("primeira_resposta", "1ª resposta"), ("resposta", "Resposta")):
+            for q in ("p50", "p90", "p99"):
+                linha[f"{rotulo} {q}"] = formatar_tempo(p[chave][q])
+        linhas_percentis.append(linha)
+    st.dataframe(linhas_percentis, use_container_width=True, hide_index=True)
+
 # --- Alertas ---
 alertas = detectar_alertas(metricas, nomes)
 if alertas:
@@ -20,6 +20,7 @@ from src.dashboard.theme import (  # noqa: E402
     CORES,
 )
 from src.database.queries import buscar_metricas_vendedor, buscar_metricas_periodo, listar_vendedores, criar_vendedor, desativar_vendedor
+from src.metrics.rollups import serie_periodo
 from src.reports.templates import formatar_tempo
 
 # --- Tema e autenticação ---
@@ -78,26 +79,37 @@ with col1:
     vendedor_nome = st.selectbox("Vendedor", list(vendedores.values()))
     vendedor_id = [k for k, v in vendedores.items() if v == vendedor_nome][0]
 with col2:
-    periodo = st.selectbox("Período", ["7 dias", "15 dias", "30 dias"])
+    periodo = st.selectbox("Período", ["7 dias", "15 dias", "30 dias", "90 dias", "365 dias"])
     limit = int(periodo.split()[0])
 
+# Até 30 dias: um ponto por dia. Acima disso: um ponto por semana/mês (rollups)
+GRANULARIDADE_PERIODO = {90: "semana", 365: "mes"}
+granularidade = GRANULARIDADE_PERIODO.get(limit)
+data_inicio_periodo = (date.today() - timedelta(days=limit - 1)).strftime("%Y-%m-%d")
+data_fim_periodo = date.today().strftime("%Y-%m-%d")
+
 # --- Carregar métricas ---
 with get_db() as db:
-    metricas_raw = buscar_metricas_vendedor(db, vendedor_id, limit=limit)
-    metricas = [
-        {
-            "data": m.data,
-            "score_medio": m.score_medio,
-            "total_atendimentos": m.total_atendimentos,
-            "tempo_primeira_resp_seg": m.tempo_primeira_resp_seg,
-            "tempo_medio_resposta_seg": m.tempo_medio_resposta_seg,
-            "total_mql": m.total_mql,
-            "total_sql": m.total_sql,
-            "total_conversoes": m.total_conversoes,
-            "leads_sem_resposta": m.leads_sem_resposta,
-        }
-        for m in metricas_raw
-    ]
+    if granularidade:
+        metricas = serie_periodo(
+            db, granularidade, data_inicio_periodo, data_fim_periodo, vendedor_id=vendedor_id,
+        )
+    else:
+        metricas_raw = buscar_metricas_vendedor(db, vendedor_id, limit=limit)
+        metricas = [
+            {
+                "data": m.data,
+                "score_medio": m.score_medio,
+                "total_atendimentos": m.total_atendimentos,
+                "tempo_primeira_resp_seg": m.tempo_primeira_resp_seg,
+                "tempo_medio_resposta_seg": m.tempo_medio_resposta_seg,
+                "total_mql": m.total_mql,
+                "total_sql": m.total_sql,
+                "total_conversoes": m.total_conversoes,
+                "leads_sem_resposta": m.leads_sem_resposta,
+            }
+            for m in metricas_raw
+        ]
 
 if not metricas:
     st.info(f"Sem métricas para {vendedor_nome} nos últimos {limit} dias.")
@@ -108,20 +120,24 @@ metricas.sort(key=lambda m: m["data"])
 datas = [m["data"] for m in metricas]
 
 # --- Carregar média da equipe para comparação ---
-data_inicio_periodo = (date.today() - timedelta(days=limit - 1)).strftime("%Y-%m-%d")
-data_fim_periodo = date.today().strftime("%Y-%m-%d")
 with get_db() as db:
-    todas_metricas = buscar_metricas_periodo(db, data_inicio_periodo, data_fim_periodo, empresa_id=empresa_id)
-
-# Agregar média da equipe por dia
-media_equipe_por_dia = defaultdict(list)
-for m in todas_metricas:
-    if m.score_medio is not None:
-        media_equipe_por_dia[m.data].append(m.score_medio)
-media_equipe = [
-    round(sum(media_equipe_por_dia[d]) / len(media_equipe_por_dia[d]), 1) if d in media_equipe_por_dia else None
-    for d in datas
-]
+    if granularidade:
+        media_equipe_por_data = {
+            p["data"]: p["score_medio"]
+            for p in serie_periodo(db, granularidade, data_inicio_periodo, data_fim_periodo, empresa_id=empresa_id)
+        }
+    else:
+        todas_metricas = buscar_metricas_periodo(db, data_inicio_periodo, data_fim_periodo, empresa_id=empresa_id)
+
+        # Agregar média da equipe por dia
+        media_equipe_por_dia = defaultdict(list)
+        for m in todas_metricas:
+            if m.score_medio is not None:
+                media_equipe_por_dia[m.data].append(m.score_medio)
+        media_equipe_por_data = {
+            d: round(sum(scores) / len(scores), 1) for d, scores in media_equipe_por_dia.items()
+        }
+media_equipe = [media_equipe_por_data.get(d) for d in datas]
 
 # --- Gráfico: Score ao longo do tempo + média da equipe ---
 st.subheader("Score de Qualidade")
@@ -218,7 +234,7 @@ fig_pipeline.update_layout(
 st.plotly_chart(fig_pipeline, use_container_width=True)
 
 # --- Tabela detalhada ---
-st.subheader("Detalhamento Diário")
+st.subheader({"semana": "Detalhamento Semanal", "mes": "Detalhamento Mensal"}.get(granularidade, "Detalhamento Diário"))
 
 tabela = []
 for m in metricas:
@@ -8,7 +8,6 @@ sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent.parent))
 import streamlit as st  # noqa: E402
 import plotly.graph_objects as go  # noqa: E402
 import pandas as pd  # noqa: E402
-from collections import defaultdict  # noqa: E402
 from datetime import date, timedelta  # noqa: E402
 
 from src.dashboard.utils import get_db, score_cor, validar_token_empresa  # noqa: E402
@@ -20,7 +19,8 @@ from src.dashboard.theme import (  # noqa: E402
     criar_gauge,
     CORES,
 )
-from src.database.queries import buscar_metricas_periodo, listar_vendedores
+from src.database.queries import listar_vendedores
+from src.metrics.rollups import agregar_periodo
 from src.reports.templates import formatar_tempo
 
 # --- Tema e autenticação ---
@@ -44,44 +44,12 @@ str_fim = data_fim.strftime("%Y-%m-%d")
 
 # --- Carregar dados (filtrado por empresa) ---
 with get_db() as db:
-    metricas_raw = buscar_metricas_periodo(db, str_inicio, str_fim, empresa_id=empresa_id)
+    # Soma/média do período por vendedor, lida dos rollups semanais/mensais
+    metricas = agregar_periodo(db, str_inicio, str_fim, empresa_id=empresa_id)
     vendedores_raw = listar_vendedores(db, empresa_id=empresa_id)
 
     nomes = {v.id: v.nome for v in vendedores_raw}
 
-    # Agregar métricas por vendedor (soma/média do período)
-    por_vendedor = defaultdict(lambda: {
-        "total_atendimentos": 0, "scores": [], "total_mql": 0, "total_sql": 0,
-        "total_conversoes": 0, "leads_sem_resposta": 0, "tempos_primeira": [], "tempos_media": [],
-    })
-    for m in metricas_raw:
-        v = por_vendedor[m.vendedor_id]
-        v["total_atendimentos"] += m.total_atendimentos
-        v["total_mql"] += m.total_mql
-        v["total_sql"] += m.total_sql
-        v["total_conversoes"] += m.total_conversoes
-        v["leads_sem_resposta"] += m.leads_sem_resposta
-        if m.score_medio is not None:
-            v["scores"].append(m.score_medio)
-        if m.tempo_primeira_resp_seg is not None:
-            v["tempos_primeira"].append(m.tempo_primeira_resp_seg)
-        if m.tempo_medio_resposta_seg is not None:
-            v["tempos_media"].append(m.tempo_medio_resposta_seg)
-
-    metricas = []
-    for vid, v in por_vendedor.items():
-        metricas.append({
-            "vendedor_id": vid,
-            "total_atendimentos": v["total_atendimentos"],
-            "score_medio": round(sum(v["scores"]) / len(v["scores"]), 1) if v["scores"] else None,
-            "total_mql": v["total_mql"],
-            "total_sql": v["total_sql"],
-            "total_conversoes": v["total_conversoes"],
-            "leads_sem_resposta": v["leads_sem_resposta"],
-            "tempo_primeira_resp_seg": round(sum(v["tempos_primeira"]) / len(v["tempos_primeira"])) if v["tempos_primeira"] else None,
-            "tempo_medio_resposta_seg": round(sum(v["tempos_media"]) / len(v["tempos_media"])) if v["tempos_media"] else None,
-        })
-
 if not metricas:
     st.info(f"Nenhuma métrica encontrada para o período {data_inicio.strftime('%d/%m/%Y')} — {data_fim.strftime('%d/%m/%Y')}.")
     st.stop()
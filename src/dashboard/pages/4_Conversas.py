@@ -66,8 +66,8 @@ with get_db() as db:
     conversas = []
     for c in conversas_raw:
         analise_mais_recente = None
-        if c.analises:
-            a = max(c.analises, key=lambda x: x.analisada_em)
+        if c.ultima_analise:
+            a = c.ultima_analise
             erros = []
             if a.erros:
                 try:
@@ -24,9 +24,11 @@ from src.dashboard.theme import (  # noqa: E402
 from src.database.queries import (  # noqa: E402
     buscar_metricas_periodo,
     buscar_analises_periodo,
-    buscar_mensagens_periodo,
+    buscar_metricas_horarias_periodo,
     listar_vendedores,
 )
+from src.config import settings  # noqa: E402
+from src.reports.templates import formatar_tempo  # noqa: E402
 
 # --- Tema e autenticação ---
 aplicar_tema()
@@ -46,7 +48,7 @@ str_fim = data_fim.strftime("%Y-%m-%d")
 with get_db() as db:
     metricas_raw = buscar_metricas_periodo(db, str_inicio, str_fim, empresa_id=empresa_id)
     analises_raw = buscar_analises_periodo(db, str_inicio, str_fim, empresa_id=empresa_id)
-    mensagens_raw = buscar_mensagens_periodo(db, str_inicio, str_fim, empresa_id=empresa_id)
+    horarias = buscar_metricas_horarias_periodo(db, str_inicio, str_fim, empresa_id=empresa_id)
     vendedores_raw = listar_vendedores(db, empresa_id=empresa_id)
     nomes = {v.id: v.nome for v in vendedores_raw}
 
@@ -125,10 +127,10 @@ else:
 # =============================================================================
 st.subheader("Horário de Pico")
 
-if mensagens_raw:
+if horarias:
     contagem_hora = [0] * 24
-    for msg in mensagens_raw:
-        contagem_hora[msg.enviada_em.hour] += 1
+    for h in horarias:
+        contagem_hora[h["hora"]] = h["msgs_lead"] + h["msgs_vendedor"]
 
     # Pico = horas acima da média (ignora horas zeradas)
     valores_positivos = [c for c in contagem_hora if c > 0]
@@ -155,6 +157,35 @@ if mensagens_raw:
         showlegend=False,
     )
     st.plotly_chart(fig_hora, use_container_width=True)
+
+    # SLA por hora da resposta
+    com_resposta = [h for h in horarias if h["respostas"]]
+    if com_resposta:
+        st.subheader(f"SLA de Resposta por Hora (até {formatar_tempo(settings.metricas_sla_resposta_seg)})")
+        horas = [h["hora"] for h in com_resposta]
+        pct_sla = [round(h["respostas_no_sla"] / h["respostas"] * 100, 1) for h in com_resposta]
+        tempo_medio = [round(h["soma_resposta_seg"] / h["respostas"]) for h in com_resposta]
+
+        fig_sla = go.Figure(
+            go.Bar(
+                x=horas,
+                y=pct_sla,
+                marker_color=[CORES["sucesso"] if p >= 80 else CORES["perigo"] for p in pct_sla],
+                text=[f"{p}%" for p in pct_sla],
+                textposition="auto",
+                customdata=[formatar_tempo(t) for t in tempo_medio],
+                hovertemplate="Hora %{x}: %{y}% no SLA (média %{customdata})<extra></extra>",
+            )
+        )
+        fig_sla.update_layout(
+            xaxis_title="Hora da Resposta",
+            yaxis_title="% no SLA",
+            xaxis=dict(tickmode="linear", dtick=1),
+            yaxis_range=[0, 100],
+            height=350,
+            showlegend=False,
+        )
+        st.plotly_chart(fig_sla, use_container_width=True)
 else:
     render_alerta("Sem mensagens no período para análise de horário.", "info")
 
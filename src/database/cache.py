@@ -0,0 +1,194 @@
+"""Caches em memoria: roteamento do webhook (instancia -> empresa -> vendedor -> conversa)
+e configuracoes/prompts.
+
+Cada processo tem o seu proprio cache. Invalidacoes explicitas so alcancam o
+processo que fez a escrita (ex: o dashboard Streamlit roda em outro processo),
+entao o TTL e o limite de tempo para que mudancas feitas fora da API sejam vistas.
+Configuracoes e prompts, que mudam raramente, usam uma checagem de versao no
+banco em vez de TTL.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+from src.config import settings
+
+# Sentinela para diferenciar "nao esta no cache" de "cacheado como None"
+AUSENTE = object()
+
+
+class CacheTTL:
+    """Dicionario com expiracao por TTL e limite de tamanho. Thread-safe."""
+
+    def __init__(self, ttl_seg: float, max_itens: int = 10_000):
+        self.ttl_seg = ttl_seg
+        self.max_itens = max_itens
+        self._dados: dict[Hashable, tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, chave: Hashable) -> Any:
+        """Retorna o valor cacheado (pode ser None) ou AUSENTE."""
+        with self._lock:
+            item = self._dados.get(chave)
+            if item is None:
+                return AUSENTE
+            expira_em, valor = item
+            if expira_em < time.monotonic():
+                del self._dados[chave]
+                return AUSENTE
+            return valor
+
+    def set(self, chave: Hashable, valor: Any) -> None:
+        with self._lock:
+            if len(self._dados) >= self.max_itens and chave not in self._dados:
+                self._remover_expirados()
+                if len(self._dados) >= self.max_itens:
+                    # Descarta o item mais antigo (ordem de insercao)
+                    self._dados.pop(next(iter(self._dados)))
+            self._dados[chave] = (time.monotonic() + self.ttl_seg, valor)
+
+    def remover(self, chave: Hashable) -> None:
+        with self._lock:
+            self._dados.pop(chave, None)
+
+    def remover_onde(self, predicado) -> None:
+        """Remove todas as chaves para as quais predicado(chave) e verdadeiro."""
+        with self._lock:
+            for chave in [c for c in self._dados if predicado(c)]:
+                del self._dados[chave]
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._dados.clear()
+
+    def __len__(self) -> int:
+        return len(self._dados)
+
+    def _remover_expirados(self) -> None:
+        agora = time.monotonic()
+        for chave in [c for c, (exp, _) in self._dados.items() if exp < agora]:
+            del self._dados[chave]
+
+
+class CacheVersionado:
+    """Dicionario sem TTL, esvaziado quando a versao dos dados no banco muda. Thread-safe.
+
+    verificar() le a versao (uma query barata) no maximo a cada
+    `verificacao_seg`: escritas de outro processo aparecem em segundos.
+    Escritas do proprio processo chamam limpar() e valem na hora.
+    """
+
+    def __init__(self, verificacao_seg: float):
+        self.verificacao_seg = verificacao_seg
+        self._dados: dict[Hashable, Any] = {}
+        self._versao: Any = AUSENTE
+        self._verificado_em = float("-inf")
+        self._lock = threading.Lock()
+
+    def verificar(self, ler_versao: Callable[[], Hashable]) -> None:
+        with self._lock:
+            if time.monotonic() - self._verificado_em < self.verificacao_seg:
+                return
+            self._verificado_em = time.monotonic()
+        versao = ler_versao()
+        with self._lock:
+            if versao != self._versao:
+                self._dados.clear()
+                self._versao = versao
+
+    def get(self, chave: Hashable) -> Any:
+        """Retorna o valor cacheado (pode ser None) ou AUSENTE."""
+        with self._lock:
+            return self._dados.get(chave, AUSENTE)
+
+    def set(self, chave: Hashable, valor: Any) -> None:
+        with self._lock:
+            self._dados[chave] = valor
+
+    def limpar(self) -> None:
+        # Mantem a versao conhecida: a proxima checagem ve a escrita e limpa de novo
+        # (descarta valor antigo gravado por uma leitura concorrente)
+        with self._lock:
+            self._dados.clear()
+
+    def __len__(self) -> int:
+        return len(self._dados)
+
+
+class LRUIds:
+    """Conjunto limitado dos IDs vistos mais recentemente. Thread-safe."""
+
+    def __init__(self, max_itens: int):
+        self.max_itens = max_itens
+        self._ids: OrderedDict[Hashable, None] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def contem(self, chave: Hashable) -> bool:
+        with self._lock:
+            if chave in self._ids:
+                self._ids.move_to_end(chave)
+                return True
+            return False
+
+    def adicionar(self, chave: Hashable) -> None:
+        with self._lock:
+            self._ids[chave] = None
+            self._ids.move_to_end(chave)
+            if len(self._ids) > self.max_itens:
+                self._ids.popitem(last=False)
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._ids.clear()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+# instance_name -> empresa_id (None = instancia nao registrada)
+instancias = CacheTTL(settings.routing_cache_ttl_seg)
+
+# (empresa_id, chave_telefone) -> vendedor_id (None = nenhum vendedor com esse telefone)
+vendedores = CacheTTL(settings.routing_cache_ttl_seg)
+
+# (empresa_id, chave_telefone do lead) -> vendedor_id da conversa existente com o lead.
+# So acertos: a conversa de um lead novo e criada logo depois da consulta
+leads = CacheTTL(settings.routing_cache_ttl_seg, max_itens=100_000)
+
+# empresa_id -> primeiro vendedor ativo (None = empresa sem vendedor ativo)
+vendedor_padrao = CacheTTL(settings.routing_cache_ttl_seg)
+
+# (vendedor_id, lead_telefone) -> (conversa_id, tem_lead_nome)
+conversas = CacheTTL(settings.routing_cache_ttl_seg, max_itens=100_000)
+
+# (instance_name, message_id) das mensagens ja salvas — descarta retries sem ir ao banco
+mensagens_recentes = LRUIds(settings.dedupe_lru_max)
+
+# ("config", empresa_id, chave) -> valor e ("prompt", empresa_id, nome) -> conteudo (None = nao cadastrado)
+configuracoes = CacheVersionado(settings.config_cache_verificacao_seg)
+
+
+def invalidar_instancia(nome_instancia: str) -> None:
+    instancias.remover(nome_instancia)
+
+
+def invalidar_vendedores_empresa(empresa_id: int | None) -> None:
+    vendedores.remover_onde(lambda chave: chave[0] == empresa_id)
+    leads.remover_onde(lambda chave: chave[0] == empresa_id)
+    vendedor_padrao.remover(empresa_id)
+
+
+def invalidar_configuracoes() -> None:
+    configuracoes.limpar()
+
+
+def invalidar_tudo() -> None:
+    instancias.limpar()
+    vendedores.limpar()
+    leads.limpar()
+    vendedor_padrao.limpar()
+    conversas.limpar()
+    mensagens_recentes.limpar()
+    configuracoes.limpar()
@@ -1,5 +1,8 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
+from sqlalchemy.pool import NullPool
 
 from src.config import settings
 
@@ -15,6 +18,42 @@ engine = create_engine(
 SessionLocal = sessionmaker(bind=engine)
 
 
+# Drivers async equivalentes aos drivers sync da DATABASE_URL
+_DRIVERS_ASYNC = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def url_async(database_url: str) -> str:
+    """Converte a DATABASE_URL sync (psycopg2/pysqlite) para o driver async (asyncpg/aiosqlite)."""
+    url = make_url(database_url)
+    driver = _DRIVERS_ASYNC.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f"Banco sem driver async configurado: {url.get_backend_name()}")
+    return url.set(drivername=driver).render_as_string(hide_password=False)
+
+
+def _criar_async_engine():
+    url = url_async(settings.database_url)
+    if url.startswith("sqlite"):
+        # Conexoes SQLite sao baratas; sem pool, nenhuma conexao fica presa a um event loop
+        return create_async_engine(url, poolclass=NullPool, echo=False)
+    return create_async_engine(
+        url,
+        pool_size=5,
+        max_overflow=10,
+        pool_pre_ping=True,
+        echo=False,
+    )
+
+
+async_engine = _criar_async_engine()
+
+# expire_on_commit=False: objetos continuam legiveis apos o commit sem novo SELECT (lazy IO nao e permitido)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
+
 class Base(DeclarativeBase):
     pass
 
@@ -28,6 +67,12 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    """Dependency FastAPI com sessao async. Usa com: db: AsyncSession = Depends(get_async_db)"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 def criar_tabelas():
     """Cria todas as tabelas no banco de dados."""
     import src.database.models  # noqa: F401 - garante que os modelos sao registrados
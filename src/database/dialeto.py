@@ -0,0 +1,24 @@
+"""Construcoes SQL que variam entre PostgreSQL (producao) e SQLite (local/testes)."""
+
+from sqlalchemy import Integer, cast, extract, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+
+def insert_para(db: Session):
+    """Retorna o `insert` do dialeto da sessao (com suporte a ON CONFLICT)."""
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql.insert
+    return sqlite.insert
+
+
+def segundos_entre(db: Session, inicio, fim):
+    """Segundos inteiros de `inicio` ate `fim` (truncado, como int(timedelta.total_seconds())).
+
+    Valido para fim >= inicio.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        return cast(func.floor(extract("epoch", fim - inicio)), Integer)
+    # julianday em ms arredondado evita erro de ponto flutuante (60s virar 59.999s)
+    milissegundos = cast(func.round((func.julianday(fim) - func.julianday(inicio)) * 86_400_000), Integer)
+    return milissegundos // 1000
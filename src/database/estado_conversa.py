@@ -0,0 +1,133 @@
+"""Estado incremental da conversa, mantido na ingestao.
+
+Cada mensagem salva atualiza as colunas de estado de `Conversa` no mesmo
+UPDATE que marca `atualizada_em`: primeira/ultima mensagem de cada lado,
+contagens, inicio do turno do lead ainda sem resposta e soma/quantidade
+dos tempos de resposta. Mesma regra de calcular_tempos_resposta(): o tempo
+conta da primeira mensagem do lead no turno ate a resposta do vendedor.
+
+Leituras como "leads aguardando resposta" usam essas colunas (indexadas)
+sem varrer `mensagens`. Contagens e primeira/ultima valem em qualquer
+ordem; turno pendente e tempos de resposta assumem mensagens chegando em
+ordem cronologica (ex: historico antigo importado depois pede
+`recalcular_estado()`, que refaz tudo a partir das mensagens).
+"""
+
+from datetime import datetime
+
+from sqlalchemy import DateTime, String, and_, bindparam, case, false, null, or_, true, update
+from sqlalchemy.orm import Session
+
+from src.database.dialeto import segundos_entre
+from src.database.models import Conversa, Mensagem
+
+
+def instrucao_atualizar_estado(db: Session):
+    """UPDATE do estado da conversa para uma mensagem nova.
+
+    Parametros (bind): conversa_id, remetente, enviada_em. Serve para uma
+    mensagem (execute com dict) ou varias (executemany, aplicadas em ordem).
+    """
+    c = Conversa.__table__.c
+    conversa_id = bindparam("conversa_id")
+    remetente = bindparam("remetente", type_=String)
+    enviada_em = bindparam("enviada_em", type_=DateTime)
+
+    e_lead = remetente == "lead"
+    e_vendedor = remetente == "vendedor"
+    responde = and_(
+        e_vendedor, c.lead_pendente_desde.isnot(None), c.lead_pendente_desde <= enviada_em
+    )
+    delta = segundos_entre(db, c.lead_pendente_desde, enviada_em)
+
+    def primeira(condicao, coluna):
+        return case(
+            (and_(condicao, or_(coluna.is_(None), enviada_em < coluna)), enviada_em), else_=coluna
+        )
+
+    def ultima(condicao, coluna):
+        return case(
+            (and_(condicao, or_(coluna.is_(None), enviada_em > coluna)), enviada_em), else_=coluna
+        )
+
+    return (
+        update(Conversa.__table__)
+        .where(c.id == conversa_id)
+        .values(
+            total_msgs_lead=c.total_msgs_lead + case((e_lead, 1), else_=0),
+            total_msgs_vendedor=c.total_msgs_vendedor + case((e_vendedor, 1), else_=0),
+            primeira_msg_lead_em=primeira(e_lead, c.primeira_msg_lead_em),
+            ultima_msg_lead_em=ultima(e_lead, c.ultima_msg_lead_em),
+            primeira_msg_vendedor_em=primeira(e_vendedor, c.primeira_msg_vendedor_em),
+            ultima_msg_vendedor_em=ultima(e_vendedor, c.ultima_msg_vendedor_em),
+            lead_pendente_desde=case(
+                (and_(e_lead, c.lead_pendente_desde.is_(None)), enviada_em),
+                (responde, null()),
+                else_=c.lead_pendente_desde,
+            ),
+            aguardando_resposta=case(
+                (e_lead, true()), (responde, false()), else_=c.aguardando_resposta
+            ),
+            primeira_resposta_seg=case(
+                (and_(responde, c.primeira_resposta_seg.is_(None)), delta),
+                else_=c.primeira_resposta_seg,
+            ),
+            soma_respostas_seg=c.soma_respostas_seg + case((responde, delta), else_=0),
+            qtd_respostas=c.qtd_respostas + case((responde, 1), else_=0),
+        )
+    )
+
+
+def calcular_estado(mensagens: list[tuple[str, datetime]]) -> dict:
+    """Estado da conversa a partir das mensagens (remetente, enviada_em) em ordem."""
+    estado = {
+        "total_msgs_lead": 0,
+        "total_msgs_vendedor": 0,
+        "primeira_msg_lead_em": None,
+        "ultima_msg_lead_em": None,
+        "primeira_msg_vendedor_em": None,
+        "ultima_msg_vendedor_em": None,
+        "lead_pendente_desde": None,
+        "aguardando_resposta": False,
+        "primeira_resposta_seg": None,
+        "soma_respostas_seg": 0,
+        "qtd_respostas": 0,
+    }
+    for remetente, enviada_em in mensagens:
+        if remetente not in ("lead", "vendedor"):
+            continue
+        estado[f"total_msgs_{remetente}"] += 1
+        if estado[f"primeira_msg_{remetente}_em"] is None:
+            estado[f"primeira_msg_{remetente}_em"] = enviada_em
+        estado[f"ultima_msg_{remetente}_em"] = enviada_em
+
+        if remetente == "lead":
+            if estado["lead_pendente_desde"] is None:
+                estado["lead_pendente_desde"] = enviada_em
+            estado["aguardando_resposta"] = True
+        elif estado["lead_pendente_desde"] is not None:
+            delta = int((enviada_em - estado["lead_pendente_desde"]).total_seconds())
+            if estado["primeira_resposta_seg"] is None:
+                estado["primeira_resposta_seg"] = delta
+            estado["soma_respostas_seg"] += delta
+            estado["qtd_respostas"] += 1
+            estado["lead_pendente_desde"] = None
+            estado["aguardando_resposta"] = False
+    return estado
+
+
+def recalcular_estado(db: Session, conversa_ids: list[int]) -> None:
+    """Refaz o estado das conversas a partir das mensagens. Nao faz commit."""
+    linhas = (
+        db.query(Mensagem.conversa_id, Mensagem.remetente, Mensagem.enviada_em)
+        .filter(Mensagem.conversa_id.in_(conversa_ids))
+        .order_by(Mensagem.conversa_id, Mensagem.enviada_em, Mensagem.id)
+        .all()
+    )
+    por_conversa: dict[int, list[tuple[str, datetime]]] = {id_: [] for id_ in conversa_ids}
+    for conversa_id, remetente, enviada_em in linhas:
+        por_conversa[conversa_id].append((remetente, enviada_em))
+    db.bulk_update_mappings(Conversa, [
+        {"id": conversa_id, **calcular_estado(mensagens)}
+        for conversa_id, mensagens in por_conversa.items()
+    ])
@@ -0,0 +1,402 @@
+"""Migracoes versionadas do schema.
+
+`criar_tabelas()` (create_all) so cria tabelas que nao existem: bancos ja em
+producao nunca ganham colunas ou indices novos. Cada migracao aqui tem uma
+versao; as aplicadas ficam registradas em `schema_versao` e as pendentes
+rodam em ordem no startup da API ou pela CLI (scripts/atualizar_schema.py).
+
+Regras para novas migracoes:
+- Sempre idempotentes (IF NOT EXISTS / checagem pelo inspector), pois num
+  banco novo o create_all ja criou o que os modelos declaram.
+- Nunca alterar uma migracao ja publicada: criar uma nova versao.
+- No PostgreSQL os indices sao criados com CONCURRENTLY (sem bloquear escritas).
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Callable
+
+from sqlalchemy import Engine, func, inspect, text
+from sqlalchemy.orm import Session
+
+from src.database.connection import engine as engine_padrao
+from src.database.estado_conversa import recalcular_estado
+from src.database.models import (
+    Analise,
+    Conversa,
+    InstanciaEvolution,
+    Mensagem,
+    MetricaHoraria,
+    MetricaPendente,
+    MetricaPeriodo,
+    SchemaVersao,
+    Vendedor,
+)
+from src.database.queries import recalcular_ultima_analise
+from src.whatsapp.telefone import chave_telefone, normalizar_e164
+
+logger = logging.getLogger(__name__)
+
+# Chave do advisory lock (PostgreSQL): um unico processo migra por vez
+_LOCK_MIGRACOES = 7_311_024
+
+
+@dataclass(frozen=True)
+class Migracao:
+    versao: int
+    descricao: str
+    aplicar: Callable[[Engine], None]
+
+
+# === Operacoes reutilizaveis ===
+
+
+def adicionar_coluna(engine: Engine, tabela: str, coluna: str, tipo: str) -> bool:
+    """ALTER TABLE ADD COLUMN se a coluna ainda nao existir."""
+    existentes = {c["name"] for c in inspect(engine).get_columns(tabela)}
+    if coluna in existentes:
+        return False
+    with engine.begin() as conn:
+        conn.execute(text(f'ALTER TABLE {tabela} ADD COLUMN "{coluna}" {tipo}'))
+    logger.info(f"Migracao: coluna {tabela}.{coluna} adicionada")
+    return True
+
+
+def criar_indice(
+    engine: Engine, nome: str, tabela: str, colunas: list[str], unico: bool = False
+) -> None:
+    """CREATE [UNIQUE] INDEX IF NOT EXISTS. No PostgreSQL usa CONCURRENTLY.
+
+    CONCURRENTLY nao roda dentro de transacao (conexao em AUTOCOMMIT) e, se
+    falhar no meio, deixa um indice INVALID com o nome — removido antes de
+    tentar de novo. No SQLite constraints unicas do create_all ficam dentro
+    do CREATE TABLE (sem indice com o nome), por isso a checagem pelo inspector.
+    """
+    unique = "UNIQUE " if unico else ""
+    lista = ", ".join(colunas)
+    if engine.dialect.name == "postgresql":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            invalido = conn.execute(
+                text(
+                    "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                    "WHERE c.relname = :nome AND NOT i.indisvalid"
+                ),
+                {"nome": nome},
+            ).first()
+            if invalido:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {nome}"))
+            conn.execute(
+                text(f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {nome} ON {tabela} ({lista})")
+            )
+    else:
+        inspetor = inspect(engine)
+        existentes = {i["name"] for i in inspetor.get_indexes(tabela)}
+        existentes |= {u["name"] for u in inspetor.get_unique_constraints(tabela)}
+        if nome in existentes:
+            return
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE {unique}INDEX {nome} ON {tabela} ({lista})"))
+
+
+def _enfileirar_recalculo(engine: Engine, condicao: str = "1 = 1") -> None:
+    """Marca em metricas_pendentes as metricas diarias (alias m) que atendem a condicao.
+
+    O job de recalculo incremental refaz esses dias aos poucos, fora do startup.
+    """
+    with engine.begin() as conn:
+        marcadas = conn.execute(text(
+            "INSERT INTO metricas_pendentes (vendedor_id, data, marcada_em) "
+            "SELECT m.vendedor_id, m.data, CURRENT_TIMESTAMP FROM metricas_diarias m "
+            f"WHERE {condicao} "
+            "AND NOT EXISTS (SELECT 1 FROM metricas_pendentes p "
+            "WHERE p.vendedor_id = m.vendedor_id AND p.data = m.data)"
+        )).rowcount
+    if marcadas:
+        logger.info(f"Migracao: {marcadas} metrica(s) diaria(s) marcadas para recalculo")
+
+
+def _backfill_estado_conversas(engine: Engine, lote: int = 500) -> None:
+    """Preenche o estado incremental das conversas a partir das mensagens."""
+    with Session(engine) as db:
+        ids = [id_ for (id_,) in db.query(Conversa.id).order_by(Conversa.id)]
+        for i in range(0, len(ids), lote):
+            recalcular_estado(db, ids[i:i + lote])
+            db.commit()
+    if ids:
+        logger.info(f"Migracao: estado de {len(ids)} conversa(s) preenchido")
+
+
+def _backfill_telefones(engine: Engine) -> None:
+    """Preenche as colunas normalizadas de telefone onde ainda estao vazias."""
+    alvos = [
+        (Vendedor, "telefone", "telefone_e164", "telefone_chave"),
+        (InstanciaEvolution, "telefone", "telefone_e164", "telefone_chave"),
+        (Conversa, "lead_telefone", "lead_telefone_e164", "lead_telefone_chave"),
+    ]
+    with Session(engine) as db:
+        for modelo, origem, col_e164, col_chave in alvos:
+            coluna_origem = getattr(modelo, origem)
+            linhas = (
+                db.query(modelo.id, coluna_origem)
+                .filter(getattr(modelo, col_chave).is_(None), coluna_origem.isnot(None))
+                .all()
+            )
+            if not linhas:
+                continue
+            db.bulk_update_mappings(modelo, [
+                {"id": id_, col_e164: normalizar_e164(tel), col_chave: chave_telefone(tel)}
+                for id_, tel in linhas
+            ])
+            db.commit()
+            logger.info(f"Migracao: {len(linhas)} telefone(s) normalizados em {modelo.__tablename__}")
+
+
+def _deduplicar_conversas(engine: Engine) -> None:
+    """Mantem a conversa mais antiga por (vendedor_id, lead_telefone).
+
+    Mensagens e analises das duplicadas (criadas por webhooks concorrentes
+    antes de uq_conversas_vendedor_lead) sao movidas para ela.
+    """
+    with Session(engine) as db:
+        grupos = (
+            db.query(Conversa.vendedor_id, Conversa.lead_telefone, func.min(Conversa.id))
+            .group_by(Conversa.vendedor_id, Conversa.lead_telefone)
+            .having(func.count(Conversa.id) > 1)
+            .all()
+        )
+        total = 0
+        for vendedor_id, lead_telefone, manter_id in grupos:
+            duplicadas = [
+                id_ for (id_,) in db.query(Conversa.id).filter(
+                    Conversa.vendedor_id == vendedor_id,
+                    Conversa.lead_telefone == lead_telefone,
+                    Conversa.id != manter_id,
+                )
+            ]
+            # Mesmo message_id ja salvo na conversa mantida (retry do webhook)
+            ids_mantidos = db.query(Mensagem.message_id).filter(
+                Mensagem.conversa_id == manter_id, Mensagem.message_id.isnot(None)
+            )
+            db.query(Mensagem).filter(
+                Mensagem.conversa_id.in_(duplicadas), Mensagem.message_id.in_(ids_mantidos)
+            ).delete(synchronize_session=False)
+            for modelo in (Mensagem, Analise):
+                db.query(modelo).filter(modelo.conversa_id.in_(duplicadas)).update(
+                    {modelo.conversa_id: manter_id}, synchronize_session=False
+                )
+            db.query(Conversa).filter(Conversa.id.in_(duplicadas)).delete(synchronize_session=False)
+            total += len(duplicadas)
+        db.commit()
+    if total:
+        logger.info(f"Migracao: {total} conversa(s) duplicada(s) removida(s)")
+
+
+def _deduplicar_metricas(engine: Engine) -> None:
+    """Mantem a MetricaDiaria mais recente (maior id) por (vendedor_id, data)."""
+    with engine.begin() as conn:
+        removidas = conn.execute(text(
+            "DELETE FROM metricas_diarias WHERE id NOT IN ("
+            "SELECT MAX(id) FROM metricas_diarias GROUP BY vendedor_id, data)"
+        )).rowcount
+    if removidas:
+        logger.info(f"Migracao: {removidas} metrica(s) diaria(s) duplicada(s) removida(s)")
+
+
+# === Migracoes ===
+
+
+def _m001_telefones_e_message_id(engine: Engine) -> None:
+    for tabela, coluna in [
+        ("vendedores", "telefone_e164"),
+        ("vendedores", "telefone_chave"),
+        ("instancias_evolution", "telefone_e164"),
+        ("instancias_evolution", "telefone_chave"),
+        ("conversas", "lead_telefone_e164"),
+        ("conversas", "lead_telefone_chave"),
+    ]:
+        adicionar_coluna(engine, tabela, coluna, "VARCHAR(20)")
+    adicionar_coluna(engine, "mensagens", "message_id", "VARCHAR(100)")
+    _backfill_telefones(engine)
+    _deduplicar_conversas(engine)
+
+    criar_indice(engine, "ix_vendedores_empresa_chave", "vendedores", ["empresa_id", "telefone_chave"])
+    criar_indice(
+        engine, "ix_instancias_evolution_empresa_chave", "instancias_evolution",
+        ["empresa_id", "telefone_chave"],
+    )
+    criar_indice(engine, "ix_conversas_empresa_lead_chave", "conversas", ["empresa_id", "lead_telefone_chave"])
+    criar_indice(
+        engine, "uq_conversas_vendedor_lead", "conversas", ["vendedor_id", "lead_telefone"], unico=True
+    )
+    criar_indice(
+        engine, "uq_mensagens_conversa_message_id", "mensagens", ["conversa_id", "message_id"], unico=True
+    )
+
+
+def _m002_indices_caminho_quente(engine: Engine) -> None:
+    criar_indice(engine, "ix_mensagens_conversa_enviada", "mensagens", ["conversa_id", "enviada_em"])
+    criar_indice(engine, "ix_mensagens_enviada_em", "mensagens", ["enviada_em"])
+    criar_indice(engine, "ix_conversas_empresa_lead", "conversas", ["empresa_id", "lead_telefone"])
+    criar_indice(engine, "ix_analises_conversa_analisada", "analises", ["conversa_id", "analisada_em"])
+    criar_indice(engine, "ix_instancias_evolution_nome", "instancias_evolution", ["nome_instancia"])
+    _deduplicar_metricas(engine)
+    criar_indice(
+        engine, "uq_metricas_diarias_vendedor_data", "metricas_diarias", ["vendedor_id", "data"], unico=True
+    )
+
+
+def _m003_metricas_incrementais(engine: Engine) -> None:
+    MetricaPendente.__table__.create(bind=engine, checkfirst=True)
+    adicionar_coluna(engine, "metricas_diarias", "calculada_em", "TIMESTAMP")
+
+
+def _m004_estado_conversa(engine: Engine) -> None:
+    novas = [
+        ("total_msgs_lead", "INTEGER NOT NULL DEFAULT 0"),
+        ("total_msgs_vendedor", "INTEGER NOT NULL DEFAULT 0"),
+        ("primeira_msg_lead_em", "TIMESTAMP"),
+        ("ultima_msg_lead_em", "TIMESTAMP"),
+        ("primeira_msg_vendedor_em", "TIMESTAMP"),
+        ("ultima_msg_vendedor_em", "TIMESTAMP"),
+        ("lead_pendente_desde", "TIMESTAMP"),
+        ("aguardando_resposta", "BOOLEAN NOT NULL DEFAULT FALSE"),
+        ("primeira_resposta_seg", "INTEGER"),
+        ("soma_respostas_seg", "INTEGER NOT NULL DEFAULT 0"),
+        ("qtd_respostas", "INTEGER NOT NULL DEFAULT 0"),
+    ]
+    adicionadas = [adicionar_coluna(engine, "conversas", coluna, tipo) for coluna, tipo in novas]
+    if any(adicionadas):
+        _backfill_estado_conversas(engine)
+    criar_indice(
+        engine, "ix_conversas_aguardando", "conversas",
+        ["empresa_id", "aguardando_resposta", "lead_pendente_desde"],
+    )
+
+
+def _m005_sketches_metricas(engine: Engine) -> None:
+    tipo = "BYTEA" if engine.dialect.name == "postgresql" else "BLOB"
+    adicionar_coluna(engine, "metricas_diarias", "sketch_primeira_resp", tipo)
+    adicionar_coluna(engine, "metricas_diarias", "sketch_resposta", tipo)
+    # Dias ja calculados entram na fila do recalculo incremental para ganhar sketches
+    _enfileirar_recalculo(engine, "m.sketch_resposta IS NULL")
+
+
+def _m006_metricas_horarias(engine: Engine) -> None:
+    MetricaHoraria.__table__.create(bind=engine, checkfirst=True)
+    # criar_tabelas() pode ter criado a tabela (vazia) antes da migracao
+    with engine.connect() as conn:
+        vazia = conn.execute(text("SELECT 1 FROM metricas_horarias LIMIT 1")).first() is None
+    if vazia:
+        _enfileirar_recalculo(engine)
+
+
+def _m007_metricas_periodo(engine: Engine) -> None:
+    MetricaPeriodo.__table__.create(bind=engine, checkfirst=True)
+    # Recalcular as metricas diarias refaz a semana e o mes de cada dia
+    with engine.connect() as conn:
+        vazia = conn.execute(text("SELECT 1 FROM metricas_periodo LIMIT 1")).first() is None
+    if vazia:
+        _enfileirar_recalculo(engine)
+
+
+def _m008_ultima_analise(engine: Engine) -> None:
+    novas = [
+        ("ultima_analise_id", "INTEGER REFERENCES analises(id)"),
+        ("ultima_analise_em", "TIMESTAMP"),
+        ("ultimo_score", "FLOAT"),
+        ("ultima_classificacao", "VARCHAR(20)"),
+        ("ultimo_sentimento", "VARCHAR(20)"),
+    ]
+    adicionadas = [adicionar_coluna(engine, "conversas", coluna, tipo) for coluna, tipo in novas]
+    # criar_tabelas() nao altera tabelas existentes: coluna nova = ponteiro ainda vazio
+    if any(adicionadas):
+        with Session(engine) as db:
+            recalcular_ultima_analise(db)
+
+
+def _m009_tokens_analise(engine: Engine) -> None:
+    adicionar_coluna(engine, "analises", "tokens_usados", "INTEGER")
+
+
+def _m010_hash_analise(engine: Engine) -> None:
+    adicionar_coluna(engine, "analises", "hash_conteudo", "VARCHAR(64)")
+    criar_indice(engine, "ix_analises_hash_conteudo", "analises", ["hash_conteudo"])
+
+
+def _m011_mensagens_analisadas(engine: Engine) -> None:
+    # Analises antigas ficam sem contagem: o modo incremental compara datas para elas
+    adicionar_coluna(engine, "analises", "mensagens_analisadas", "INTEGER")
+    adicionar_coluna(engine, "conversas", "ultima_analise_msgs", "INTEGER")
+
+
+def _m012_ultima_analise_set_null(engine: Engine) -> None:
+    # SQLite nao altera constraints; la a FK so e aplicada com PRAGMA foreign_keys
+    if engine.dialect.name != "postgresql":
+        return
+    fks = [
+        fk["name"] for fk in inspect(engine).get_foreign_keys("conversas")
+        if fk["constrained_columns"] == ["ultima_analise_id"]
+    ]
+    with engine.begin() as conn:
+        for nome in fks:
+            conn.execute(text(f'ALTER TABLE conversas DROP CONSTRAINT "{nome}"'))
+        conn.execute(text(
+            "ALTER TABLE conversas ADD CONSTRAINT fk_conversas_ultima_analise "
+            "FOREIGN KEY (ultima_analise_id) REFERENCES analises(id) ON DELETE SET NULL"
+        ))
+
+
+MIGRACOES: list[Migracao] = [
+    Migracao(1, "telefones normalizados, message_id e conversa unica por lead", _m001_telefones_e_message_id),
+    Migracao(2, "indices do caminho quente e metrica diaria unica", _m002_indices_caminho_quente),
+    Migracao(3, "metricas pendentes e frescor das metricas diarias", _m003_metricas_incrementais),
+    Migracao(4, "estado incremental da conversa", _m004_estado_conversa),
+    Migracao(5, "sketches de percentis nas metricas diarias", _m005_sketches_metricas),
+    Migracao(6, "rollup horario de mensagens e respostas", _m006_metricas_horarias),
+    Migracao(7, "rollups semanais e mensais das metricas", _m007_metricas_periodo),
+    Migracao(8, "ponteiro para a analise mais recente da conversa", _m008_ultima_analise),
+    Migracao(9, "tokens usados por analise", _m009_tokens_analise),
+    Migracao(10, "hash do conteudo analisado (cache de analises)", _m010_hash_analise),
+    Migracao(11, "mensagens cobertas por cada analise", _m011_mensagens_analisadas),
+    Migracao(12, "apagar analise limpa o ponteiro da conversa", _m012_ultima_analise_set_null),
+]
+
+
+# === Execucao ===
+
+
+def versoes_aplicadas(engine: Engine | None = None) -> set[int]:
+    engine = engine or engine_padrao
+    SchemaVersao.__table__.create(bind=engine, checkfirst=True)
+    with Session(engine) as db:
+        return {v for (v,) in db.query(SchemaVersao.versao)}
+
+
+def migracoes_pendentes(engine: Engine | None = None) -> list[Migracao]:
+    aplicadas = versoes_aplicadas(engine)
+    return [m for m in MIGRACOES if m.versao not in aplicadas]
+
+
+def aplicar_migracoes(engine: Engine | None = None) -> list[int]:
+    """Aplica as migracoes pendentes em ordem. Retorna as versoes aplicadas."""
+    engine = engine or engine_padrao
+    if engine.dialect.name == "postgresql":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:chave)"), {"chave": _LOCK_MIGRACOES})
+            try:
+                return _aplicar_pendentes(engine)
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:chave)"), {"chave": _LOCK_MIGRACOES})
+    return _aplicar_pendentes(engine)
+
+
+def _aplicar_pendentes(engine: Engine) -> list[int]:
+    aplicadas = []
+    for migracao in migracoes_pendentes(engine):
+        logger.info(f"Aplicando migracao {migracao.versao}: {migracao.descricao}")
+        migracao.aplicar(engine)
+        with Session(engine) as db:
+            db.add(SchemaVersao(versao=migracao.versao, descricao=migracao.descricao))
+            db.commit()
+        aplicadas.append(migracao.versao)
+    return aplicadas
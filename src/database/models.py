@@ -1,10 +1,26 @@
 from datetime import datetime
 from uuid import uuid4
 
-from sqlalchemy import Boolean, DateTime, Float, ForeignKey, Integer, String, Text, UniqueConstraint
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy import (
+    Boolean,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+    Text,
+    UniqueConstraint,
+    event,
+    false,
+    or_,
+    update,
+)
+from sqlalchemy.orm import Mapped, mapped_column, relationship, validates
 
 from src.database.connection import Base
+from src.whatsapp.telefone import chave_telefone, normalizar_e164
 
 
 class Empresa(Base):
@@ -34,14 +50,26 @@ class InstanciaEvolution(Base):
     empresa_id: Mapped[int] = mapped_column(ForeignKey("empresas.id"), nullable=False)
     nome_instancia: Mapped[str] = mapped_column(String(100), nullable=False)
     telefone: Mapped[str | None] = mapped_column(String(20))
+    telefone_e164: Mapped[str | None] = mapped_column(String(20))
+    telefone_chave: Mapped[str | None] = mapped_column(String(20))  # ver chave_telefone()
     ativa: Mapped[bool] = mapped_column(Boolean, default=True)
     criada_em: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
 
-    __table_args__ = (UniqueConstraint("empresa_id", "nome_instancia"),)
+    __table_args__ = (
+        UniqueConstraint("empresa_id", "nome_instancia"),
+        Index("ix_instancias_evolution_nome", "nome_instancia"),
+        Index("ix_instancias_evolution_empresa_chave", "empresa_id", "telefone_chave"),
+    )
 
     # Relationships
     empresa: Mapped["Empresa"] = relationship(back_populates="instancias_evolution")
 
+    @validates("telefone")
+    def _normalizar_telefone(self, _key, telefone):
+        self.telefone_e164 = normalizar_e164(telefone)
+        self.telefone_chave = chave_telefone(telefone)
+        return telefone
+
     def __repr__(self):
         return f"<InstanciaEvolution {self.nome_instancia} empresa={self.empresa_id}>"
 
@@ -53,16 +81,27 @@ class Vendedor(Base):
     empresa_id: Mapped[int | None] = mapped_column(ForeignKey("empresas.id"))
     nome: Mapped[str] = mapped_column(String(100), nullable=False)
     telefone: Mapped[str] = mapped_column(String(20), nullable=False)
+    telefone_e164: Mapped[str | None] = mapped_column(String(20))
+    telefone_chave: Mapped[str | None] = mapped_column(String(20))  # ver chave_telefone()
     ativo: Mapped[bool] = mapped_column(Boolean, default=True)
     criado_em: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
 
-    __table_args__ = (UniqueConstraint("empresa_id", "telefone"),)
+    __table_args__ = (
+        UniqueConstraint("empresa_id", "telefone"),
+        Index("ix_vendedores_empresa_chave", "empresa_id", "telefone_chave"),
+    )
 
     # Relacionamentos
     empresa: Mapped["Empresa | None"] = relationship(back_populates="vendedores")
     conversas: Mapped[list["Conversa"]] = relationship(back_populates="vendedor")
     metricas: Mapped[list["MetricaDiaria"]] = relationship(back_populates="vendedor")
 
+    @validates("telefone")
+    def _normalizar_telefone(self, _key, telefone):
+        self.telefone_e164 = normalizar_e164(telefone)
+        self.telefone_chave = chave_telefone(telefone)
+        return telefone
+
     def __repr__(self):
         return f"<Vendedor {self.nome} ({self.telefone})>"
 
@@ -74,6 +113,8 @@ class Conversa(Base):
     empresa_id: Mapped[int | None] = mapped_column(ForeignKey("empresas.id"))
     vendedor_id: Mapped[int] = mapped_column(ForeignKey("vendedores.id"), nullable=False)
     lead_telefone: Mapped[str] = mapped_column(String(20), nullable=False)
+    lead_telefone_e164: Mapped[str | None] = mapped_column(String(20))
+    lead_telefone_chave: Mapped[str | None] = mapped_column(String(20))  # ver chave_telefone()
     lead_nome: Mapped[str | None] = mapped_column(String(100))
     status: Mapped[str] = mapped_column(String(20), default="novo")
     iniciada_em: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
@@ -81,13 +122,52 @@ class Conversa(Base):
         DateTime, default=datetime.now, onupdate=datetime.now
     )
 
+    # Estado incremental, mantido a cada mensagem (ver src/database/estado_conversa.py)
+    total_msgs_lead: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    total_msgs_vendedor: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    primeira_msg_lead_em: Mapped[datetime | None] = mapped_column(DateTime)
+    ultima_msg_lead_em: Mapped[datetime | None] = mapped_column(DateTime)
+    primeira_msg_vendedor_em: Mapped[datetime | None] = mapped_column(DateTime)
+    ultima_msg_vendedor_em: Mapped[datetime | None] = mapped_column(DateTime)
+    lead_pendente_desde: Mapped[datetime | None] = mapped_column(DateTime)  # inicio do turno sem resposta
+    aguardando_resposta: Mapped[bool] = mapped_column(Boolean, default=False, server_default=false())
+    primeira_resposta_seg: Mapped[int | None] = mapped_column(Integer)
+    soma_respostas_seg: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    qtd_respostas: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+
+    # Analise mais recente, mantida no insert de Analise (funil e score sem carregar o historico)
+    ultima_analise_id: Mapped[int | None] = mapped_column(
+        ForeignKey("analises.id", use_alter=True, name="fk_conversas_ultima_analise", ondelete="SET NULL")
+    )
+    ultima_analise_em: Mapped[datetime | None] = mapped_column(DateTime)
+    ultimo_score: Mapped[float | None] = mapped_column(Float)
+    ultima_classificacao: Mapped[str | None] = mapped_column(String(20))
+    ultimo_sentimento: Mapped[str | None] = mapped_column(String(20))
+    ultima_analise_msgs: Mapped[int | None] = mapped_column(Integer)  # mensagens que a analise viu
+
+    __table_args__ = (
+        UniqueConstraint("vendedor_id", "lead_telefone", name="uq_conversas_vendedor_lead"),
+        Index("ix_conversas_empresa_lead", "empresa_id", "lead_telefone"),
+        Index("ix_conversas_empresa_lead_chave", "empresa_id", "lead_telefone_chave"),
+        Index("ix_conversas_aguardando", "empresa_id", "aguardando_resposta", "lead_pendente_desde"),
+    )
+
     # Relacionamentos
     empresa: Mapped["Empresa | None"] = relationship(back_populates="conversas")
     vendedor: Mapped["Vendedor"] = relationship(back_populates="conversas")
     mensagens: Mapped[list["Mensagem"]] = relationship(
         back_populates="conversa", order_by="Mensagem.enviada_em"
     )
-    analises: Mapped[list["Analise"]] = relationship(back_populates="conversa")
+    analises: Mapped[list["Analise"]] = relationship(
+        back_populates="conversa", foreign_keys="Analise.conversa_id"
+    )
+    ultima_analise: Mapped["Analise | None"] = relationship(foreign_keys=[ultima_analise_id])
+
+    @validates("lead_telefone")
+    def _normalizar_lead_telefone(self, _key, telefone):
+        self.lead_telefone_e164 = normalizar_e164(telefone)
+        self.lead_telefone_chave = chave_telefone(telefone)
+        return telefone
 
     def __repr__(self):
         return f"<Conversa vendedor={self.vendedor_id} lead={self.lead_telefone} status={self.status}>"
@@ -102,6 +182,13 @@ class Mensagem(Base):
     conteudo: Mapped[str] = mapped_column(Text, nullable=False)
     tipo: Mapped[str] = mapped_column(String(20), default="texto")  # texto/audio/imagem
     enviada_em: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    message_id: Mapped[str | None] = mapped_column(String(100))  # id da mensagem no WhatsApp
+
+    __table_args__ = (
+        UniqueConstraint("conversa_id", "message_id", name="uq_mensagens_conversa_message_id"),
+        Index("ix_mensagens_conversa_enviada", "conversa_id", "enviada_em"),
+        Index("ix_mensagens_enviada_em", "enviada_em"),
+    )
 
     # Relacionamento
     conversa: Mapped["Conversa"] = relationship(back_populates="mensagens")
@@ -121,14 +208,48 @@ class Analise(Base):
     erros: Mapped[str | None] = mapped_column(Text)
     sentimento_lead: Mapped[str | None] = mapped_column(String(20))
     feedback_ia: Mapped[str | None] = mapped_column(Text)
+    tokens_usados: Mapped[int | None] = mapped_column(Integer)  # total da chamada a OpenAI
+    mensagens_analisadas: Mapped[int | None] = mapped_column(Integer)  # mensagens da conversa na transcricao
+    # sha256 de transcricao + versao do prompt + modelo (cache de analises)
+    hash_conteudo: Mapped[str | None] = mapped_column(String(64))
     analisada_em: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
 
-    conversa: Mapped["Conversa"] = relationship(back_populates="analises")
+    __table_args__ = (
+        Index("ix_analises_conversa_analisada", "conversa_id", "analisada_em"),
+        Index("ix_analises_hash_conteudo", "hash_conteudo"),
+    )
+
+    conversa: Mapped["Conversa"] = relationship(back_populates="analises", foreign_keys=[conversa_id])
 
     def __repr__(self):
         return f"<Analise conversa={self.conversa_id} score={self.score_qualidade}>"
 
 
+@event.listens_for(Analise, "after_insert")
+def _apontar_ultima_analise(_mapper, connection, analise):
+    """Aponta a conversa para a analise recem-inserida, se ela for a mais recente.
+
+    Vale para qualquer insert pela ORM (salvar_analise, lote, scripts, testes).
+    Nao mexe em Conversa.atualizada_em, que marca atividade de mensagens.
+    """
+    connection.execute(
+        update(Conversa.__table__)
+        .where(
+            Conversa.id == analise.conversa_id,
+            or_(Conversa.ultima_analise_em.is_(None), Conversa.ultima_analise_em <= analise.analisada_em),
+        )
+        .values(
+            ultima_analise_id=analise.id,
+            ultima_analise_em=analise.analisada_em,
+            ultimo_score=analise.score_qualidade,
+            ultima_classificacao=analise.classificacao,
+            ultimo_sentimento=analise.sentimento_lead,
+            ultima_analise_msgs=analise.mensagens_analisadas,
+            atualizada_em=Conversa.atualizada_em,
+        )
+    )
+
+
 class ConfiguracaoPrompt(Base):
     __tablename__ = "configuracoes_prompt"
 
@@ -178,9 +299,103 @@ class MetricaDiaria(Base):
     total_conversoes: Mapped[int] = mapped_column(Integer, default=0)
     score_medio: Mapped[float | None] = mapped_column(Float)
     leads_sem_resposta: Mapped[int] = mapped_column(Integer, default=0)
+    calculada_em: Mapped[datetime | None] = mapped_column(DateTime)  # frescor do calculo
+    # DDSketch serializado (src/metrics/sketch.py): percentis mesclaveis entre dias
+    sketch_primeira_resp: Mapped[bytes | None] = mapped_column(LargeBinary)
+    sketch_resposta: Mapped[bytes | None] = mapped_column(LargeBinary)
+
+    __table_args__ = (
+        UniqueConstraint("vendedor_id", "data", name="uq_metricas_diarias_vendedor_data"),
+    )
 
     # Relacionamento
     vendedor: Mapped["Vendedor"] = relationship(back_populates="metricas")
 
     def __repr__(self):
         return f"<Metrica vendedor={self.vendedor_id} data={self.data}>"
+
+
+class MetricaPeriodo(Base):
+    """Rollup semanal/mensal de MetricaDiaria por vendedor (ver src/metrics/rollups.py).
+
+    Medias guardadas como soma + quantidade de dias para poderem ser mescladas.
+    """
+
+    __tablename__ = "metricas_periodo"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    vendedor_id: Mapped[int] = mapped_column(ForeignKey("vendedores.id"), nullable=False)
+    empresa_id: Mapped[int | None] = mapped_column(ForeignKey("empresas.id"))
+    granularidade: Mapped[str] = mapped_column(String(10), nullable=False)  # semana | mes
+    inicio: Mapped[str] = mapped_column(String(10), nullable=False)  # segunda-feira ou dia 1 (YYYY-MM-DD)
+    dias: Mapped[int] = mapped_column(Integer, default=0)  # dias com MetricaDiaria no periodo
+    total_atendimentos: Mapped[int] = mapped_column(Integer, default=0)
+    total_mql: Mapped[int] = mapped_column(Integer, default=0)
+    total_sql: Mapped[int] = mapped_column(Integer, default=0)
+    total_conversoes: Mapped[int] = mapped_column(Integer, default=0)
+    leads_sem_resposta: Mapped[int] = mapped_column(Integer, default=0)
+    soma_score_medio: Mapped[float] = mapped_column(Float, default=0.0)
+    dias_com_score: Mapped[int] = mapped_column(Integer, default=0)
+    soma_tempo_primeira_seg: Mapped[int] = mapped_column(Integer, default=0)
+    dias_com_tempo_primeira: Mapped[int] = mapped_column(Integer, default=0)
+    soma_tempo_medio_seg: Mapped[int] = mapped_column(Integer, default=0)
+    dias_com_tempo_medio: Mapped[int] = mapped_column(Integer, default=0)
+    sketch_primeira_resp: Mapped[bytes | None] = mapped_column(LargeBinary)
+    sketch_resposta: Mapped[bytes | None] = mapped_column(LargeBinary)
+    atualizada_em: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        UniqueConstraint("vendedor_id", "granularidade", "inicio", name="uq_metricas_periodo_vendedor"),
+        Index("ix_metricas_periodo_empresa", "empresa_id", "granularidade", "inicio"),
+    )
+
+    def __repr__(self):
+        return f"<MetricaPeriodo vendedor={self.vendedor_id} {self.granularidade} {self.inicio}>"
+
+
+class MetricaHoraria(Base):
+    """Rollup por hora do dia (pico de atendimento e SLA), recalculado junto com MetricaDiaria."""
+
+    __tablename__ = "metricas_horarias"
+
+    vendedor_id: Mapped[int] = mapped_column(ForeignKey("vendedores.id"), primary_key=True)
+    data: Mapped[str] = mapped_column(String(10), primary_key=True)  # formato: YYYY-MM-DD
+    hora: Mapped[int] = mapped_column(Integer, primary_key=True)  # 0-23
+    empresa_id: Mapped[int | None] = mapped_column(ForeignKey("empresas.id"))
+    msgs_lead: Mapped[int] = mapped_column(Integer, default=0)
+    msgs_vendedor: Mapped[int] = mapped_column(Integer, default=0)
+    leads_novos: Mapped[int] = mapped_column(Integer, default=0)  # primeira mensagem do lead na conversa
+    respostas: Mapped[int] = mapped_column(Integer, default=0)  # respostas que fecham um turno do lead
+    respostas_no_sla: Mapped[int] = mapped_column(Integer, default=0)  # ate settings.metricas_sla_resposta_seg
+    soma_resposta_seg: Mapped[int] = mapped_column(Integer, default=0)
+
+    __table_args__ = (Index("ix_metricas_horarias_empresa_data", "empresa_id", "data"),)
+
+    def __repr__(self):
+        return f"<MetricaHoraria vendedor={self.vendedor_id} data={self.data} hora={self.hora}>"
+
+
+class MetricaPendente(Base):
+    """(vendedor, dia) com mensagens ou analises novas desde o ultimo calculo."""
+
+    __tablename__ = "metricas_pendentes"
+
+    vendedor_id: Mapped[int] = mapped_column(ForeignKey("vendedores.id"), primary_key=True)
+    data: Mapped[str] = mapped_column(String(10), primary_key=True)  # formato: YYYY-MM-DD
+    marcada_em: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+
+    def __repr__(self):
+        return f"<MetricaPendente vendedor={self.vendedor_id} data={self.data}>"
+
+
+class SchemaVersao(Base):
+    """Migracoes aplicadas (ver src/database/migrations.py)."""
+
+    __tablename__ = "schema_versao"
+
+    versao: Mapped[int] = mapped_column(Integer, primary_key=True)
+    descricao: Mapped[str] = mapped_column(String(200), nullable=False)
+    aplicada_em: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+
+    def __repr__(self):
+        return f"<SchemaVersao {self.versao} {self.descricao}>"
@@ -4,8 +4,13 @@ import json
 from datetime import datetime
 from uuid import uuid4
 
+from sqlalchemy import Select, and_, func, or_, select, update
 from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm.attributes import set_committed_value
 
+from src.database import cache
+from src.database.dialeto import insert_para
+from src.database.estado_conversa import instrucao_atualizar_estado
 from src.database.models import (
     Analise,
     Configuracao,
@@ -15,8 +20,11 @@ from src.database.models import (
     InstanciaEvolution,
     Mensagem,
     MetricaDiaria,
+    MetricaHoraria,
+    MetricaPendente,
     Vendedor,
 )
+from src.whatsapp.telefone import chave_telefone, normalizar_e164
 
 
 # === Queries de Empresa ===
@@ -69,6 +77,7 @@ def criar_instancia_evolution(
     db.add(instancia)
     db.commit()
     db.refresh(instancia)
+    cache.invalidar_instancia(nome_instancia)
     return instancia
 
 
@@ -84,12 +93,14 @@ def atualizar_instancia(
     )
     if not instancia:
         return None
+    cache.invalidar_instancia(instancia.nome_instancia)
     if nome_instancia is not None:
         instancia.nome_instancia = nome_instancia
     if telefone is not None:
         instancia.telefone = telefone
     db.commit()
     db.refresh(instancia)
+    cache.invalidar_instancia(instancia.nome_instancia)
     return instancia
 
 
@@ -102,8 +113,10 @@ def remover_instancia(db: Session, instancia_id: int, empresa_id: int) -> bool:
     )
     if not instancia:
         return False
+    nome_instancia = instancia.nome_instancia
     db.delete(instancia)
     db.commit()
+    cache.invalidar_instancia(nome_instancia)
     return True
 
 
@@ -123,6 +136,27 @@ def buscar_vendedor_por_telefone(
     )
 
 
+def buscar_vendedor_ativo_por_chave(
+    db: Session, empresa_id: int, telefone: str
+) -> Vendedor | None:
+    """Busca vendedor ativo pela chave normalizada do telefone (match flexivel p/ 9o digito BR).
+
+    Usa o indice (empresa_id, telefone_chave).
+    """
+    chave = chave_telefone(telefone)
+    if chave is None:
+        return None
+    return (
+        db.query(Vendedor)
+        .filter(
+            Vendedor.empresa_id == empresa_id,
+            Vendedor.telefone_chave == chave,
+            Vendedor.ativo.is_(True),
+        )
+        .first()
+    )
+
+
 def criar_vendedor(db: Session, nome: str, telefone: str, empresa_id: int | None = None) -> Vendedor:
     # Reativar vendedor inativo com mesmo telefone na empresa
     existente = (
@@ -139,12 +173,14 @@ def criar_vendedor(db: Session, nome: str, telefone: str, empresa_id: int | None
         existente.ativo = True
         db.commit()
         db.refresh(existente)
+        cache.invalidar_vendedores_empresa(empresa_id)
         return existente
 
     vendedor = Vendedor(nome=nome, telefone=telefone, empresa_id=empresa_id)
     db.add(vendedor)
     db.commit()
     db.refresh(vendedor)
+    cache.invalidar_vendedores_empresa(empresa_id)
     return vendedor
 
 
@@ -160,6 +196,7 @@ def desativar_vendedor(db: Session, vendedor_id: int, empresa_id: int) -> Vended
     vendedor.ativo = False
     db.commit()
     db.refresh(vendedor)
+    cache.invalidar_vendedores_empresa(empresa_id)
     return vendedor
 
 
@@ -177,36 +214,64 @@ def listar_vendedores(
 # === Queries de Conversa ===
 
 
+def upsert_conversa(
+    db: Session, vendedor_id: int, lead_telefone: str, lead_nome: str = "",
+    empresa_id: int | None = None,
+) -> tuple[int, bool]:
+    """Busca ou cria a conversa vendedor <-> lead num unico statement, sem corrida.
+
+    INSERT ... ON CONFLICT (vendedor_id, lead_telefone) DO UPDATE ... RETURNING,
+    preenchendo lead_nome apenas se ainda estiver vazio. Nao faz commit: o commit
+    vem junto com a mensagem (salvar_mensagem/salvar_mensagens_lote).
+
+    Returns:
+        (conversa_id, tem_lead_nome)
+    """
+    inserir = insert_para(db)
+    stmt = inserir(Conversa).values(
+        vendedor_id=vendedor_id,
+        lead_telefone=lead_telefone,
+        lead_telefone_e164=normalizar_e164(lead_telefone),
+        lead_telefone_chave=chave_telefone(lead_telefone),
+        lead_nome=lead_nome or None,
+        empresa_id=empresa_id,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["vendedor_id", "lead_telefone"],
+        set_={"lead_nome": func.coalesce(Conversa.lead_nome, stmt.excluded.lead_nome)},
+    ).returning(Conversa.id, Conversa.lead_nome)
+    conversa_id, nome = db.execute(stmt).one()
+    return conversa_id, bool(nome)
+
+
 def buscar_ou_criar_conversa(
     db: Session, vendedor_id: int, lead_telefone: str, lead_nome: str = "",
     empresa_id: int | None = None,
 ) -> Conversa:
     """Busca conversa ativa entre vendedor e lead ou cria uma nova."""
-    conversa = (
+    conversa_id, _ = upsert_conversa(db, vendedor_id, lead_telefone, lead_nome, empresa_id)
+    db.commit()
+    return db.get(Conversa, conversa_id)
+
+
+def buscar_conversa_por_lead(
+    db: Session, empresa_id: int, lead_telefone: str
+) -> Conversa | None:
+    """Busca conversa de um lead (com vendedor ativo) na empresa pela chave normalizada do telefone."""
+    chave = chave_telefone(lead_telefone)
+    if chave is None:
+        return None
+    return (
         db.query(Conversa)
+        .join(Vendedor)
         .filter(
-            Conversa.vendedor_id == vendedor_id,
-            Conversa.lead_telefone == lead_telefone,
+            Conversa.empresa_id == empresa_id,
+            Conversa.lead_telefone_chave == chave,
+            Vendedor.ativo.is_(True),
         )
         .first()
     )
 
-    if not conversa:
-        conversa = Conversa(
-            vendedor_id=vendedor_id,
-            lead_telefone=lead_telefone,
-            lead_nome=lead_nome or None,
-            empresa_id=empresa_id,
-        )
-        db.add(conversa)
-        db.commit()
-        db.refresh(conversa)
-    elif lead_nome and not conversa.lead_nome:
-        conversa.lead_nome = lead_nome
-        db.commit()
-
-    return conversa
-
 
 def buscar_conversa_com_mensagens(db: Session, conversa_id: int) -> Conversa | None:
     """Busca conversa por ID, carregando mensagens em ordem cronologica."""
@@ -218,12 +283,79 @@ def buscar_conversa_com_mensagens(db: Session, conversa_id: int) -> Conversa | N
     )
 
 
+def consulta_inicio_turno_pendente(conversa_ids, inicio: datetime) -> Select:
+    """Ids da primeira mensagem do turno do lead ainda sem resposta antes de `inicio`.
+
+    Turno pendente = mensagens do lead depois da ultima resposta do vendedor.
+    E o ponto de partida do tempo de resposta quando o vendedor responde
+    so depois de `inicio` (ex: lead mandou as 23h50, resposta no dia seguinte).
+
+    Args:
+        conversa_ids: lista ou select de ids de conversa
+    """
+    ultima_resposta = (
+        select(Mensagem.conversa_id, func.max(Mensagem.enviada_em).label("enviada_em"))
+        .where(
+            Mensagem.conversa_id.in_(conversa_ids),
+            Mensagem.remetente == "vendedor",
+            Mensagem.enviada_em < inicio,
+        )
+        .group_by(Mensagem.conversa_id)
+        .subquery()
+    )
+    pendentes = (
+        select(
+            Mensagem.id,
+            func.row_number().over(
+                partition_by=Mensagem.conversa_id,
+                order_by=(Mensagem.enviada_em, Mensagem.id),
+            ).label("posicao"),
+        )
+        .outerjoin(ultima_resposta, ultima_resposta.c.conversa_id == Mensagem.conversa_id)
+        .where(
+            Mensagem.conversa_id.in_(conversa_ids),
+            Mensagem.remetente == "lead",
+            Mensagem.enviada_em < inicio,
+            or_(
+                ultima_resposta.c.enviada_em.is_(None),
+                Mensagem.enviada_em > ultima_resposta.c.enviada_em,
+            ),
+        )
+        .subquery()
+    )
+    return select(pendentes.c.id).where(pendentes.c.posicao == 1)
+
+
+def listar_leads_aguardando(
+    db: Session, empresa_id: int | None = None, vendedor_id: int | None = None,
+    desde_antes_de: datetime | None = None,
+) -> list[Conversa]:
+    """Conversas com lead aguardando resposta, mais antigas primeiro (ix_conversas_aguardando).
+
+    Args:
+        desde_antes_de: se informado, so leads esperando desde antes desse horario
+    """
+    query = db.query(Conversa).filter(Conversa.aguardando_resposta.is_(True))
+    if empresa_id is not None:
+        query = query.filter(Conversa.empresa_id == empresa_id)
+    if vendedor_id is not None:
+        query = query.filter(Conversa.vendedor_id == vendedor_id)
+    if desde_antes_de is not None:
+        query = query.filter(Conversa.lead_pendente_desde < desde_antes_de)
+    return query.order_by(Conversa.lead_pendente_desde).all()
+
+
 def buscar_conversas_do_dia(
     db: Session, data: str, vendedor_id: int | None = None,
     empresa_id: int | None = None,
 ) -> list[Conversa]:
     """Busca conversas com atividade (mensagens) num dia especifico.
 
+    `Conversa.mensagens` vem carregado apenas com as mensagens do dia, mais
+    o inicio do turno do lead pendente antes da meia-noite (ver
+    consulta_inicio_turno_pendente) — memoria e tempo proporcionais ao
+    movimento do dia, nao ao historico da conversa.
+
     Args:
         data: formato YYYY-MM-DD
         vendedor_id: se informado, filtra por vendedor
@@ -236,14 +368,37 @@ def buscar_conversas_do_dia(
         db.query(Conversa)
         .join(Mensagem)
         .filter(Mensagem.enviada_em >= inicio, Mensagem.enviada_em <= fim)
-        .options(joinedload(Conversa.mensagens), joinedload(Conversa.analises))
     )
     if vendedor_id is not None:
         query = query.filter(Conversa.vendedor_id == vendedor_id)
     if empresa_id is not None:
         query = query.filter(Conversa.empresa_id == empresa_id)
 
-    return query.distinct().all()
+    conversas = query.distinct().all()
+    if not conversas:
+        return conversas
+
+    ids = [c.id for c in conversas]
+    mensagens = (
+        db.query(Mensagem)
+        .filter(or_(
+            and_(
+                Mensagem.conversa_id.in_(ids),
+                Mensagem.enviada_em >= inicio,
+                Mensagem.enviada_em <= fim,
+            ),
+            Mensagem.id.in_(consulta_inicio_turno_pendente(ids, inicio)),
+        ))
+        .order_by(Mensagem.enviada_em, Mensagem.id)
+        .all()
+    )
+    por_conversa: dict[int, list[Mensagem]] = {id_: [] for id_ in ids}
+    for mensagem in mensagens:
+        por_conversa[mensagem.conversa_id].append(mensagem)
+    for conversa in conversas:
+        # Colecao parcial: marcada como carregada para nao disparar lazy load
+        set_committed_value(conversa, "mensagens", por_conversa[conversa.id])
+    return conversas
 
 
 def buscar_conversas_periodo(
@@ -265,7 +420,7 @@ def buscar_conversas_periodo(
         db.query(Conversa)
         .join(Mensagem)
         .filter(Mensagem.enviada_em >= inicio, Mensagem.enviada_em <= fim)
-        .options(joinedload(Conversa.mensagens), joinedload(Conversa.analises))
+        .options(joinedload(Conversa.mensagens), joinedload(Conversa.ultima_analise))
     )
     if vendedor_id is not None:
         query = query.filter(Conversa.vendedor_id == vendedor_id)
@@ -285,26 +440,105 @@ def salvar_mensagem(
     conteudo: str,
     tipo: str = "texto",
     enviada_em: datetime | None = None,
-) -> Mensagem:
-    mensagem = Mensagem(
-        conversa_id=conversa_id,
-        remetente=remetente,
-        conteudo=conteudo,
-        tipo=tipo,
-        enviada_em=enviada_em or datetime.now(),
-    )
-    db.add(mensagem)
+    message_id: str | None = None,
+) -> Mensagem | None:
+    """Salva uma mensagem e atualiza a conversa numa unica transacao.
 
-    # Atualizar timestamp da conversa
-    conversa = db.query(Conversa).get(conversa_id)
-    if conversa:
-        conversa.atualizada_em = datetime.now()
+    Idempotente quando message_id e informado: retorna None se ja existir
+    mensagem com o mesmo message_id na conversa (INSERT ... ON CONFLICT DO
+    NOTHING — retries custam um unico statement).
+    """
+    stmt = (
+        insert_para(db)(Mensagem)
+        .values(
+            conversa_id=conversa_id,
+            remetente=remetente,
+            conteudo=conteudo,
+            tipo=tipo,
+            enviada_em=enviada_em or datetime.now(),
+            message_id=message_id or None,
+        )
+        .on_conflict_do_nothing(index_elements=["conversa_id", "message_id"])
+        .returning(Mensagem)
+    )
+    mensagem = db.scalars(stmt).first()
+    if mensagem is None:
+        # Duplicada: confirma apenas o que ja estava na transacao (ex: upsert_conversa)
+        db.commit()
+        return None
 
+    # Atualizar timestamp e estado da conversa na mesma transacao, sem carrega-la
+    vendedor_id = db.execute(
+        instrucao_atualizar_estado(db)
+        .values(atualizada_em=datetime.now())
+        .returning(Conversa.vendedor_id),
+        {"conversa_id": conversa_id, "remetente": remetente, "enviada_em": mensagem.enviada_em},
+    ).scalar_one()
+    marcar_metricas_pendentes(db, [(vendedor_id, mensagem.enviada_em.strftime("%Y-%m-%d"))])
+
+    # Desanexa para manter os campos vindos do RETURNING sem novo SELECT apos o commit
+    db.expunge(mensagem)
     db.commit()
-    db.refresh(mensagem)
     return mensagem
 
 
+def mensagem_existe(
+    db: Session, conversa_id: int, remetente: str, enviada_em: datetime, conteudo: str
+) -> bool:
+    """Verifica se uma mensagem identica ja foi salva (replay de payloads sem message_id)."""
+    return db.query(
+        db.query(Mensagem)
+        .filter(
+            Mensagem.conversa_id == conversa_id,
+            Mensagem.remetente == remetente,
+            Mensagem.enviada_em == enviada_em,
+            Mensagem.conteudo == conteudo,
+        )
+        .exists()
+    ).scalar()
+
+
+def salvar_mensagens_lote(db: Session, mensagens: list[dict]) -> list[int]:
+    """Insere varias mensagens numa unica transacao (INSERT multi-linha).
+
+    Mensagens com message_id ja existente na conversa sao ignoradas
+    (ON CONFLICT DO NOTHING). Retorna os ids das mensagens inseridas.
+
+    Args:
+        mensagens: dicts com conversa_id, remetente, conteudo, tipo, enviada_em, message_id
+    """
+    if not mensagens:
+        return []
+    stmt = (
+        insert_para(db)(Mensagem)
+        .on_conflict_do_nothing(index_elements=["conversa_id", "message_id"])
+        .returning(Mensagem.id, Mensagem.conversa_id, Mensagem.remetente, Mensagem.enviada_em)
+    )
+    inseridas = db.execute(stmt, mensagens).all()
+
+    # Atualizar timestamp das conversas num unico UPDATE
+    conversa_ids = {conversa_id for _, conversa_id, _, _ in inseridas}
+    if conversa_ids:
+        vendedores = dict(db.execute(
+            update(Conversa)
+            .where(Conversa.id.in_(conversa_ids))
+            .values(atualizada_em=datetime.now())
+            .returning(Conversa.id, Conversa.vendedor_id)
+            .execution_options(synchronize_session=False)
+        ).all())
+        marcar_metricas_pendentes(db, [
+            (vendedores[conversa_id], enviada_em.strftime("%Y-%m-%d"))
+            for _, conversa_id, _, enviada_em in inseridas
+        ])
+        # Estado das conversas: uma execucao por mensagem, em ordem cronologica
+        db.execute(instrucao_atualizar_estado(db), [
+            {"conversa_id": conversa_id, "remetente": remetente, "enviada_em": enviada_em}
+            for _, conversa_id, remetente, enviada_em in sorted(inseridas, key=lambda m: (m[3], m[0]))
+        ])
+    db.commit()
+    return [mensagem_id for mensagem_id, _, _, _ in inseridas]
+
+
 # === Queries de Analise ===
 
 
@@ -316,6 +550,9 @@ def salvar_analise(
     erros: list[dict],
     sentimento_lead: str,
     feedback_ia: str,
+    tokens_usados: int | None = None,
+    hash_conteudo: str | None = None,
+    mensagens_analisadas: int | None = None,
 ) -> Analise:
     """Salva resultado de analise no banco."""
     analise = Analise(
@@ -325,13 +562,63 @@ def salvar_analise(
         erros=json.dumps(erros, ensure_ascii=False),
         sentimento_lead=sentimento_lead,
         feedback_ia=feedback_ia,
+        tokens_usados=tokens_usados,
+        hash_conteudo=hash_conteudo,
+        mensagens_analisadas=mensagens_analisadas,
+        analisada_em=datetime.now(),
     )
     db.add(analise)
+    db.flush()
+    marcar_metricas_pendentes(db, db.execute(consulta_dias_conversa(conversa_id)).all())
     db.commit()
     db.refresh(analise)
     return analise
 
 
+def recalcular_ultima_analise(db: Session, conversa_ids: list[int] | None = None) -> None:
+    """Reaponta as conversas para a analise mais recente a partir do historico. Faz commit.
+
+    O insert de Analise ja mantem o ponteiro; isto serve para a migracao e
+    para analises apagadas ou com analisada_em alterado.
+    """
+    ultima = (
+        select(Analise.id)
+        .where(Analise.conversa_id == Conversa.id)
+        .order_by(Analise.analisada_em.desc(), Analise.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    filtro = [Conversa.id.in_(conversa_ids)] if conversa_ids is not None else []
+    db.execute(update(Conversa).where(*filtro).values(ultima_analise_id=ultima, atualizada_em=Conversa.atualizada_em))
+
+    def campo(coluna):
+        return select(coluna).where(Analise.id == Conversa.ultima_analise_id).scalar_subquery()
+
+    db.execute(
+        update(Conversa)
+        .where(*filtro)
+        .values(
+            ultima_analise_em=campo(Analise.analisada_em),
+            ultimo_score=campo(Analise.score_qualidade),
+            ultima_classificacao=campo(Analise.classificacao),
+            ultimo_sentimento=campo(Analise.sentimento_lead),
+            ultima_analise_msgs=campo(Analise.mensagens_analisadas),
+            atualizada_em=Conversa.atualizada_em,
+        )
+    )
+    db.commit()
+
+
+def buscar_analise_por_hash(db: Session, hash_conteudo: str) -> Analise | None:
+    """Analise mais recente do mesmo conteudo (transcricao, prompt e modelo), se houver."""
+    return (
+        db.query(Analise)
+        .filter(Analise.hash_conteudo == hash_conteudo)
+        .order_by(Analise.analisada_em.desc(), Analise.id.desc())
+        .first()
+    )
+
+
 def buscar_analises_por_conversa(db: Session, conversa_id: int) -> list[Analise]:
     """Busca todas as analises de uma conversa, mais recente primeiro."""
     return (
@@ -345,6 +632,65 @@ def buscar_analises_por_conversa(db: Session, conversa_id: int) -> list[Analise]
 # === Queries de Metricas ===
 
 
+def marcar_metricas_pendentes(db: Session, pares) -> None:
+    """Marca pares (vendedor_id, data) para o recalculo incremental. Nao faz commit.
+
+    Chamado na ingestao e ao salvar analises; o recalculo
+    (calculator.recalcular_pendentes) processa apenas os pares marcados.
+    """
+    agora = datetime.now()
+    linhas = [{"vendedor_id": vid, "data": str(dia), "marcada_em": agora} for vid, dia in set(pares)]
+    if not linhas:
+        return
+    stmt = insert_para(db)(MetricaPendente)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["vendedor_id", "data"],
+        set_={"marcada_em": stmt.excluded.marcada_em},
+    )
+    db.execute(stmt, linhas)
+
+
+def listar_metricas_pendentes(
+    db: Session, empresa_id: int | None = None, data: str | None = None
+) -> list[tuple[int, str, datetime]]:
+    """Pendencias como tuplas (vendedor_id, data, marcada_em), lidas uma unica vez."""
+    query = db.query(MetricaPendente.vendedor_id, MetricaPendente.data, MetricaPendente.marcada_em)
+    if empresa_id is not None:
+        query = query.join(Vendedor).filter(Vendedor.empresa_id == empresa_id)
+    if data is not None:
+        query = query.filter(MetricaPendente.data == data)
+    return [tuple(linha) for linha in query]
+
+
+def remover_metricas_pendentes(db: Session, pendentes: list[tuple[int, str, datetime]]) -> None:
+    """Remove pendencias ja recalculadas, exceto as remarcadas depois da leitura."""
+    for vendedor_id, data, marcada_em in pendentes:
+        db.query(MetricaPendente).filter(
+            MetricaPendente.vendedor_id == vendedor_id,
+            MetricaPendente.data == data,
+            MetricaPendente.marcada_em == marcada_em,
+        ).delete(synchronize_session=False)
+    db.commit()
+
+
+def consulta_dias_conversa(conversa_id: int) -> Select:
+    """Pares (vendedor_id, dia) em que a conversa teve mensagens.
+
+    Uma analise nova muda o funil de todos esses dias.
+    """
+    return consulta_dias_conversas([conversa_id])
+
+
+def consulta_dias_conversas(conversa_ids: list[int]) -> Select:
+    """Pares (vendedor_id, dia) distintos com mensagens de qualquer uma das conversas."""
+    return (
+        select(Conversa.vendedor_id, func.date(Mensagem.enviada_em))
+        .join(Mensagem, Mensagem.conversa_id == Conversa.id)
+        .where(Conversa.id.in_(conversa_ids))
+        .distinct()
+    )
+
+
 def upsert_metrica_diaria(
     db: Session, vendedor_id: int, data: str, **valores
 ) -> MetricaDiaria:
@@ -366,6 +712,30 @@ def upsert_metrica_diaria(
     return metrica
 
 
+def upsert_metricas_diarias(
+    db: Session, itens: list[tuple[int, str, dict]]
+) -> dict[tuple[int, str], int]:
+    """Grava varias MetricaDiaria num unico INSERT ... ON CONFLICT (vendedor_id, data).
+
+    Args:
+        itens: (vendedor_id, data, valores); todos os `valores` com as mesmas chaves.
+
+    Returns:
+        {(vendedor_id, data): metrica_id}. Faz commit (uma transacao).
+    """
+    if not itens:
+        return {}
+    linhas = [{"vendedor_id": vid, "data": data, **valores} for vid, data, valores in itens]
+    stmt = insert_para(db)(MetricaDiaria).values(linhas)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["vendedor_id", "data"],
+        set_={campo: stmt.excluded[campo] for campo in itens[0][2]},
+    ).returning(MetricaDiaria.vendedor_id, MetricaDiaria.data, MetricaDiaria.id)
+    ids = {(vid, data): metrica_id for vid, data, metrica_id in db.execute(stmt)}
+    db.commit()
+    return ids
+
+
 def buscar_metricas_vendedor(
     db: Session, vendedor_id: int, limit: int = 30
 ) -> list[MetricaDiaria]:
@@ -448,6 +818,7 @@ def salvar_prompt(
     db.add(novo)
     db.commit()
     db.refresh(novo)
+    cache.invalidar_configuracoes()
     return novo
 
 
@@ -475,6 +846,20 @@ def buscar_configuracao(
     )
 
 
+def versao_configuracoes(db: Session) -> tuple:
+    """Versao de configuracoes e prompts numa unica query (muda a cada salvar_*).
+
+    Contagem, maior id e ultima atualizacao das duas tabelas: inserir, editar
+    ou apagar uma linha muda ao menos um dos valores.
+    """
+    colunas = [
+        agregado
+        for modelo in (Configuracao, ConfiguracaoPrompt)
+        for agregado in (func.count(modelo.id), func.max(modelo.id), func.max(modelo.atualizado_em))
+    ]
+    return tuple(db.execute(select(*(select(c).scalar_subquery() for c in colunas))).one())
+
+
 def buscar_metricas_periodo(
     db: Session, data_inicio: str, data_fim: str, empresa_id: int | None = None
 ) -> list[MetricaDiaria]:
@@ -488,6 +873,21 @@ def buscar_metricas_periodo(
     return query.order_by(MetricaDiaria.data).all()
 
 
+def buscar_sketches_periodo(
+    db: Session, data_inicio: str, data_fim: str,
+    empresa_id: int | None = None, vendedor_id: int | None = None,
+) -> list[tuple[int, bytes | None, bytes | None]]:
+    """(vendedor_id, sketch_primeira_resp, sketch_resposta) das metricas do periodo."""
+    query = db.query(
+        MetricaDiaria.vendedor_id, MetricaDiaria.sketch_primeira_resp, MetricaDiaria.sketch_resposta
+    ).filter(MetricaDiaria.data >= data_inicio, MetricaDiaria.data <= data_fim)
+    if empresa_id is not None:
+        query = query.join(Vendedor).filter(Vendedor.empresa_id == empresa_id)
+    if vendedor_id is not None:
+        query = query.filter(MetricaDiaria.vendedor_id == vendedor_id)
+    return [tuple(linha) for linha in query]
+
+
 def buscar_analises_periodo(
     db: Session, data_inicio: str, data_fim: str, empresa_id: int | None = None
 ) -> list[Analise]:
@@ -505,20 +905,41 @@ def buscar_analises_periodo(
     return query.all()
 
 
-def buscar_mensagens_periodo(
-    db: Session, data_inicio: str, data_fim: str, empresa_id: int | None = None
-) -> list[Mensagem]:
-    """Mensagens num periodo (para analise de horario)."""
-    inicio = datetime.strptime(data_inicio, "%Y-%m-%d")
-    fim = datetime.strptime(data_fim, "%Y-%m-%d").replace(hour=23, minute=59, second=59)
-    query = (
-        db.query(Mensagem)
-        .join(Conversa)
-        .filter(Mensagem.enviada_em >= inicio, Mensagem.enviada_em <= fim)
-    )
+def substituir_metricas_horarias(
+    db: Session, data: str, vendedor_ids: list[int], linhas: list[dict]
+) -> None:
+    """Troca o rollup horario dos vendedores no dia pelas linhas novas, numa transacao."""
+    db.query(MetricaHoraria).filter(
+        MetricaHoraria.data == data, MetricaHoraria.vendedor_id.in_(vendedor_ids)
+    ).delete(synchronize_session=False)
+    if linhas:
+        db.execute(insert_para(db)(MetricaHoraria), linhas)
+    db.commit()
+
+
+def buscar_metricas_horarias_periodo(
+    db: Session, data_inicio: str, data_fim: str,
+    empresa_id: int | None = None, vendedor_id: int | None = None,
+) -> list[dict]:
+    """Rollup horario somado no periodo: uma linha por hora (0-23) com movimento."""
+    query = db.query(
+        MetricaHoraria.hora,
+        func.sum(MetricaHoraria.msgs_lead),
+        func.sum(MetricaHoraria.msgs_vendedor),
+        func.sum(MetricaHoraria.leads_novos),
+        func.sum(MetricaHoraria.respostas),
+        func.sum(MetricaHoraria.respostas_no_sla),
+        func.sum(MetricaHoraria.soma_resposta_seg),
+    ).filter(MetricaHoraria.data >= data_inicio, MetricaHoraria.data <= data_fim)
     if empresa_id is not None:
-        query = query.filter(Conversa.empresa_id == empresa_id)
-    return query.all()
+        query = query.filter(MetricaHoraria.empresa_id == empresa_id)
+    if vendedor_id is not None:
+        query = query.filter(MetricaHoraria.vendedor_id == vendedor_id)
+    campos = (
+        "hora", "msgs_lead", "msgs_vendedor", "leads_novos",
+        "respostas", "respostas_no_sla", "soma_resposta_seg",
+    )
+    return [dict(zip(campos, linha)) for linha in query.group_by(MetricaHoraria.hora).order_by(MetricaHoraria.hora)]
 
 
 def salvar_configuracao(
@@ -546,4 +967,5 @@ def salvar_configuracao(
         db.add(config)
     db.commit()
     db.refresh(config)
+    cache.invalidar_configuracoes()
     return config
@@ -0,0 +1,269 @@
+"""Variantes async (AsyncSession) das queries usadas pelos endpoints da API.
+
+Mesmos nomes e semantica de `queries.py`. Relacionamentos sao carregados
+explicitamente (selectinload): em AsyncSession nao existe lazy load.
+"""
+
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, case, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from src.database.dialeto import insert_para
+from src.database.models import Analise, Conversa, Mensagem, MetricaDiaria, MetricaPendente, Vendedor
+from src.database.queries import consulta_dias_conversa, consulta_dias_conversas
+
+
+# === Queries de Vendedor ===
+
+
+async def listar_vendedores(
+    db: AsyncSession, empresa_id: int | None = None, apenas_ativos: bool = True
+) -> list[Vendedor]:
+    stmt = select(Vendedor)
+    if empresa_id is not None:
+        stmt = stmt.where(Vendedor.empresa_id == empresa_id)
+    if apenas_ativos:
+        stmt = stmt.where(Vendedor.ativo.is_(True))
+    return list(await db.scalars(stmt))
+
+
+# === Queries de Conversa ===
+
+
+async def listar_conversas_empresa(db: AsyncSession, empresa_id: int) -> list[Conversa]:
+    """Conversas de uma empresa, mais recentes primeiro."""
+    stmt = (
+        select(Conversa)
+        .where(Conversa.empresa_id == empresa_id)
+        .order_by(Conversa.atualizada_em.desc())
+    )
+    return list(await db.scalars(stmt))
+
+
+async def buscar_conversa_com_mensagens(db: AsyncSession, conversa_id: int) -> Conversa | None:
+    """Busca conversa por ID, carregando mensagens em ordem cronologica."""
+    stmt = (
+        select(Conversa)
+        .options(selectinload(Conversa.mensagens))
+        .where(Conversa.id == conversa_id)
+    )
+    return await db.scalar(stmt)
+
+
+# === Queries de Mensagem ===
+
+
+async def listar_mensagens_conversa(db: AsyncSession, conversa_id: int) -> list[Mensagem]:
+    """Mensagens de uma conversa em ordem cronologica."""
+    stmt = (
+        select(Mensagem)
+        .where(Mensagem.conversa_id == conversa_id)
+        .order_by(Mensagem.enviada_em)
+    )
+    return list(await db.scalars(stmt))
+
+
+# === Queries de Analise ===
+
+
+async def salvar_analise(
+    db: AsyncSession,
+    conversa_id: int,
+    score_qualidade: float,
+    classificacao: str,
+    erros: list[dict],
+    sentimento_lead: str,
+    feedback_ia: str,
+    tokens_usados: int | None = None,
+    hash_conteudo: str | None = None,
+    mensagens_analisadas: int | None = None,
+) -> Analise:
+    """Salva resultado de analise no banco."""
+    analise = Analise(
+        conversa_id=conversa_id,
+        score_qualidade=score_qualidade,
+        classificacao=classificacao,
+        erros=json.dumps(erros, ensure_ascii=False),
+        sentimento_lead=sentimento_lead,
+        feedback_ia=feedback_ia,
+        tokens_usados=tokens_usados,
+        hash_conteudo=hash_conteudo,
+        mensagens_analisadas=mensagens_analisadas,
+        analisada_em=datetime.now(),
+    )
+    db.add(analise)
+    await db.flush()
+    pares = (await db.execute(consulta_dias_conversa(conversa_id))).all()
+    await marcar_metricas_pendentes(db, pares)
+    await db.commit()
+    await db.refresh(analise)
+    return analise
+
+
+async def listar_conversas_para_analise(
+    db: AsyncSession, data_inicio: str, data_fim: str, empresa_id: int | None = None
+) -> list[tuple[int, int | None]]:
+    """(conversa_id, empresa_id) das conversas com mensagens no periodo (datas inclusive)."""
+    inicio = datetime.strptime(data_inicio, "%Y-%m-%d")
+    fim = datetime.strptime(data_fim, "%Y-%m-%d").replace(hour=23, minute=59, second=59)
+    stmt = (
+        select(Conversa.id, Conversa.empresa_id)
+        .where(
+            Conversa.id.in_(
+                select(Mensagem.conversa_id).where(Mensagem.enviada_em >= inicio, Mensagem.enviada_em <= fim)
+            )
+        )
+        .order_by(Conversa.id)
+    )
+    if empresa_id is not None:
+        stmt = stmt.where(Conversa.empresa_id == empresa_id)
+    return [tuple(linha) for linha in await db.execute(stmt)]
+
+
+async def listar_conversas_desatualizadas(
+    db: AsyncSession,
+    limite: int,
+    empresa_id: int | None = None,
+    mensagem_ate: datetime | None = None,
+) -> list[tuple[int, int | None]]:
+    """(conversa_id, empresa_id) das conversas com mensagens que a ultima analise nao viu.
+
+    Compara a contagem de mensagens do estado incremental com as mensagens
+    cobertas pela ultima analise, sem varrer `mensagens`: pega tambem mensagem
+    que chegou durante a chamada a OpenAI ou atrasada com `enviada_em` antigo.
+    Analises sem contagem (anteriores a migracao 11) comparam datas. Nunca
+    analisadas primeiro, depois a analise mais antiga. `mensagem_ate` ignora
+    conversas ainda em andamento (ultima mensagem depois desse instante).
+    """
+    ultima_msg = case(
+        (
+            or_(
+                Conversa.ultima_msg_vendedor_em.is_(None),
+                Conversa.ultima_msg_lead_em >= Conversa.ultima_msg_vendedor_em,
+            ),
+            Conversa.ultima_msg_lead_em,
+        ),
+        else_=Conversa.ultima_msg_vendedor_em,
+    )
+    stmt = (
+        select(Conversa.id, Conversa.empresa_id)
+        .where(
+            ultima_msg.is_not(None),
+            or_(
+                Conversa.ultima_analise_em.is_(None),
+                Conversa.total_msgs_lead + Conversa.total_msgs_vendedor > Conversa.ultima_analise_msgs,
+                and_(Conversa.ultima_analise_msgs.is_(None), ultima_msg > Conversa.ultima_analise_em),
+            ),
+        )
+        .order_by(Conversa.ultima_analise_em.nulls_first(), ultima_msg, Conversa.id)
+        .limit(limite)
+    )
+    if empresa_id is not None:
+        stmt = stmt.where(Conversa.empresa_id == empresa_id)
+    if mensagem_ate is not None:
+        stmt = stmt.where(ultima_msg <= mensagem_ate)
+    return [tuple(linha) for linha in await db.execute(stmt)]
+
+
+async def buscar_mensagens_para_analise(db: AsyncSession, conversa_ids: list[int]) -> dict[int, list[dict]]:
+    """Mensagens de varias conversas num unico SELECT, no formato de analisar_conversa()."""
+    stmt = (
+        select(Mensagem.conversa_id, Mensagem.remetente, Mensagem.conteudo, Mensagem.enviada_em)
+        .where(Mensagem.conversa_id.in_(conversa_ids))
+        .order_by(Mensagem.conversa_id, Mensagem.enviada_em, Mensagem.id)
+    )
+    por_conversa: dict[int, list[dict]] = {id_: [] for id_ in conversa_ids}
+    for conversa_id, remetente, conteudo, enviada_em in await db.execute(stmt):
+        por_conversa[conversa_id].append(
+            {"remetente": remetente, "conteudo": conteudo, "enviada_em": str(enviada_em)}
+        )
+    return por_conversa
+
+
+async def salvar_analises_lote(db: AsyncSession, analises: list[dict]) -> list[Analise]:
+    """Grava varias analises numa transacao (mesmos campos de salvar_analise, `erros` como lista).
+
+    O ponteiro da analise mais recente vem do insert (models.py); as metricas
+    dos dias afetados sao marcadas uma unica vez.
+    """
+    if not analises:
+        return []
+    agora = datetime.now()
+    objetos = [
+        Analise(**{**a, "erros": json.dumps(a["erros"], ensure_ascii=False)}, analisada_em=agora)
+        for a in analises
+    ]
+    db.add_all(objetos)
+    await db.flush()
+    pares = (await db.execute(consulta_dias_conversas([a.conversa_id for a in objetos]))).all()
+    await marcar_metricas_pendentes(db, pares)
+    await db.commit()
+    return objetos
+
+
+async def buscar_analises_por_conversa(db: AsyncSession, conversa_id: int) -> list[Analise]:
+    """Busca todas as analises de uma conversa, mais recente primeiro."""
+    stmt = (
+        select(Analise)
+        .where(Analise.conversa_id == conversa_id)
+        .order_by(Analise.analisada_em.desc())
+    )
+    return list(await db.scalars(stmt))
+
+
+# === Queries de Metricas ===
+
+
+async def marcar_metricas_pendentes(db: AsyncSession, pares) -> None:
+    """Marca pares (vendedor_id, data) para o recalculo incremental. Nao faz commit."""
+    agora = datetime.now()
+    linhas = [{"vendedor_id": vid, "data": str(dia), "marcada_em": agora} for vid, dia in set(pares)]
+    if not linhas:
+        return
+    stmt = insert_para(db)(MetricaPendente)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["vendedor_id", "data"],
+        set_={"marcada_em": stmt.excluded.marcada_em},
+    )
+    await db.execute(stmt, linhas)
+
+
+async def buscar_metricas_vendedor(
+    db: AsyncSession, vendedor_id: int, limit: int = 30
+) -> list[MetricaDiaria]:
+    """Historico de metricas de um vendedor, mais recente primeiro."""
+    stmt = (
+        select(MetricaDiaria)
+        .where(MetricaDiaria.vendedor_id == vendedor_id)
+        .order_by(MetricaDiaria.data.desc())
+        .limit(limit)
+    )
+    return list(await db.scalars(stmt))
+
+
+async def buscar_metricas_dia(
+    db: AsyncSession, data: str, empresa_id: int | None = None
+) -> list[MetricaDiaria]:
+    """Metricas de todos os vendedores num dia, opcionalmente filtrado por empresa."""
+    stmt = select(MetricaDiaria).where(MetricaDiaria.data == data)
+    if empresa_id is not None:
+        stmt = stmt.join(Vendedor).where(Vendedor.empresa_id == empresa_id)
+    return list(await db.scalars(stmt))
+
+
+async def buscar_sketches_periodo(
+    db: AsyncSession, data_inicio: str, data_fim: str,
+    empresa_id: int | None = None, vendedor_id: int | None = None,
+) -> list[tuple[int, bytes | None, bytes | None]]:
+    """(vendedor_id, sketch_primeira_resp, sketch_resposta) das metricas do periodo."""
+    stmt = select(
+        MetricaDiaria.vendedor_id, MetricaDiaria.sketch_primeira_resp, MetricaDiaria.sketch_resposta
+    ).where(MetricaDiaria.data >= data_inicio, MetricaDiaria.data <= data_fim)
+    if empresa_id is not None:
+        stmt = stmt.join(Vendedor).where(Vendedor.empresa_id == empresa_id)
+    if vendedor_id is not None:
+        stmt = stmt.where(MetricaDiaria.vendedor_id == vendedor_id)
+    return [tuple(linha) for linha in await db.execute(stmt)]
@@ -4,15 +4,23 @@ import logging
 from contextlib import asynccontextmanager
 
 from fastapi import Depends, FastAPI, Header, HTTPException, Query
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.config import settings
-from src.database.connection import SessionLocal, criar_tabelas
-from src.database.models import Conversa, Mensagem, Vendedor
+from src.database.connection import async_engine, criar_tabelas, get_async_db
+from src.database.migrations import aplicar_migracoes
+from src.database.queries_async import (
+    listar_conversas_empresa,
+    listar_mensagens_conversa,
+    listar_vendedores,
+)
+from src.analysis.analyzer import clientes_openai
 from src.analysis.router import router as analysis_router
 from src.metrics.router import router as metrics_router
 from src.reports.router import router as reports_router
 from src.reports.scheduler import iniciar_scheduler, parar_scheduler, recarregar_jobs
+from src.whatsapp.ingest import fila_ingestao
+from src.whatsapp.journal import journal
 from src.whatsapp.webhook import router as webhook_router
 
 # Configurar logging
@@ -28,11 +36,21 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("Iniciando Agente Comercial...")
     criar_tabelas()
+    if settings.migrar_na_inicializacao:
+        aplicar_migracoes()
     logger.info("Banco de dados pronto.")
     iniciar_scheduler()
+    if settings.journal_habilitado:
+        journal.abrir()
+    if settings.ingest_assincrono:
+        await fila_ingestao.iniciar()
     yield
     # Shutdown
+    await fila_ingestao.parar()
+    await journal.fechar()
     parar_scheduler()
+    await clientes_openai.fechar()
+    await async_engine.dispose()
     logger.info("Agente Comercial encerrado.")
 
 
@@ -51,14 +69,6 @@ app.include_router(metrics_router)
 app.include_router(reports_router)
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 def validar_admin_key(x_admin_key: str = Header(...)):
     """Valida admin_key no header para endpoints internos."""
     if x_admin_key != settings.admin_key:
@@ -82,14 +92,10 @@ async def health():
 @app.get("/vendedores", dependencies=[Depends(validar_admin_key)])
 async def api_listar_vendedores(
     empresa_id: int = Query(..., description="ID da empresa"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Lista vendedores de uma empresa (requer admin_key)."""
-    vendedores = (
-        db.query(Vendedor)
-        .filter(Vendedor.empresa_id == empresa_id)
-        .all()
-    )
+    vendedores = await listar_vendedores(db, empresa_id=empresa_id, apenas_ativos=False)
     return [
         {"id": v.id, "nome": v.nome, "telefone": v.telefone, "ativo": v.ativo}
         for v in vendedores
@@ -99,15 +105,10 @@ async def api_listar_vendedores(
 @app.get("/conversas", dependencies=[Depends(validar_admin_key)])
 async def api_listar_conversas(
     empresa_id: int = Query(..., description="ID da empresa"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Lista conversas de uma empresa (requer admin_key)."""
-    conversas = (
-        db.query(Conversa)
-        .filter(Conversa.empresa_id == empresa_id)
-        .order_by(Conversa.atualizada_em.desc())
-        .all()
-    )
+    conversas = await listar_conversas_empresa(db, empresa_id)
     return [
         {
             "id": c.id,
@@ -123,14 +124,9 @@ async def api_listar_conversas(
 
 
 @app.get("/conversas/{conversa_id}/mensagens", dependencies=[Depends(validar_admin_key)])
-async def api_listar_mensagens(conversa_id: int, db: Session = Depends(get_db)):
+async def api_listar_mensagens(conversa_id: int, db: AsyncSession = Depends(get_async_db)):
     """Lista mensagens de uma conversa (requer admin_key)."""
-    mensagens = (
-        db.query(Mensagem)
-        .filter_by(conversa_id=conversa_id)
-        .order_by(Mensagem.enviada_em)
-        .all()
-    )
+    mensagens = await listar_mensagens_conversa(db, conversa_id)
     return [
         {
             "id": m.id,
@@ -150,3 +146,7 @@ async def api_recarregar_scheduler():
     return {"status": "ok", "mensagem": "Jobs do scheduler recarregados"}
 
 
+@app.get("/admin/ingestao/status", dependencies=[Depends(validar_admin_key)])
+async def api_status_ingestao():
+    """Profundidade da fila de ingestao, tamanho dos lotes e latencia de flush."""
+    return fila_ingestao.status()
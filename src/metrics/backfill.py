@@ -0,0 +1,182 @@
+"""Backfill paralelo de metricas diarias por (empresa, dia).
+
+Cada tarefa recalcula todos os vendedores de uma empresa num dia com o
+motor SQL e grava as MetricaDiaria num unico upsert. As tarefas rodam num
+pool de processos, cada worker com o seu engine. Os rollups semanais e
+mensais sao refeitos uma vez no final (dias da mesma semana em workers
+diferentes disputariam a mesma linha de rollup).
+
+O checkpoint (JSON) guarda as tarefas concluidas: rodar de novo pula o que
+ja foi feito.
+"""
+
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Callable
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from src.config import settings
+from src.database.connection import SessionLocal, engine as engine_padrao
+from src.database.queries import (
+    listar_empresas,
+    listar_metricas_pendentes,
+    listar_vendedores,
+    remover_metricas_pendentes,
+)
+from src.metrics.calculator import atualizar_metricas_horarias, calcular_valores_sql, salvar_metricas
+from src.metrics.rollups import atualizar_rollups_intervalo
+
+logger = logging.getLogger(__name__)
+
+Tarefa = tuple[int | None, str]  # (empresa_id, data)
+
+# Sessoes do worker (um engine por processo, criado no initializer do pool)
+_SessaoWorker: sessionmaker | None = None
+
+
+def tarefas_backfill(data_inicio: str, data_fim: str, empresa_ids: list[int | None]) -> list[Tarefa]:
+    """Uma tarefa por (empresa, dia) do intervalo, dias mais recentes primeiro."""
+    inicio, fim = date.fromisoformat(data_inicio), date.fromisoformat(data_fim)
+    dias = [(fim - timedelta(days=i)).isoformat() for i in range((fim - inicio).days + 1)]
+    return [(empresa_id, dia) for dia in dias for empresa_id in empresa_ids]
+
+
+def _chave(tarefa: Tarefa) -> str:
+    empresa_id, data = tarefa
+    return f"{empresa_id if empresa_id is not None else '-'}:{data}"
+
+
+def carregar_checkpoint(caminho: Path) -> set[str]:
+    if not Path(caminho).exists():
+        return set()
+    return set(json.loads(Path(caminho).read_text())["concluidas"])
+
+
+def salvar_checkpoint(caminho: Path, concluidas: set[str]) -> None:
+    """Grava de forma atomica (arquivo temporario + rename)."""
+    caminho = Path(caminho)
+    caminho.parent.mkdir(parents=True, exist_ok=True)
+    tmp = caminho.with_suffix(".tmp")
+    tmp.write_text(json.dumps({"concluidas": sorted(concluidas)}))
+    os.replace(tmp, caminho)
+
+
+def _iniciar_worker(database_url: str) -> None:
+    global _SessaoWorker
+    if database_url.startswith("sqlite"):
+        engine = create_engine(database_url, connect_args={"timeout": 60})
+    else:
+        engine = create_engine(database_url, pool_size=1, max_overflow=0, pool_pre_ping=True)
+    _SessaoWorker = sessionmaker(bind=engine)
+
+
+def calcular_tarefa(tarefa: Tarefa) -> int:
+    """Recalcula as metricas diarias (e o rollup horario) de uma empresa num dia.
+
+    Remove as pendencias do dia lidas antes do calculo, como recalcular_pendentes.
+
+    Returns:
+        Quantidade de vendedor-dias gravados.
+    """
+    empresa_id, data = tarefa
+    db = (_SessaoWorker or SessionLocal)()
+    try:
+        vendedor_ids = [v.id for v in listar_vendedores(db, empresa_id=empresa_id)]
+        if not vendedor_ids:
+            return 0
+        pendentes = listar_metricas_pendentes(db, empresa_id=empresa_id, data=data)
+        atualizar_metricas_horarias(db, data, vendedor_ids, empresa_id)
+        valores = calcular_valores_sql(db, data, vendedor_ids, empresa_id)
+        gravadas = salvar_metricas(db, data, valores)
+        remover_metricas_pendentes(db, pendentes)
+        return len(gravadas)
+    finally:
+        db.close()
+
+
+def executar_backfill(
+    data_inicio: str,
+    data_fim: str,
+    empresa_ids: list[int] | None = None,
+    workers: int | None = None,
+    checkpoint: Path | None = None,
+    ao_progredir: Callable[[dict], None] | None = None,
+) -> dict:
+    """Recalcula metricas do intervalo em paralelo e refaz os rollups no final.
+
+    Args:
+        empresa_ids: padrao: todas as empresas ativas. Lista vazia (ou nenhuma
+            empresa cadastrada): todos os vendedores, sem filtro de empresa
+        workers: processos do pool (padrao: CPUs da maquina)
+        checkpoint: arquivo JSON das tarefas concluidas; None desliga a retomada
+        ao_progredir: chamado a cada tarefa concluida com o resumo parcial
+
+    Returns:
+        {"tarefas", "puladas", "concluidas", "falhas", "vendedor_dias", "segundos"}
+    """
+    if empresa_ids is None:
+        db = SessionLocal()
+        try:
+            empresa_ids = [e.id for e in listar_empresas(db, apenas_ativas=True)]
+        finally:
+            db.close()
+    alvos: list[int | None] = list(empresa_ids) or [None]
+
+    todas = tarefas_backfill(data_inicio, data_fim, alvos)
+    concluidas = carregar_checkpoint(checkpoint) if checkpoint else set()
+    pendentes = [t for t in todas if _chave(t) not in concluidas]
+    resumo = {
+        "tarefas": len(todas), "puladas": len(todas) - len(pendentes),
+        "concluidas": 0, "falhas": 0, "vendedor_dias": 0, "segundos": 0.0,
+    }
+
+    # Conexoes abertas antes do fork nao podem ser herdadas pelos workers
+    engine_padrao.dispose()
+    inicio = time.monotonic()
+    with ProcessPoolExecutor(
+        max_workers=workers or os.cpu_count(),
+        initializer=_iniciar_worker,
+        initargs=(settings.database_url,),
+    ) as pool:
+        futuros = {pool.submit(calcular_tarefa, tarefa): tarefa for tarefa in pendentes}
+        for futuro in as_completed(futuros):
+            tarefa = futuros[futuro]
+            try:
+                resumo["vendedor_dias"] += futuro.result()
+            except Exception as e:
+                resumo["falhas"] += 1
+                logger.error(f"Backfill: falha em empresa={tarefa[0]} data={tarefa[1]}: {e}")
+            else:
+                resumo["concluidas"] += 1
+                concluidas.add(_chave(tarefa))
+                if checkpoint and resumo["concluidas"] % 50 == 0:
+                    salvar_checkpoint(checkpoint, concluidas)
+            resumo["segundos"] = time.monotonic() - inicio
+            if ao_progredir:
+                ao_progredir(dict(resumo))
+
+    if checkpoint:
+        salvar_checkpoint(checkpoint, concluidas)
+
+    db = SessionLocal()
+    try:
+        for empresa_id in alvos:
+            vendedor_ids = [v.id for v in listar_vendedores(db, empresa_id=empresa_id)]
+            atualizar_rollups_intervalo(db, data_inicio, data_fim, vendedor_ids)
+    finally:
+        db.close()
+
+    resumo["segundos"] = time.monotonic() - inicio
+    logger.info(
+        f"Backfill {data_inicio}..{data_fim}: {resumo['concluidas']} tarefa(s), "
+        f"{resumo['vendedor_dias']} vendedor-dia(s), {resumo['falhas']} falha(s) "
+        f"em {resumo['segundos']:.1f}s"
+    )
+    return resumo
@@ -1,25 +1,48 @@
 """Motor de calculo de metricas diarias por vendedor — multi-tenant."""
 
 import logging
-from dataclasses import dataclass
+from collections import defaultdict
+from dataclasses import dataclass, field
 from datetime import datetime
 
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, case, exists, extract, func, or_, select
+from sqlalchemy.orm import Session, aliased
 
-from src.database.models import Conversa, Mensagem
+from src.config import settings
+from src.database.models import Conversa, Mensagem, Vendedor
 from src.database.queries import (
     buscar_conversas_do_dia,
+    buscar_metricas_periodo,
+    consulta_inicio_turno_pendente,
+    listar_metricas_pendentes,
     listar_vendedores,
-    upsert_metrica_diaria,
+    remover_metricas_pendentes,
+    substituir_metricas_horarias,
+    upsert_metricas_diarias,
 )
+from src.metrics.rollups import atualizar_rollups
+from src.metrics.sketch import sketch_de_valores
 
 logger = logging.getLogger(__name__)
 
+# Valores calculados de MetricaDiaria (mesmas chaves dos dicts retornados)
+CAMPOS_METRICA = (
+    "total_atendimentos",
+    "tempo_primeira_resp_seg",
+    "tempo_medio_resposta_seg",
+    "total_mql",
+    "total_sql",
+    "total_conversoes",
+    "score_medio",
+    "leads_sem_resposta",
+)
+
 
 @dataclass
 class TemposResposta:
     primeira_resposta_seg: int | None
     media_resposta_seg: int | None
+    deltas: list[int] = field(default_factory=list)  # cada tempo de resposta da conversa
 
 
 def calcular_tempos_resposta(mensagens: list[Mensagem]) -> TemposResposta:
@@ -40,30 +63,21 @@ def calcular_tempos_resposta(mensagens: list[Mensagem]) -> TemposResposta:
             timestamp_lead = None
 
     media = round(sum(deltas) / len(deltas)) if deltas else None
-    return TemposResposta(primeira_resposta_seg=primeira_resposta, media_resposta_seg=media)
+    return TemposResposta(primeira_resposta_seg=primeira_resposta, media_resposta_seg=media, deltas=deltas)
 
 
 def _contar_funil(conversas: list[Conversa]) -> dict[str, int]:
     """Conta conversas por classificacao da analise mais recente."""
     contagem = {"mql": 0, "sql": 0, "cliente": 0}
     for conversa in conversas:
-        if not conversa.analises:
-            continue
-        mais_recente = max(conversa.analises, key=lambda a: a.analisada_em)
-        if mais_recente.classificacao in contagem:
-            contagem[mais_recente.classificacao] += 1
+        if conversa.ultima_classificacao in contagem:
+            contagem[conversa.ultima_classificacao] += 1
     return contagem
 
 
 def _calcular_score_medio(conversas: list[Conversa]) -> float | None:
     """Media dos score_qualidade das analises mais recentes."""
-    scores = []
-    for conversa in conversas:
-        if not conversa.analises:
-            continue
-        mais_recente = max(conversa.analises, key=lambda a: a.analisada_em)
-        if mais_recente.score_qualidade is not None:
-            scores.append(mais_recente.score_qualidade)
+    scores = [c.ultimo_score for c in conversas if c.ultimo_score is not None]
     return round(sum(scores) / len(scores), 1) if scores else None
 
 
@@ -78,62 +92,259 @@ def _contar_leads_sem_resposta(conversas: list[Conversa]) -> int:
     return sem_resposta
 
 
-def calcular_metricas_vendedor(
-    db: Session, vendedor_id: int, data: str, conversas: list[Conversa]
-) -> dict:
-    """Calcula e persiste metricas de um vendedor para um dia."""
-    funil = _contar_funil(conversas)
-    score = _calcular_score_medio(conversas)
-    sem_resposta = _contar_leads_sem_resposta(conversas)
-
-    # Calcular tempos de resposta agregados
-    tempos_primeira = []
-    tempos_media = []
-    for conversa in conversas:
-        if not conversa.mensagens:
-            continue
-        tempos = calcular_tempos_resposta(conversa.mensagens)
-        if tempos.primeira_resposta_seg is not None:
-            tempos_primeira.append(tempos.primeira_resposta_seg)
-        if tempos.media_resposta_seg is not None:
-            tempos_media.append(tempos.media_resposta_seg)
-
-    primeira_resp = (
-        round(sum(tempos_primeira) / len(tempos_primeira))
-        if tempos_primeira
-        else None
+def _agregar_tempos(tempos: list[TemposResposta]) -> tuple[int | None, int | None]:
+    """Media (arredondada) dos tempos por conversa: (primeira resposta, resposta media)."""
+    primeiras = [t.primeira_resposta_seg for t in tempos if t.primeira_resposta_seg is not None]
+    medias = [t.media_resposta_seg for t in tempos if t.media_resposta_seg is not None]
+    return (
+        round(sum(primeiras) / len(primeiras)) if primeiras else None,
+        round(sum(medias) / len(medias)) if medias else None,
     )
-    media_resp = (
-        round(sum(tempos_media) / len(tempos_media))
-        if tempos_media
-        else None
+
+
+def _sketches_tempos(tempos: list[TemposResposta]) -> dict[str, bytes | None]:
+    """Sketches de quantis (ver sketch.py): primeira resposta por conversa e todas as respostas."""
+    return {
+        "sketch_primeira_resp": sketch_de_valores(
+            [t.primeira_resposta_seg for t in tempos if t.primeira_resposta_seg is not None]
+        ),
+        "sketch_resposta": sketch_de_valores([delta for t in tempos for delta in t.deltas]),
+    }
+
+
+def salvar_metricas(db: Session, data: str, valores: dict[int, dict]) -> list[dict]:
+    """Grava as metricas do dia de varios vendedores num unico upsert (uma transacao).
+
+    Args:
+        valores: {vendedor_id: valores da MetricaDiaria}
+
+    Returns:
+        Um dict por vendedor (metrica_id, vendedor_id, data e CAMPOS_METRICA), na ordem recebida.
+    """
+    agora = datetime.now()
+    ids = upsert_metricas_diarias(
+        db, [(vid, data, {"calculada_em": agora, **v}) for vid, v in valores.items()]
     )
+    if valores:
+        logger.info(
+            f"Metricas calculadas: data={data} vendedores={len(valores)} "
+            f"atendimentos={sum(v['total_atendimentos'] for v in valores.values())}"
+        )
+    return [
+        {
+            "metrica_id": ids[(vid, data)],
+            "vendedor_id": vid,
+            "data": data,
+            **{campo: v[campo] for campo in CAMPOS_METRICA},
+        }
+        for vid, v in valores.items()
+    ]
+
 
-    valores = {
+def valores_metricas_vendedor(conversas: list[Conversa]) -> dict:
+    """Valores da MetricaDiaria de um vendedor a partir das conversas do dia (motor Python)."""
+    funil = _contar_funil(conversas)
+    tempos = [calcular_tempos_resposta(c.mensagens) for c in conversas if c.mensagens]
+    primeira_resp, media_resp = _agregar_tempos(tempos)
+
+    return {
         "total_atendimentos": len(conversas),
         "tempo_primeira_resp_seg": primeira_resp,
         "tempo_medio_resposta_seg": media_resp,
         "total_mql": funil["mql"],
         "total_sql": funil["sql"],
         "total_conversoes": funil["cliente"],
-        "score_medio": score,
-        "leads_sem_resposta": sem_resposta,
+        "score_medio": _calcular_score_medio(conversas),
+        "leads_sem_resposta": _contar_leads_sem_resposta(conversas),
+        **_sketches_tempos(tempos),
     }
 
-    metrica = upsert_metrica_diaria(db, vendedor_id, data, **valores)
-    logger.info(f"Metricas calculadas: vendedor={vendedor_id} data={data} atendimentos={len(conversas)}")
 
+def calcular_metricas_vendedor(
+    db: Session, vendedor_id: int, data: str, conversas: list[Conversa]
+) -> dict:
+    """Calcula e persiste metricas de um vendedor para um dia."""
+    return salvar_metricas(db, data, {vendedor_id: valores_metricas_vendedor(conversas)})[0]
+
+
+# === Motor SQL ===
+#
+# Mesmo resultado do motor Python, mas com agregacoes set-based para todos os
+# vendedores do dia de uma vez (3 queries), sem carregar conversas no ORM.
+# As mensagens consideradas sao as mesmas de buscar_conversas_do_dia(): as do
+# dia mais o inicio do turno do lead pendente antes da meia-noite.
+
+
+def _conversas_do_dia_sql(data: str, vendedor_ids: list[int], empresa_id: int | None):
+    """Subquery (conversa_id, vendedor_id) das conversas com mensagem no dia."""
+    inicio = datetime.strptime(data, "%Y-%m-%d")
+    fim = inicio.replace(hour=23, minute=59, second=59)
+    stmt = select(Conversa.id.label("conversa_id"), Conversa.vendedor_id).where(
+        Conversa.vendedor_id.in_(vendedor_ids),
+        exists().where(
+            Mensagem.conversa_id == Conversa.id,
+            Mensagem.enviada_em >= inicio,
+            Mensagem.enviada_em <= fim,
+        ),
+    )
+    if empresa_id is not None:
+        stmt = stmt.where(Conversa.empresa_id == empresa_id)
+    return stmt.subquery("conversas_dia")
+
+
+def _mensagens_janela_sql(data: str, conversas_dia):
+    """Subquery (vendedor_id, conversa_id, id, remetente, enviada_em) das mensagens do calculo."""
+    inicio = datetime.strptime(data, "%Y-%m-%d")
+    fim = inicio.replace(hour=23, minute=59, second=59)
+    ids_conversas = select(conversas_dia.c.conversa_id)
+    stmt = (
+        select(
+            conversas_dia.c.vendedor_id,
+            Mensagem.conversa_id,
+            Mensagem.id,
+            Mensagem.remetente,
+            Mensagem.enviada_em,
+        )
+        .join(Mensagem, Mensagem.conversa_id == conversas_dia.c.conversa_id)
+        .where(or_(
+            and_(Mensagem.enviada_em >= inicio, Mensagem.enviada_em <= fim),
+            Mensagem.id.in_(consulta_inicio_turno_pendente(ids_conversas, inicio)),
+        ))
+    )
+    return stmt.subquery("mensagens_janela")
+
+
+def _contagens_sql(db: Session, mensagens) -> dict[int, tuple[int, int]]:
+    """vendedor_id -> (total_atendimentos, leads_sem_resposta)."""
+    por_conversa = (
+        select(
+            mensagens.c.vendedor_id,
+            func.sum(case((mensagens.c.remetente == "lead", 1), else_=0)).label("msgs_lead"),
+            func.sum(case((mensagens.c.remetente == "vendedor", 1), else_=0)).label("msgs_vendedor"),
+        )
+        .group_by(mensagens.c.vendedor_id, mensagens.c.conversa_id)
+        .subquery()
+    )
+    sem_resposta = and_(por_conversa.c.msgs_lead > 0, por_conversa.c.msgs_vendedor == 0)
+    stmt = select(
+        por_conversa.c.vendedor_id,
+        func.count(),
+        func.sum(case((sem_resposta, 1), else_=0)),
+    ).group_by(por_conversa.c.vendedor_id)
+    return {vid: (total, sem) for vid, total, sem in db.execute(stmt)}
+
+
+def _analises_sql(db: Session, conversas_dia) -> dict[int, dict]:
+    """vendedor_id -> contagens do funil e soma/quantidade de scores (analise mais recente)."""
+
+    def contar(classificacao: str):
+        return func.sum(case((Conversa.ultima_classificacao == classificacao, 1), else_=0))
+
+    stmt = (
+        select(
+            conversas_dia.c.vendedor_id,
+            contar("mql"),
+            contar("sql"),
+            contar("cliente"),
+            func.sum(Conversa.ultimo_score),
+            func.count(Conversa.ultimo_score),
+        )
+        .join(Conversa, Conversa.id == conversas_dia.c.conversa_id)
+        .where(Conversa.ultima_analise_id.is_not(None))
+        .group_by(conversas_dia.c.vendedor_id)
+    )
     return {
-        "metrica_id": metrica.id,
-        "vendedor_id": vendedor_id,
-        "data": data,
-        **valores,
+        vid: {"mql": mql, "sql": sql_, "cliente": cliente, "soma_score": soma, "qtd_score": qtd}
+        for vid, mql, sql_, cliente, soma, qtd in db.execute(stmt)
     }
 
 
+def _turnos_sql(db: Session, mensagens) -> list[tuple[int, int, datetime, datetime]]:
+    """(vendedor_id, conversa_id, inicio do turno do lead, resposta) de cada turno respondido.
+
+    Cada mensagem recebe o numero de respostas do vendedor antes dela (SUM
+    acumulado em janela). Leads com o mesmo numero formam um turno, fechado
+    pela resposta seguinte do vendedor — igual a calcular_tempos_resposta().
+    """
+    e_vendedor = case((mensagens.c.remetente == "vendedor", 1), else_=0)
+    ordenadas = select(
+        mensagens.c.vendedor_id,
+        mensagens.c.conversa_id,
+        mensagens.c.remetente,
+        mensagens.c.enviada_em,
+        func.sum(e_vendedor).over(
+            partition_by=mensagens.c.conversa_id,
+            order_by=(mensagens.c.enviada_em, mensagens.c.id),
+        ).label("respostas_ate_aqui"),
+    ).subquery()
+    # A resposta que fecha o turno ja esta contada em respostas_ate_aqui
+    turno = case(
+        (ordenadas.c.remetente == "vendedor", ordenadas.c.respostas_ate_aqui - 1),
+        else_=ordenadas.c.respostas_ate_aqui,
+    )
+    inicio_lead = func.min(case((ordenadas.c.remetente == "lead", ordenadas.c.enviada_em)))
+    resposta = func.min(case((ordenadas.c.remetente == "vendedor", ordenadas.c.enviada_em)))
+    stmt = (
+        select(ordenadas.c.vendedor_id, ordenadas.c.conversa_id, inicio_lead, resposta)
+        .group_by(ordenadas.c.vendedor_id, ordenadas.c.conversa_id, turno)
+        .having(and_(inicio_lead.isnot(None), resposta.isnot(None)))
+        .order_by(ordenadas.c.conversa_id, turno)
+    )
+    return [tuple(linha) for linha in db.execute(stmt)]
+
+
+def _tempos_sql(db: Session, mensagens) -> dict[int, list[TemposResposta]]:
+    """vendedor_id -> TemposResposta de cada conversa com ao menos uma resposta."""
+    deltas: dict[tuple[int, int], list[int]] = defaultdict(list)
+    for vid, conversa_id, inicio, fim in _turnos_sql(db, mensagens):
+        # Truncado como em calcular_tempos_resposta(); diferenca calculada em Python (portavel)
+        deltas[(vid, conversa_id)].append(int((fim - inicio).total_seconds()))
+
+    tempos: dict[int, list[TemposResposta]] = defaultdict(list)
+    for (vid, _), lista in deltas.items():
+        tempos[vid].append(TemposResposta(
+            primeira_resposta_seg=lista[0],
+            media_resposta_seg=round(sum(lista) / len(lista)),
+            deltas=lista,
+        ))
+    return tempos
+
+
+def calcular_valores_sql(
+    db: Session, data: str, vendedor_ids: list[int], empresa_id: int | None = None
+) -> dict[int, dict]:
+    """Calcula (sem persistir) os valores de MetricaDiaria de varios vendedores num dia."""
+    conversas_dia = _conversas_do_dia_sql(data, vendedor_ids, empresa_id)
+    mensagens = _mensagens_janela_sql(data, conversas_dia)
+    contagens = _contagens_sql(db, mensagens)
+    analises = _analises_sql(db, conversas_dia)
+    tempos = _tempos_sql(db, mensagens)
+
+    resultado = {}
+    for vid in vendedor_ids:
+        total, sem_resposta = contagens.get(vid, (0, 0))
+        funil = analises.get(vid, {"mql": 0, "sql": 0, "cliente": 0, "qtd_score": 0})
+        tempos_vendedor = tempos.get(vid, [])
+        primeira_resp, media_resp = _agregar_tempos(tempos_vendedor)
+        resultado[vid] = {
+            "total_atendimentos": total,
+            "tempo_primeira_resp_seg": primeira_resp,
+            "tempo_medio_resposta_seg": media_resp,
+            "total_mql": funil["mql"],
+            "total_sql": funil["sql"],
+            "total_conversoes": funil["cliente"],
+            "score_medio": (
+                round(funil["soma_score"] / funil["qtd_score"], 1) if funil["qtd_score"] else None
+            ),
+            "leads_sem_resposta": sem_resposta,
+            **_sketches_tempos(tempos_vendedor),
+        }
+    return resultado
+
+
 def calcular_metricas(
     db: Session, data: str, vendedor_id: int | None = None,
-    empresa_id: int | None = None,
+    empresa_id: int | None = None, motor: str | None = None,
 ) -> list[dict]:
     """Calcula metricas para um ou todos os vendedores num dia.
 
@@ -141,16 +352,172 @@ def calcular_metricas(
         data: formato YYYY-MM-DD
         vendedor_id: se informado, calcula so para esse vendedor
         empresa_id: se informado, filtra vendedores da empresa
+        motor: "sql" (agregacoes no banco) ou "python" (ORM, por vendedor).
+            Padrao: settings.metricas_motor
     """
+    motor = motor or settings.metricas_motor
+    if motor not in ("sql", "python"):
+        raise ValueError(f"Motor de metricas invalido: {motor}")
+
     if vendedor_id is not None:
-        conversas = buscar_conversas_do_dia(db, data, vendedor_id, empresa_id=empresa_id)
-        return [calcular_metricas_vendedor(db, vendedor_id, data, conversas)]
+        vendedor_ids = [vendedor_id]
+    else:
+        vendedor_ids = [v.id for v in listar_vendedores(db, empresa_id=empresa_id)]
+    return _calcular_vendedores(db, data, vendedor_ids, empresa_id, motor)
+
+
+def _calcular_vendedores(
+    db: Session, data: str, vendedor_ids: list[int], empresa_id: int | None, motor: str
+) -> list[dict]:
+    atualizar_metricas_horarias(db, data, vendedor_ids, empresa_id)
+    if motor == "sql":
+        valores = calcular_valores_sql(db, data, vendedor_ids, empresa_id) if vendedor_ids else {}
+    else:
+        valores = {
+            vid: valores_metricas_vendedor(buscar_conversas_do_dia(db, data, vid, empresa_id=empresa_id))
+            for vid in vendedor_ids
+        }
+    resultados = salvar_metricas(db, data, {vid: valores[vid] for vid in vendedor_ids})
+    atualizar_rollups(db, data, vendedor_ids)
+    return resultados
 
-    vendedores = listar_vendedores(db, empresa_id=empresa_id)
-    resultados = []
-    for vendedor in vendedores:
-        conversas = buscar_conversas_do_dia(db, data, vendedor.id, empresa_id=empresa_id)
-        resultado = calcular_metricas_vendedor(db, vendedor.id, data, conversas)
-        resultados.append(resultado)
 
+# === Rollup horario ===
+#
+# MetricaHoraria (vendedor, dia, hora) alimenta os graficos de horario de pico
+# e SLA por hora sem carregar mensagens. Recalculada sempre que a MetricaDiaria
+# do mesmo (vendedor, dia) e calculada, com qualquer motor.
+
+
+def calcular_horarias_sql(
+    db: Session, data: str, vendedor_ids: list[int], empresa_id: int | None = None
+) -> list[dict]:
+    """Linhas de MetricaHoraria (sem persistir) de varios vendedores num dia."""
+    if not vendedor_ids:
+        return []
+    inicio = datetime.strptime(data, "%Y-%m-%d")
+    fim = inicio.replace(hour=23, minute=59, second=59)
+    conversas_dia = _conversas_do_dia_sql(data, vendedor_ids, empresa_id)
+
+    anterior = aliased(Mensagem)
+    lead_novo = and_(
+        Mensagem.remetente == "lead",
+        ~exists().where(
+            anterior.conversa_id == Mensagem.conversa_id,
+            anterior.remetente == "lead",
+            or_(
+                anterior.enviada_em < Mensagem.enviada_em,
+                and_(anterior.enviada_em == Mensagem.enviada_em, anterior.id < Mensagem.id),
+            ),
+        ),
+    )
+    hora = extract("hour", Mensagem.enviada_em)
+    contagens = (
+        select(
+            conversas_dia.c.vendedor_id,
+            hora,
+            func.sum(case((Mensagem.remetente == "lead", 1), else_=0)),
+            func.sum(case((Mensagem.remetente == "vendedor", 1), else_=0)),
+            func.sum(case((lead_novo, 1), else_=0)),
+        )
+        .join(Mensagem, Mensagem.conversa_id == conversas_dia.c.conversa_id)
+        .where(Mensagem.enviada_em >= inicio, Mensagem.enviada_em <= fim)
+        .group_by(conversas_dia.c.vendedor_id, hora)
+    )
+
+    empresas = dict(db.query(Vendedor.id, Vendedor.empresa_id).filter(Vendedor.id.in_(vendedor_ids)))
+    linhas: dict[tuple[int, int], dict] = {}
+
+    def linha(vid: int, h: int) -> dict:
+        return linhas.setdefault((vid, h), {
+            "vendedor_id": vid, "data": data, "hora": h, "empresa_id": empresas.get(vid),
+            "msgs_lead": 0, "msgs_vendedor": 0, "leads_novos": 0,
+            "respostas": 0, "respostas_no_sla": 0, "soma_resposta_seg": 0,
+        })
+
+    for vid, h, msgs_lead, msgs_vendedor, leads_novos in db.execute(contagens):
+        item = linha(vid, int(h))
+        item.update(msgs_lead=msgs_lead, msgs_vendedor=msgs_vendedor, leads_novos=leads_novos)
+
+    # Resposta conta na hora em que foi enviada
+    for vid, _, inicio_turno, resposta in _turnos_sql(db, _mensagens_janela_sql(data, conversas_dia)):
+        delta = int((resposta - inicio_turno).total_seconds())
+        item = linha(vid, resposta.hour)
+        item["respostas"] += 1
+        item["soma_resposta_seg"] += delta
+        item["respostas_no_sla"] += delta <= settings.metricas_sla_resposta_seg
+    return list(linhas.values())
+
+
+def atualizar_metricas_horarias(
+    db: Session, data: str, vendedor_ids: list[int], empresa_id: int | None = None
+) -> int:
+    """Recalcula e substitui o rollup horario dos vendedores no dia. Retorna as linhas gravadas."""
+    linhas = calcular_horarias_sql(db, data, vendedor_ids, empresa_id)
+    substituir_metricas_horarias(db, data, vendedor_ids, linhas)
+    return len(linhas)
+
+
+# === Recalculo incremental ===
+#
+# A ingestao e as analises marcam (vendedor_id, data) em metricas_pendentes;
+# o scheduler chama recalcular_pendentes() a cada poucos minutos e so esses
+# pares sao recalculados. Dashboard e relatorio leem MetricaDiaria pronta.
+
+
+def recalcular_pendentes(
+    db: Session, empresa_id: int | None = None, data: str | None = None,
+    motor: str | None = None,
+) -> int:
+    """Recalcula as metricas marcadas como pendentes. Retorna quantos pares processou.
+
+    Args:
+        empresa_id: se informado, so pendencias de vendedores da empresa
+        data: se informado, so pendencias desse dia (YYYY-MM-DD)
+    """
+    motor = motor or settings.metricas_motor
+    if motor not in ("sql", "python"):
+        raise ValueError(f"Motor de metricas invalido: {motor}")
+
+    pendentes = listar_metricas_pendentes(db, empresa_id=empresa_id, data=data)
+    por_dia: dict[str, list[int]] = defaultdict(list)
+    for vendedor_id, dia, _ in pendentes:
+        por_dia[dia].append(vendedor_id)
+
+    for dia, vendedor_ids in sorted(por_dia.items()):
+        _calcular_vendedores(db, dia, vendedor_ids, None, motor)
+    # Marcacoes feitas durante o calculo (marcada_em mais nova) continuam pendentes
+    remover_metricas_pendentes(db, pendentes)
+    if pendentes:
+        logger.info(f"Recalculo incremental: {len(pendentes)} metrica(s) em {len(por_dia)} dia(s)")
+    return len(pendentes)
+
+
+def metricas_do_dia(db: Session, data: str, empresa_id: int | None = None) -> list[dict]:
+    """Metricas de todos os vendedores ativos num dia, recalculando so o necessario.
+
+    Aplica as pendencias do dia e calcula apenas vendedores ainda sem
+    MetricaDiaria (ex: sem movimento). Mesmo formato de calcular_metricas().
+    """
+    recalcular_pendentes(db, empresa_id=empresa_id, data=data)
+    vendedor_ids = [v.id for v in listar_vendedores(db, empresa_id=empresa_id)]
+    prontas = {m.vendedor_id: m for m in buscar_metricas_periodo(db, data, data, empresa_id=empresa_id)}
+    faltando = [vid for vid in vendedor_ids if vid not in prontas]
+    calculadas = {
+        m["vendedor_id"]: m
+        for m in _calcular_vendedores(db, data, faltando, empresa_id, settings.metricas_motor)
+    }
+
+    resultados = []
+    for vid in vendedor_ids:
+        if vid in calculadas:
+            resultados.append(calculadas[vid])
+            continue
+        metrica = prontas[vid]
+        resultados.append({
+            "metrica_id": metrica.id,
+            "vendedor_id": vid,
+            "data": data,
+            **{campo: getattr(metrica, campo) for campo in CAMPOS_METRICA},
+        })
     return resultados
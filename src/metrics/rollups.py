@@ -0,0 +1,292 @@
+"""Rollups semanais e mensais de MetricaDiaria (tabela metricas_periodo).
+
+Periodos longos (90 dias, 1 ano) eram agregados em Python a partir de uma
+linha diaria por vendedor por dia. Cada MetricaPeriodo guarda somas e, para
+as medias, soma das medias diarias + quantidade de dias com valor: mesclar
+periodos reproduz exatamente a media das medias diarias que as paginas ja
+mostravam. Os sketches de tempo de resposta sao mesclados como no diario.
+
+Semana comeca na segunda-feira; mes no dia 1. Os rollups de (vendedor, dia)
+sao refeitos sempre que a MetricaDiaria do dia e recalculada.
+"""
+
+import calendar
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.orm import Session
+
+from src.database.dialeto import insert_para
+from src.database.models import MetricaDiaria, MetricaPeriodo, Vendedor
+from src.metrics.sketch import DDSketch
+
+GRANULARIDADES = ("semana", "mes")
+
+CAMPOS_SOMA = ("total_atendimentos", "total_mql", "total_sql", "total_conversoes", "leads_sem_resposta")
+# campo medio da MetricaDiaria -> (coluna da soma, coluna da quantidade de dias) no rollup
+CAMPOS_MEDIA = {
+    "score_medio": ("soma_score_medio", "dias_com_score"),
+    "tempo_primeira_resp_seg": ("soma_tempo_primeira_seg", "dias_com_tempo_primeira"),
+    "tempo_medio_resposta_seg": ("soma_tempo_medio_seg", "dias_com_tempo_medio"),
+}
+CAMPOS_SKETCH = ("sketch_primeira_resp", "sketch_resposta")
+
+
+def inicio_periodo(granularidade: str, dia: date) -> date:
+    """Segunda-feira da semana ou dia 1 do mes que contem `dia`."""
+    if granularidade == "semana":
+        return dia - timedelta(days=dia.weekday())
+    if granularidade == "mes":
+        return dia.replace(day=1)
+    raise ValueError(f"Granularidade invalida: {granularidade}")
+
+
+def fim_periodo(granularidade: str, inicio: date) -> date:
+    """Ultimo dia (inclusive) do periodo que comeca em `inicio`."""
+    if granularidade == "semana":
+        return inicio + timedelta(days=6)
+    if granularidade == "mes":
+        return inicio.replace(day=calendar.monthrange(inicio.year, inicio.month)[1])
+    raise ValueError(f"Granularidade invalida: {granularidade}")
+
+
+def fatiar_periodo(inicio: date, fim: date) -> list[tuple[str, date]]:
+    """Cobre [inicio, fim] com a granularidade mais grossa possivel.
+
+    Retorna (granularidade, inicio) em ordem, com granularidade em
+    "mes", "semana" ou "dia". Meses inteiros tem prioridade: uma semana que
+    invadiria um mes inteiro dentro do intervalo vira dias avulsos.
+    """
+    fatias = []
+    cursor = inicio
+    while cursor <= fim:
+        if cursor.day == 1 and fim_periodo("mes", cursor) <= fim:
+            fatias.append(("mes", cursor))
+            cursor = fim_periodo("mes", cursor) + timedelta(days=1)
+            continue
+        if cursor.weekday() == 0 and fim_periodo("semana", cursor) <= fim:
+            proximo_mes = fim_periodo("mes", cursor) + timedelta(days=1)
+            invade_mes = fim_periodo("semana", cursor) >= proximo_mes and fim_periodo("mes", proximo_mes) <= fim
+            if not invade_mes:
+                fatias.append(("semana", cursor))
+                cursor += timedelta(days=7)
+                continue
+        fatias.append(("dia", cursor))
+        cursor += timedelta(days=1)
+    return fatias
+
+
+# === Manutencao ===
+
+
+def _atualizar_periodo(db: Session, granularidade: str, inicio: date, vendedor_ids: list[int]) -> None:
+    """Reagrega as MetricaDiaria do periodo e grava (upsert) um rollup por vendedor."""
+    str_inicio = inicio.isoformat()
+    str_fim = fim_periodo(granularidade, inicio).isoformat()
+    filtro = (
+        MetricaDiaria.vendedor_id.in_(vendedor_ids),
+        MetricaDiaria.data >= str_inicio,
+        MetricaDiaria.data <= str_fim,
+    )
+
+    colunas = [func.count(MetricaDiaria.id)]
+    colunas += [func.coalesce(func.sum(getattr(MetricaDiaria, c)), 0) for c in CAMPOS_SOMA]
+    for campo in CAMPOS_MEDIA:
+        coluna = getattr(MetricaDiaria, campo)
+        colunas += [func.coalesce(func.sum(coluna), 0), func.count(coluna)]
+    agregados = db.execute(
+        select(MetricaDiaria.vendedor_id, Vendedor.empresa_id, *colunas)
+        .join(Vendedor, Vendedor.id == MetricaDiaria.vendedor_id)
+        .where(*filtro)
+        .group_by(MetricaDiaria.vendedor_id, Vendedor.empresa_id)
+    ).all()
+
+    sketches: dict[int, list[DDSketch]] = {}
+    for vendedor_id, *dados in db.execute(
+        select(MetricaDiaria.vendedor_id, *(getattr(MetricaDiaria, c) for c in CAMPOS_SKETCH)).where(*filtro)
+    ):
+        destino = sketches.setdefault(vendedor_id, [DDSketch() for _ in CAMPOS_SKETCH])
+        for sketch, bruto in zip(destino, dados):
+            if bruto:
+                sketch.mesclar(DDSketch.de_bytes(bruto))
+
+    agora = datetime.now()
+    linhas = []
+    for vendedor_id, empresa_id, dias, *valores in agregados:
+        linha = {
+            "vendedor_id": vendedor_id,
+            "empresa_id": empresa_id,
+            "granularidade": granularidade,
+            "inicio": str_inicio,
+            "dias": dias,
+            "atualizada_em": agora,
+        }
+        linha.update(zip(CAMPOS_SOMA, valores))
+        pares = valores[len(CAMPOS_SOMA):]
+        for i, (soma, quantidade) in enumerate(CAMPOS_MEDIA.values()):
+            linha[soma], linha[quantidade] = pares[2 * i], pares[2 * i + 1]
+        for campo, sketch in zip(CAMPOS_SKETCH, sketches.get(vendedor_id, ())):
+            linha[campo] = sketch.para_bytes() if sketch.contagem else None
+        linhas.append(linha)
+
+    sem_dados = set(vendedor_ids) - {linha["vendedor_id"] for linha in linhas}
+    if sem_dados:
+        db.query(MetricaPeriodo).filter(
+            MetricaPeriodo.vendedor_id.in_(sem_dados),
+            MetricaPeriodo.granularidade == granularidade,
+            MetricaPeriodo.inicio == str_inicio,
+        ).delete(synchronize_session=False)
+    if not linhas:
+        return
+
+    stmt = insert_para(db)(MetricaPeriodo)
+    atualizar = {c: stmt.excluded[c] for c in linhas[0] if c not in ("vendedor_id", "granularidade", "inicio")}
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["vendedor_id", "granularidade", "inicio"], set_=atualizar,
+    )
+    db.execute(stmt, linhas)
+
+
+def atualizar_rollups(db: Session, data: str, vendedor_ids: list[int]) -> None:
+    """Refaz a semana e o mes que contem `data` para os vendedores. Faz commit."""
+    if not vendedor_ids:
+        return
+    dia = date.fromisoformat(data)
+    for granularidade in GRANULARIDADES:
+        _atualizar_periodo(db, granularidade, inicio_periodo(granularidade, dia), vendedor_ids)
+    db.commit()
+
+
+def atualizar_rollups_intervalo(db: Session, data_inicio: str, data_fim: str, vendedor_ids: list[int]) -> int:
+    """Refaz todas as semanas e meses que tocam [data_inicio, data_fim]. Retorna periodos refeitos."""
+    if not vendedor_ids:
+        return 0
+    fim = date.fromisoformat(data_fim)
+    total = 0
+    for granularidade in GRANULARIDADES:
+        inicio = inicio_periodo(granularidade, date.fromisoformat(data_inicio))
+        while inicio <= fim:
+            _atualizar_periodo(db, granularidade, inicio, vendedor_ids)
+            inicio = fim_periodo(granularidade, inicio) + timedelta(days=1)
+            total += 1
+    db.commit()
+    return total
+
+
+# === Leitura ===
+
+
+def _linha_rollup(r: MetricaPeriodo) -> dict:
+    linha = {c: getattr(r, c) for c in ("vendedor_id", *CAMPOS_SOMA, *CAMPOS_SKETCH)}
+    for soma, quantidade in CAMPOS_MEDIA.values():
+        linha[soma], linha[quantidade] = getattr(r, soma), getattr(r, quantidade)
+    return linha
+
+
+def _linhas_periodo(
+    db: Session, data_inicio: str, data_fim: str,
+    empresa_id: int | None = None, vendedor_id: int | None = None,
+) -> list[dict]:
+    """Linhas normalizadas (rollups + dias avulsos) que cobrem o intervalo."""
+    fatias = fatiar_periodo(date.fromisoformat(data_inicio), date.fromisoformat(data_fim))
+    dias = [inicio.isoformat() for gran, inicio in fatias if gran == "dia"]
+    rollups = [(gran, inicio.isoformat()) for gran, inicio in fatias if gran != "dia"]
+    linhas = []
+
+    if rollups:
+        query = db.query(MetricaPeriodo).filter(
+            or_(*(
+                (MetricaPeriodo.granularidade == gran) & (MetricaPeriodo.inicio == inicio)
+                for gran, inicio in rollups
+            ))
+        )
+        if empresa_id is not None:
+            query = query.filter(MetricaPeriodo.empresa_id == empresa_id)
+        if vendedor_id is not None:
+            query = query.filter(MetricaPeriodo.vendedor_id == vendedor_id)
+        linhas += [_linha_rollup(r) for r in query]
+
+    if dias:
+        query = db.query(MetricaDiaria).filter(MetricaDiaria.data.in_(dias))
+        if empresa_id is not None:
+            query = query.join(Vendedor).filter(Vendedor.empresa_id == empresa_id)
+        if vendedor_id is not None:
+            query = query.filter(MetricaDiaria.vendedor_id == vendedor_id)
+        for m in query:
+            linha = {c: getattr(m, c) for c in ("vendedor_id", *CAMPOS_SOMA, *CAMPOS_SKETCH)}
+            for campo, (soma, quantidade) in CAMPOS_MEDIA.items():
+                valor = getattr(m, campo)
+                linha[soma], linha[quantidade] = (valor, 1) if valor is not None else (0, 0)
+            linhas.append(linha)
+
+    return linhas
+
+
+def _fechar_agregado(vendedor_id: int, linhas: list[dict]) -> dict:
+    agregado = {"vendedor_id": vendedor_id}
+    for campo in CAMPOS_SOMA:
+        agregado[campo] = sum(linha[campo] or 0 for linha in linhas)
+    for campo, (soma, quantidade) in CAMPOS_MEDIA.items():
+        total = sum(linha[quantidade] for linha in linhas)
+        media = sum(linha[soma] for linha in linhas) / total if total else None
+        if media is not None:
+            media = round(media, 1) if campo == "score_medio" else round(media)
+        agregado[campo] = media
+    for campo in CAMPOS_SKETCH:
+        sketch = DDSketch()
+        for linha in linhas:
+            if linha[campo]:
+                sketch.mesclar(DDSketch.de_bytes(linha[campo]))
+        agregado[campo] = sketch.para_bytes() if sketch.contagem else None
+    return agregado
+
+
+def agregar_periodo(
+    db: Session, data_inicio: str, data_fim: str,
+    empresa_id: int | None = None, vendedor_id: int | None = None,
+) -> list[dict]:
+    """Metricas somadas por vendedor no intervalo, lendo rollups sempre que possivel.
+
+    Cada dict tem vendedor_id, as somas do periodo, score_medio e tempos
+    (media das medias diarias) e os sketches mesclados do periodo.
+    """
+    por_vendedor: dict[int, list[dict]] = {}
+    for linha in _linhas_periodo(db, data_inicio, data_fim, empresa_id, vendedor_id):
+        por_vendedor.setdefault(linha["vendedor_id"], []).append(linha)
+    return [_fechar_agregado(vid, linhas) for vid, linhas in sorted(por_vendedor.items())]
+
+
+def serie_periodo(
+    db: Session, granularidade: str, data_inicio: str, data_fim: str,
+    empresa_id: int | None = None, vendedor_id: int | None = None,
+) -> list[dict]:
+    """Um ponto por semana ou mes (campo "data" = inicio do periodo), em ordem.
+
+    Sem vendedor_id, soma os rollups dos vendedores (da empresa) por periodo;
+    score e tempos seguem como media das medias diarias. Sem sketches.
+    """
+    colunas = [func.sum(getattr(MetricaPeriodo, c)) for c in CAMPOS_SOMA]
+    for soma, quantidade in CAMPOS_MEDIA.values():
+        colunas += [func.sum(getattr(MetricaPeriodo, soma)), func.sum(getattr(MetricaPeriodo, quantidade))]
+    query = db.query(MetricaPeriodo.inicio, *colunas).filter(
+        MetricaPeriodo.granularidade == granularidade,
+        MetricaPeriodo.inicio >= inicio_periodo(granularidade, date.fromisoformat(data_inicio)).isoformat(),
+        MetricaPeriodo.inicio <= data_fim,
+    )
+    if empresa_id is not None:
+        query = query.filter(MetricaPeriodo.empresa_id == empresa_id)
+    if vendedor_id is not None:
+        query = query.filter(MetricaPeriodo.vendedor_id == vendedor_id)
+
+    serie = []
+    for inicio, *valores in query.group_by(MetricaPeriodo.inicio).order_by(MetricaPeriodo.inicio):
+        linha = {"vendedor_id": vendedor_id, **dict.fromkeys(CAMPOS_SKETCH)}
+        linha.update(zip(CAMPOS_SOMA, valores))
+        pares = valores[len(CAMPOS_SOMA):]
+        for i, (soma, quantidade) in enumerate(CAMPOS_MEDIA.values()):
+            linha[soma], linha[quantidade] = pares[2 * i] or 0, pares[2 * i + 1] or 0
+        ponto = _fechar_agregado(vendedor_id, [linha])
+        for campo in CAMPOS_SKETCH:
+            del ponto[campo]
+        serie.append({"data": inicio, **ponto})
+    return serie
@@ -4,11 +4,17 @@ import logging
 from datetime import date
 
 from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from src.database.connection import get_db
-from src.database.queries import buscar_metricas_dia, buscar_metricas_vendedor
+from src.database.connection import get_async_db, get_db
+from src.database.queries_async import (
+    buscar_metricas_dia,
+    buscar_metricas_vendedor,
+    buscar_sketches_periodo,
+)
 from src.metrics.calculator import calcular_metricas
+from src.metrics.sketch import percentis_por_vendedor
 
 logger = logging.getLogger(__name__)
 
@@ -36,13 +42,13 @@ def calcular(
 
 
 @router.get("/vendedor/{vendedor_id}")
-def metricas_vendedor(
+async def metricas_vendedor(
     vendedor_id: int,
     limit: int = Query(default=30, ge=1, le=365),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Historico de metricas de um vendedor."""
-    metricas = buscar_metricas_vendedor(db, vendedor_id, limit)
+    metricas = await buscar_metricas_vendedor(db, vendedor_id, limit)
     if not metricas:
         raise HTTPException(status_code=404, detail="Nenhuma metrica encontrada.")
 
@@ -57,19 +63,20 @@ def metricas_vendedor(
             "total_conversoes": m.total_conversoes,
             "score_medio": m.score_medio,
             "leads_sem_resposta": m.leads_sem_resposta,
+            "calculada_em": m.calculada_em,
         }
         for m in metricas
     ]
 
 
 @router.get("/dia/{data}")
-def metricas_dia(
+async def metricas_dia(
     data: str,
     empresa_id: int | None = Query(default=None, description="ID da empresa"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Metricas de todos os vendedores num dia."""
-    metricas = buscar_metricas_dia(db, data, empresa_id=empresa_id)
+    metricas = await buscar_metricas_dia(db, data, empresa_id=empresa_id)
     if not metricas:
         raise HTTPException(status_code=404, detail="Nenhuma metrica encontrada para este dia.")
 
@@ -84,19 +91,38 @@ def metricas_dia(
             "total_conversoes": m.total_conversoes,
             "score_medio": m.score_medio,
             "leads_sem_resposta": m.leads_sem_resposta,
+            "calculada_em": m.calculada_em,
         }
         for m in metricas
     ]
 
 
+@router.get("/percentis")
+async def percentis(
+    inicio: date = Query(description="Data inicial YYYY-MM-DD"),
+    fim: date = Query(description="Data final YYYY-MM-DD (inclusive)"),
+    vendedor_id: int | None = Query(default=None, description="ID do vendedor (padrao: todos)"),
+    empresa_id: int | None = Query(default=None, description="ID da empresa"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """p50/p90/p99 dos tempos de resposta no periodo, mesclando os sketches diarios."""
+    if inicio > fim:
+        raise HTTPException(status_code=422, detail="inicio deve ser anterior ou igual a fim.")
+    inicio, fim = inicio.isoformat(), fim.isoformat()
+    linhas = await buscar_sketches_periodo(db, inicio, fim, empresa_id=empresa_id, vendedor_id=vendedor_id)
+    if not linhas:
+        raise HTTPException(status_code=404, detail="Nenhuma metrica encontrada no periodo.")
+    return {"inicio": inicio, "fim": fim, **percentis_por_vendedor(linhas)}
+
+
 @router.get("/ranking/{data}")
-def ranking(
+async def ranking(
     data: str,
     empresa_id: int | None = Query(default=None, description="ID da empresa"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Ranking de vendedores no dia, ordenado por score_medio decrescente."""
-    metricas = buscar_metricas_dia(db, data, empresa_id=empresa_id)
+    metricas = await buscar_metricas_dia(db, data, empresa_id=empresa_id)
     if not metricas:
         raise HTTPException(status_code=404, detail="Nenhuma metrica encontrada para este dia.")
 
@@ -0,0 +1,161 @@
+"""DDSketch: quantis de tempo de resposta mesclaveis entre vendedores e dias.
+
+Media diaria nao pode ser combinada entre dias e esconde a cauda. Cada
+MetricaDiaria guarda um sketch (bytes, poucas centenas no maximo) com todos
+os tempos do dia; p50/p90/p99 de qualquer periodo saem da mescla dos
+sketches diarios, sem reler mensagens.
+
+Cada valor cai no bucket ceil(log_gama(x)), gama = (1 + alfa) / (1 - alfa):
+qualquer quantil estimado tem erro relativo de no maximo `alfa` (1%).
+"""
+
+import math
+import struct
+
+ALFA_PADRAO = 0.01
+_VERSAO = 1
+
+
+def _escrever_varint(saida: bytearray, valor: int) -> None:
+    while valor >= 0x80:
+        saida.append((valor & 0x7F) | 0x80)
+        valor >>= 7
+    saida.append(valor)
+
+
+def _ler_varint(dados: bytes, pos: int) -> tuple[int, int]:
+    valor = deslocamento = 0
+    while True:
+        byte = dados[pos]
+        pos += 1
+        valor |= (byte & 0x7F) << deslocamento
+        if byte < 0x80:
+            return valor, pos
+        deslocamento += 7
+
+
+class DDSketch:
+    """Sketch de quantis com erro relativo garantido (valores >= 0)."""
+
+    __slots__ = ("alfa", "_gama", "_log_gama", "zeros", "buckets")
+
+    def __init__(self, alfa: float = ALFA_PADRAO):
+        self.alfa = alfa
+        self._gama = (1 + alfa) / (1 - alfa)
+        self._log_gama = math.log(self._gama)
+        self.zeros = 0
+        self.buckets: dict[int, int] = {}
+
+    @property
+    def contagem(self) -> int:
+        return self.zeros + sum(self.buckets.values())
+
+    def adicionar(self, valor: float, vezes: int = 1) -> None:
+        if valor < 0:
+            raise ValueError(f"Valor negativo no sketch: {valor}")
+        if valor == 0:
+            self.zeros += vezes
+            return
+        indice = math.ceil(math.log(valor) / self._log_gama)
+        self.buckets[indice] = self.buckets.get(indice, 0) + vezes
+
+    def mesclar(self, outro: "DDSketch") -> "DDSketch":
+        if outro.alfa != self.alfa:
+            raise ValueError("Sketches com alfa diferente nao podem ser mesclados")
+        self.zeros += outro.zeros
+        for indice, vezes in outro.buckets.items():
+            self.buckets[indice] = self.buckets.get(indice, 0) + vezes
+        return self
+
+    def quantil(self, q: float) -> float | None:
+        """Valor estimado do quantil q (0..1); None se o sketch estiver vazio."""
+        if not 0 <= q <= 1:
+            raise ValueError(f"Quantil fora de [0, 1]: {q}")
+        total = self.contagem
+        if total == 0:
+            return None
+        posicao = q * (total - 1)
+        acumulado = self.zeros
+        if posicao < acumulado:
+            return 0.0
+        for indice in sorted(self.buckets):
+            acumulado += self.buckets[indice]
+            if posicao < acumulado:
+                return 2 * self._gama ** indice / (self._gama + 1)
+        return 2 * self._gama ** max(self.buckets) / (self._gama + 1)
+
+    def para_bytes(self) -> bytes:
+        """Formato: versao, alfa (double), zeros, n buckets e pares (delta do indice, contagem)."""
+        saida = bytearray(struct.pack("<Bd", _VERSAO, self.alfa))
+        _escrever_varint(saida, self.zeros)
+        _escrever_varint(saida, len(self.buckets))
+        anterior = 0
+        for indice in sorted(self.buckets):
+            delta = indice - anterior
+            _escrever_varint(saida, (delta << 1) ^ (delta >> 63))  # zigzag: indices podem ser negativos
+            _escrever_varint(saida, self.buckets[indice])
+            anterior = indice
+        return bytes(saida)
+
+    @classmethod
+    def de_bytes(cls, dados: bytes) -> "DDSketch":
+        versao, alfa = struct.unpack_from("<Bd", dados)
+        if versao != _VERSAO:
+            raise ValueError(f"Versao de sketch desconhecida: {versao}")
+        sketch = cls(alfa)
+        pos = struct.calcsize("<Bd")
+        sketch.zeros, pos = _ler_varint(dados, pos)
+        quantidade, pos = _ler_varint(dados, pos)
+        indice = 0
+        for _ in range(quantidade):
+            zigzag, pos = _ler_varint(dados, pos)
+            indice += (zigzag >> 1) ^ -(zigzag & 1)
+            sketch.buckets[indice], pos = _ler_varint(dados, pos)
+        return sketch
+
+
+def sketch_de_valores(valores: list[int]) -> bytes | None:
+    """Serializa os valores num sketch; None se nao houver valores."""
+    if not valores:
+        return None
+    sketch = DDSketch()
+    for valor in valores:
+        sketch.adicionar(valor)
+    return sketch.para_bytes()
+
+
+def resumir_percentis(sketch: DDSketch) -> dict:
+    """p50/p90/p99 em segundos (arredondados) e quantidade de amostras."""
+    resumo = {"amostras": sketch.contagem}
+    for nome, q in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+        valor = sketch.quantil(q)
+        resumo[nome] = round(valor) if valor is not None else None
+    return resumo
+
+
+def percentis_por_vendedor(linhas) -> dict:
+    """Percentis do periodo a partir das linhas (vendedor_id, sketch_primeira_resp, sketch_resposta).
+
+    Returns:
+        {"vendedores": [{vendedor_id, primeira_resposta, resposta}], "geral": {primeira_resposta, resposta}}
+    """
+    por_vendedor: dict[int, tuple[DDSketch, DDSketch]] = {}
+    geral = (DDSketch(), DDSketch())
+    for vendedor_id, primeira, resposta in linhas:
+        sketches = por_vendedor.setdefault(vendedor_id, (DDSketch(), DDSketch()))
+        for destino, dados in zip(sketches, (primeira, resposta)):
+            if dados:
+                destino.mesclar(DDSketch.de_bytes(dados))
+    for primeira, resposta in por_vendedor.values():
+        geral[0].mesclar(primeira)
+        geral[1].mesclar(resposta)
+
+    def resumo(par: tuple[DDSketch, DDSketch]) -> dict:
+        return {"primeira_resposta": resumir_percentis(par[0]), "resposta": resumir_percentis(par[1])}
+
+    return {
+        "vendedores": [
+            {"vendedor_id": vid, **resumo(par)} for vid, par in sorted(por_vendedor.items())
+        ],
+        "geral": resumo(geral),
+    }
@@ -1,12 +1,13 @@
 """Orquestracao do relatorio diario: calcular -> alertas -> formatar -> enviar — multi-tenant."""
 
+import asyncio
 import logging
 from datetime import date
 
 from src.config_manager import get_config
 from src.database.connection import SessionLocal
 from src.database.queries import listar_vendedores
-from src.metrics.calculator import calcular_metricas
+from src.metrics.calculator import metricas_do_dia
 from src.reports.templates import formatar_tempo, montar_relatorio_completo
 from src.whatsapp.sender import enviar_mensagem
 
@@ -70,42 +71,54 @@ async def gerar_e_enviar_relatorio(
     data = data or date.today().strftime("%Y-%m-%d")
     logger.info(f"Gerando relatorio para {data} empresa={empresa_id}...")
 
+    # Calculo e consultas sao bloqueantes: rodam fora do event loop
+    metricas, texto, alertas, gestor_telefone = await asyncio.to_thread(
+        _montar_relatorio, data, empresa_id
+    )
+
+    # Dividir se necessario e enviar
+    if gestor_telefone:
+        partes = dividir_mensagens(texto)
+        for parte in partes:
+            await enviar_mensagem(gestor_telefone, parte, empresa_id=empresa_id)
+    else:
+        partes = []
+        logger.warning(f"Sem gestor_telefone para empresa {empresa_id}. Relatorio nao enviado.")
+
+    logger.info(
+        f"Relatorio gerado: empresa={empresa_id} {len(metricas)} vendedores, "
+        f"{len(alertas)} alertas, {len(partes)} mensagem(ns)"
+    )
+
+    return {
+        "data": data,
+        "empresa_id": empresa_id,
+        "vendedores": len(metricas),
+        "alertas": len(alertas),
+        "mensagens_enviadas": len(partes),
+    }
+
+
+def _montar_relatorio(
+    data: str, empresa_id: int | None
+) -> tuple[list[dict], str, list[str], str | None]:
+    """Parte bloqueante do pipeline: metricas, alertas, texto e telefone do gestor."""
     db = SessionLocal()
     try:
-        # 1. Calcular metricas
-        metricas = calcular_metricas(db, data, empresa_id=empresa_id)
+        # 1. Metricas do dia (so recalcula o que estiver pendente)
+        metricas = metricas_do_dia(db, data, empresa_id=empresa_id)
 
         # 2. Mapear vendedor_id -> nome
         vendedores = listar_vendedores(db, empresa_id=empresa_id)
         nomes = {v.id: v.nome for v in vendedores}
+    finally:
+        db.close()
 
-        # 3. Detectar alertas
-        alertas = detectar_alertas(metricas, nomes)
+    # 3. Detectar alertas
+    alertas = detectar_alertas(metricas, nomes)
 
-        # 4. Montar texto do relatorio
-        texto = montar_relatorio_completo(data, metricas, nomes, alertas)
+    # 4. Montar texto do relatorio
+    texto = montar_relatorio_completo(data, metricas, nomes, alertas)
 
-        # 5. Dividir se necessario e enviar
-        gestor_telefone = get_config("gestor_telefone", empresa_id=empresa_id)
-        if gestor_telefone:
-            partes = dividir_mensagens(texto)
-            for parte in partes:
-                await enviar_mensagem(gestor_telefone, parte, empresa_id=empresa_id)
-        else:
-            partes = []
-            logger.warning(f"Sem gestor_telefone para empresa {empresa_id}. Relatorio nao enviado.")
-
-        logger.info(
-            f"Relatorio gerado: empresa={empresa_id} {len(metricas)} vendedores, "
-            f"{len(alertas)} alertas, {len(partes)} mensagem(ns)"
-        )
-
-        return {
-            "data": data,
-            "empresa_id": empresa_id,
-            "vendedores": len(metricas),
-            "alertas": len(alertas),
-            "mensagens_enviadas": len(partes),
-        }
-    finally:
-        db.close()
+    gestor_telefone = get_config("gestor_telefone", empresa_id=empresa_id)
+    return metricas, texto, alertas, gestor_telefone
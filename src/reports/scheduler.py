@@ -1,14 +1,19 @@
 """Agendamento do relatório diário com APScheduler — multi-tenant."""
 
+import asyncio
 import logging
 from zoneinfo import ZoneInfo
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 
+from src.analysis.lote import analisar_lote, analisar_pendentes
+from src.config import settings
 from src.config_manager import get_config
 from src.database.connection import SessionLocal
 from src.database.queries import listar_empresas
+from src.metrics.calculator import recalcular_pendentes
 from src.reports.daily import gerar_e_enviar_relatorio
 
 logger = logging.getLogger(__name__)
@@ -27,12 +32,60 @@ async def _job_relatorio_empresa(empresa_id: int):
         logger.error(f"Erro no job de relatório empresa {empresa_id}: {e}", exc_info=True)
 
 
+async def _job_analise_empresa(empresa_id: int | None):
+    """Job de analise em lote das conversas do dia, antes do relatório."""
+    try:
+        await analisar_lote(empresa_id=empresa_id)
+    except Exception as e:
+        logger.error(f"Erro no job de análise empresa {empresa_id}: {e}", exc_info=True)
+
+
+def _agendar_analise(empresa_id: int | None, hora: int, minuto: int, job_id: str):
+    """Agenda a análise do dia `analise_lote_antecedencia_min` antes do relatório."""
+    if settings.analise_lote_antecedencia_min <= 0:
+        return
+    total = (hora * 60 + minuto - settings.analise_lote_antecedencia_min) % (24 * 60)
+    scheduler.add_job(
+        _job_analise_empresa,
+        CronTrigger(hour=total // 60, minute=total % 60, timezone=TIMEZONE_BR),
+        args=[empresa_id],
+        id=job_id,
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+    )
+
+
+async def _job_analise_incremental():
+    """Job de analise das conversas com mensagens novas, dentro do orçamento por execução."""
+    try:
+        await analisar_pendentes()
+    except Exception as e:
+        logger.error(f"Erro no job de análise incremental: {e}", exc_info=True)
+
+
+def _recalcular_metricas_pendentes() -> int:
+    db = SessionLocal()
+    try:
+        return recalcular_pendentes(db)
+    finally:
+        db.close()
+
+
+async def _job_metricas_pendentes():
+    """Job de recalculo incremental das metricas (so pares marcados como pendentes)."""
+    try:
+        await asyncio.to_thread(_recalcular_metricas_pendentes)
+    except Exception as e:
+        logger.error(f"Erro no job de metricas pendentes: {e}", exc_info=True)
+
+
 def _carregar_jobs():
     """Carrega (ou recarrega) jobs de todas as empresas ativas."""
     # Remover jobs existentes
     existing_jobs = scheduler.get_jobs()
     for job in existing_jobs:
-        if job.id.startswith("relatorio_"):
+        if job.id.startswith(("relatorio_", "analise_empresa_", "analise_sem_empresa")):
             job.remove()
 
     db = SessionLocal()
@@ -55,6 +108,7 @@ def _carregar_jobs():
             id="relatorio_sem_empresa",
             replace_existing=True,
         )
+        _agendar_analise(None, int(hora), int(minuto), "analise_sem_empresa")
         logger.info(f"Scheduler: sem empresas — relatório às {horario} (Brasília)")
     else:
         for empresa in empresas:
@@ -70,6 +124,7 @@ def _carregar_jobs():
                 id=f"relatorio_empresa_{empresa.id}",
                 replace_existing=True,
             )
+            _agendar_analise(empresa.id, int(hora), int(minuto), f"analise_empresa_{empresa.id}")
             logger.info(
                 f"Scheduler: empresa '{empresa.nome}' (id={empresa.id}) — "
                 f"relatório às {horario} (Brasília)"
@@ -80,7 +135,28 @@ def _carregar_jobs():
 
 def iniciar_scheduler():
     """Inicia o scheduler com um job de relatório por empresa ativa."""
+    # O AsyncIOScheduler guarda o loop do primeiro start: reiniciar o app no
+    # mesmo processo (ex: testes com lifespan) usaria um loop ja fechado
+    scheduler.configure(event_loop=asyncio.get_running_loop())
     total = _carregar_jobs()
+    if settings.metricas_recalculo_intervalo_min > 0:
+        scheduler.add_job(
+            _job_metricas_pendentes,
+            IntervalTrigger(minutes=settings.metricas_recalculo_intervalo_min),
+            id="metricas_pendentes",
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+        )
+    if settings.analise_incremental_intervalo_min > 0:
+        scheduler.add_job(
+            _job_analise_incremental,
+            IntervalTrigger(minutes=settings.analise_incremental_intervalo_min),
+            id="analise_incremental",
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+        )
     scheduler.start()
     logger.info(f"Scheduler iniciado com {total} empresa(s)")
 
@@ -0,0 +1,259 @@
+"""Fila de ingestao em memoria: o webhook enfileira e um writer persiste em micro-lotes."""
+
+import asyncio
+import logging
+import time
+
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+
+from src.config import settings
+from src.database import cache
+from src.database.connection import SessionLocal
+from src.database.queries import salvar_mensagens_lote
+from src.whatsapp.parser import MensagemParseada
+from src.whatsapp.roteamento import Rota, rotear_mensagem
+
+logger = logging.getLogger(__name__)
+
+
+def persistir_lote(mensagens: list[MensagemParseada]) -> int:
+    """Roteia e salva um lote de mensagens com um unico INSERT/commit. Bloqueante.
+
+    Retorna quantas mensagens foram salvas (as nao roteaveis e as duplicadas
+    sao descartadas). So as roteadas entram no LRU de duplicatas: uma mensagem
+    de instancia/vendedor ainda nao cadastrado precisa ser aceita no retry.
+    """
+    db = SessionLocal()
+    try:
+        linhas = []
+        vistas = []
+        for msg in mensagens:
+            rota = rotear_mensagem(db, msg)
+            if not isinstance(rota, Rota):
+                continue
+            if msg.message_id:
+                vistas.append((msg.instance_name, msg.message_id))
+            linhas.append({
+                "conversa_id": rota.conversa_id,
+                "remetente": rota.remetente,
+                "conteudo": msg.conteudo,
+                "tipo": msg.tipo,
+                "enviada_em": msg.timestamp,
+                "message_id": msg.message_id or None,
+            })
+        salvas = salvar_mensagens_lote(db, linhas)
+    except Exception:
+        # Conversas criadas pelo upsert podem ter sido cacheadas sem commit
+        cache.conversas.limpar()
+        raise
+    finally:
+        db.close()
+
+    # Apos o commit: inseridas ou ja existentes (ON CONFLICT)
+    for chave in vistas:
+        cache.mensagens_recentes.adicionar(chave)
+    return len(salvas)
+
+
+def _erro_transitorio(erro: Exception) -> bool:
+    """Banco fora do ar, conexao perdida ou pool esgotado: vale repetir o mesmo lote."""
+    if isinstance(erro, (OperationalError, InterfaceError, PoolTimeoutError)):
+        return True
+    return isinstance(erro, DBAPIError) and erro.connection_invalidated
+
+
+class FilaIngestao:
+    """Fila limitada + writer em background que drena em lotes de N itens ou T ms.
+
+    As mensagens ja foram confirmadas (202) quando o writer as persiste, entao
+    um lote que falha nao e descartado: erro transitorio repete o lote com
+    backoff (a fila enche e o webhook passa a responder 503); erro de dados
+    reprocessa mensagem a mensagem e descarta so as que falharem de novo
+    (o payload continua no journal para o replay).
+    """
+
+    def __init__(
+        self,
+        max_itens: int,
+        tamanho_lote: int,
+        intervalo_ms: int,
+        espera_max_seg: float = 30.0,
+        timeout_parada_seg: float = 30.0,
+    ):
+        self.max_itens = max_itens
+        self.tamanho_lote = tamanho_lote
+        self.intervalo_ms = intervalo_ms
+        self.espera_max_seg = espera_max_seg
+        self.timeout_parada_seg = timeout_parada_seg
+        self._fila: asyncio.Queue | None = None
+        self._writer: asyncio.Task | None = None
+        self._zerar_estatisticas()
+
+    @property
+    def ativa(self) -> bool:
+        return self._writer is not None and not self._writer.done()
+
+    async def iniciar(self) -> None:
+        """Cria a fila e inicia o writer no event loop atual."""
+        if self.ativa:
+            return
+        self._fila = asyncio.Queue(maxsize=self.max_itens)
+        self._writer = asyncio.create_task(self._loop_writer())
+        logger.info(
+            f"Fila de ingestao iniciada (max={self.max_itens}, lote={self.tamanho_lote}, "
+            f"intervalo={self.intervalo_ms}ms)"
+        )
+
+    async def parar(self) -> None:
+        """Para o writer depois de persistir o que ja estava na fila."""
+        if not self.ativa:
+            return
+        try:
+            await asyncio.wait_for(self._fila.join(), timeout=self.timeout_parada_seg)
+        except asyncio.TimeoutError:
+            logger.error(
+                f"Fila de ingestao parada com {self._fila.qsize()} mensagem(ns) sem persistir "
+                f"(alem do lote em andamento). Rode o replay do journal."
+            )
+        self._writer.cancel()
+        try:
+            await self._writer
+        except asyncio.CancelledError:
+            pass
+        self._writer = None
+        logger.info("Fila de ingestao parada.")
+
+    def enfileirar(self, msg: MensagemParseada) -> bool:
+        """Enfileira sem bloquear. Retorna False se a fila estiver cheia."""
+        try:
+            self._fila.put_nowait((time.monotonic(), msg))
+        except asyncio.QueueFull:
+            self._rejeitadas += 1
+            return False
+        self._enfileiradas += 1
+        return True
+
+    def enfileirar_lote(self, mensagens: list[MensagemParseada]) -> bool:
+        """Enfileira todas as mensagens ou nenhuma. Retorna False se nao couberem."""
+        if self._fila.maxsize - self._fila.qsize() < len(mensagens):
+            self._rejeitadas += len(mensagens)
+            return False
+        agora = time.monotonic()
+        for msg in mensagens:
+            self._fila.put_nowait((agora, msg))
+        self._enfileiradas += len(mensagens)
+        return True
+
+    def status(self) -> dict:
+        """Profundidade da fila, tamanho dos lotes e latencia de flush."""
+        return {
+            "ativa": self.ativa,
+            "profundidade": self._fila.qsize() if self._fila else 0,
+            "max_itens": self.max_itens,
+            "tamanho_lote_max": self.tamanho_lote,
+            "intervalo_ms": self.intervalo_ms,
+            "enfileiradas": self._enfileiradas,
+            "rejeitadas": self._rejeitadas,
+            "persistidas": self._persistidas,
+            "lotes": self._lotes,
+            "erros": self._erros,
+            "retentativas": self._retentativas,
+            "descartadas": self._descartadas,
+            "ultimo_lote": self._ultimo_lote,
+            "media_lote": round(self._processadas / self._lotes, 1) if self._lotes else None,
+            "ultimo_flush_ms": self._ultimo_flush_ms,
+            "max_flush_ms": self._max_flush_ms,
+            "max_espera_ms": self._max_espera_ms,
+        }
+
+    def _zerar_estatisticas(self) -> None:
+        self._enfileiradas = 0
+        self._rejeitadas = 0
+        self._processadas = 0
+        self._persistidas = 0
+        self._lotes = 0
+        self._erros = 0
+        self._retentativas = 0
+        self._descartadas = 0
+        self._ultimo_lote = 0
+        self._ultimo_flush_ms: float | None = None
+        self._max_flush_ms = 0.0
+        self._max_espera_ms = 0.0
+
+    async def _coletar_lote(self) -> list[tuple[float, MensagemParseada]]:
+        """Espera o primeiro item e junta mais ate N itens ou T ms."""
+        lote = [await self._fila.get()]
+        prazo = time.monotonic() + self.intervalo_ms / 1000
+        while len(lote) < self.tamanho_lote:
+            restante = prazo - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(await asyncio.wait_for(self._fila.get(), timeout=restante))
+            except asyncio.TimeoutError:
+                break
+        return lote
+
+    async def _loop_writer(self) -> None:
+        while True:
+            lote = await self._coletar_lote()
+            inicio = time.monotonic()
+            try:
+                self._persistidas += await self._persistir([msg for _, msg in lote])
+            finally:
+                fim = time.monotonic()
+                flush_ms = round((fim - inicio) * 1000, 1)
+                self._lotes += 1
+                self._processadas += len(lote)
+                self._ultimo_lote = len(lote)
+                self._ultimo_flush_ms = flush_ms
+                self._max_flush_ms = max(self._max_flush_ms, flush_ms)
+                self._max_espera_ms = max(
+                    self._max_espera_ms, round((fim - lote[0][0]) * 1000, 1)
+                )
+                for _ in lote:
+                    self._fila.task_done()
+
+    async def _persistir(self, mensagens: list[MensagemParseada]) -> int:
+        """Persiste o lote sem perder mensagens ja confirmadas. Retorna quantas foram salvas."""
+        espera = 0.5
+        while True:
+            try:
+                # Persistencia bloqueante roda fora do event loop
+                return await asyncio.to_thread(persistir_lote, mensagens)
+            except Exception as e:
+                self._erros += 1
+                if _erro_transitorio(e):
+                    self._retentativas += 1
+                    logger.warning(
+                        f"Erro transitorio ao persistir lote de {len(mensagens)} mensagem(ns): {e}. "
+                        f"Nova tentativa em {espera:.1f}s."
+                    )
+                    await asyncio.sleep(espera)
+                    espera = min(espera * 2, self.espera_max_seg)
+                    continue
+                if len(mensagens) == 1:
+                    self._descartadas += 1
+                    msg = mensagens[0]
+                    logger.error(
+                        f"Mensagem descartada (instancia={msg.instance_name} message_id={msg.message_id}): {e}",
+                        exc_info=True,
+                    )
+                    return 0
+                logger.error(
+                    f"Erro ao persistir lote de {len(mensagens)} mensagem(ns): {e}. Reprocessando uma a uma.",
+                    exc_info=True,
+                )
+                salvas = 0
+                for msg in mensagens:
+                    salvas += await self._persistir([msg])
+                return salvas
+
+
+fila_ingestao = FilaIngestao(
+    max_itens=settings.ingest_fila_max,
+    tamanho_lote=settings.ingest_lote_max,
+    intervalo_ms=settings.ingest_lote_intervalo_ms,
+    espera_max_seg=settings.ingest_retry_espera_max_seg,
+    timeout_parada_seg=settings.ingest_parada_timeout_seg,
+)
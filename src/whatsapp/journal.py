@@ -0,0 +1,270 @@
+"""Journal local append-only dos webhooks aceitos, com fsync em grupo e replay.
+
+Cada payload `messages.upsert` aceito e gravado (e sincronizado em disco)
+antes do webhook responder. Se o processo cair antes do commit no banco, ou
+o banco ficar fora do ar, o replay reprocessa os segmentos pelo mesmo
+caminho do webhook (parsear_webhook_lote -> roteamento -> salvar_mensagem).
+
+Formato: segmentos `journal-NNNNNNNNNN.log` com registros
+`[tamanho u32][crc32 u32][payload JSON]` (big-endian).
+
+Retencao: o replay apaga os segmentos que leu por inteiro (anteriores ao
+checkpoint, ja salvos no banco) e a rotacao apaga segmentos fechados ha
+mais de `journal_retencao_horas` — na operacao normal o writer em lote salva
+em segundos; a janela e o prazo para rodar o replay depois de uma queda.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator
+
+from sqlalchemy.orm import Session
+
+from src.config import settings
+from src.database.connection import SessionLocal
+from src.database.queries import mensagem_existe, salvar_mensagem
+from src.whatsapp.parser import MensagemParseada, decodificar_json, parsear_webhook_lote
+from src.whatsapp.roteamento import Rota, rotear_mensagem
+
+logger = logging.getLogger(__name__)
+
+_CABECALHO = struct.Struct(">II")
+_PREFIXO = "journal-"
+_SUFIXO = ".log"
+
+
+def codificar_registro(payload: bytes) -> bytes:
+    return _CABECALHO.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _nome_segmento(numero: int) -> str:
+    return f"{_PREFIXO}{numero:010d}{_SUFIXO}"
+
+
+def listar_segmentos(diretorio: Path) -> list[Path]:
+    """Segmentos do journal em ordem de gravacao."""
+    return sorted(Path(diretorio).glob(f"{_PREFIXO}*{_SUFIXO}"))
+
+
+def compactar_journal(
+    diretorio: Path, antes_de: str = "", retencao_seg: float = 0, atual: str = ""
+) -> list[str]:
+    """Apaga segmentos fechados ja confirmados. Retorna os nomes apagados.
+
+    Args:
+        antes_de: segmentos com nome anterior (checkpoint do replay) ja foram salvos
+        retencao_seg: se > 0, apaga tambem os modificados ha mais que isso
+        atual: segmento aberto para append, nunca apagado
+    """
+    limite = time.time() - retencao_seg
+    apagados = []
+    for caminho in listar_segmentos(diretorio):
+        if caminho.name == atual:
+            continue
+        if caminho.name < antes_de or (retencao_seg > 0 and caminho.stat().st_mtime < limite):
+            caminho.unlink(missing_ok=True)
+            apagados.append(caminho.name)
+    if apagados:
+        logger.info(f"Journal: {len(apagados)} segmento(s) apagado(s) ({apagados[0]}..{apagados[-1]})")
+    return apagados
+
+
+class Journal:
+    """Writer do journal. Agrupa gravacoes concorrentes num unico write+fsync."""
+
+    def __init__(
+        self, diretorio: str, segmento_max_bytes: int, intervalo_fsync_ms: int, retencao_seg: float = 0
+    ):
+        self.diretorio = Path(diretorio)
+        self.segmento_max_bytes = segmento_max_bytes
+        self.intervalo_fsync_ms = intervalo_fsync_ms
+        self.retencao_seg = retencao_seg  # 0 = segmentos fechados so saem pelo replay
+        self._arquivo = None
+        self._numero_segmento = 0
+        self._buffer: list[bytes] = []
+        self._pendentes: list[asyncio.Future] = []
+        self._tarefa_flush: asyncio.Task | None = None
+
+    @property
+    def aberto(self) -> bool:
+        return self._arquivo is not None
+
+    def abrir(self) -> None:
+        """Abre o ultimo segmento para append (ou cria o primeiro)."""
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        segmentos = listar_segmentos(self.diretorio)
+        self._numero_segmento = int(segmentos[-1].name[len(_PREFIXO):-len(_SUFIXO)]) if segmentos else 1
+        self._arquivo = open(self.diretorio / _nome_segmento(self._numero_segmento), "ab")
+        logger.info(f"Journal aberto em {self.diretorio} (segmento {self._numero_segmento})")
+
+    async def fechar(self) -> None:
+        """Espera o flush pendente e fecha o segmento atual."""
+        if self._tarefa_flush is not None:
+            await self._tarefa_flush
+        if self._arquivo is not None:
+            self._arquivo.close()
+            self._arquivo = None
+
+    async def gravar(self, payload: bytes) -> None:
+        """Grava um payload e so retorna depois do fsync (em grupo com gravacoes concorrentes)."""
+        futuro = asyncio.get_running_loop().create_future()
+        self._buffer.append(codificar_registro(payload))
+        self._pendentes.append(futuro)
+        if self._tarefa_flush is None:
+            self._tarefa_flush = asyncio.create_task(self._flush())
+        await futuro
+
+    async def _flush(self) -> None:
+        # Janela curta para juntar gravacoes concorrentes no mesmo fsync
+        await asyncio.sleep(self.intervalo_fsync_ms / 1000)
+        try:
+            while self._buffer:
+                registros, futuros = self._buffer, self._pendentes
+                self._buffer, self._pendentes = [], []
+                try:
+                    await asyncio.to_thread(self._escrever_e_sincronizar, registros)
+                except Exception as e:
+                    logger.error(f"Erro ao gravar journal: {e}", exc_info=True)
+                    for futuro in futuros:
+                        futuro.set_exception(e)
+                else:
+                    for futuro in futuros:
+                        futuro.set_result(None)
+        finally:
+            self._tarefa_flush = None
+
+    def _escrever_e_sincronizar(self, registros: list[bytes]) -> None:
+        self._arquivo.write(b"".join(registros))
+        self._arquivo.flush()
+        os.fsync(self._arquivo.fileno())
+        if self._arquivo.tell() >= self.segmento_max_bytes:
+            self._rotacionar()
+
+    def _rotacionar(self) -> None:
+        self._arquivo.close()
+        self._numero_segmento += 1
+        self._arquivo = open(self.diretorio / _nome_segmento(self._numero_segmento), "ab")
+        logger.info(f"Journal: novo segmento {self._numero_segmento}")
+        if self.retencao_seg > 0:
+            compactar_journal(
+                self.diretorio, retencao_seg=self.retencao_seg, atual=_nome_segmento(self._numero_segmento)
+            )
+
+
+# === Leitura e replay ===
+
+
+@dataclass
+class Checkpoint:
+    """Posicao do replay: proximo byte a ler no segmento."""
+
+    segmento: str = ""
+    offset: int = 0
+
+    @classmethod
+    def carregar(cls, caminho: Path) -> "Checkpoint":
+        if not Path(caminho).exists():
+            return cls()
+        dados = json.loads(Path(caminho).read_text())
+        return cls(segmento=dados["segmento"], offset=dados["offset"])
+
+    def salvar(self, caminho: Path) -> None:
+        """Grava de forma atomica (arquivo temporario + rename)."""
+        caminho = Path(caminho)
+        tmp = caminho.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"segmento": self.segmento, "offset": self.offset}))
+        os.replace(tmp, caminho)
+
+
+def ler_registros(
+    diretorio: Path, a_partir_de: Checkpoint | None = None
+) -> Iterator[tuple[str, int, bytes]]:
+    """Le registros em ordem a partir do checkpoint. Yields (segmento, offset_seguinte, payload).
+
+    Um registro incompleto ou com CRC invalido (queda no meio de um write)
+    encerra a leitura daquele segmento.
+    """
+    a_partir_de = a_partir_de or Checkpoint()
+    for caminho in listar_segmentos(diretorio):
+        if caminho.name < a_partir_de.segmento:
+            continue
+        offset = a_partir_de.offset if caminho.name == a_partir_de.segmento else 0
+        with open(caminho, "rb") as f:
+            f.seek(offset)
+            while True:
+                cabecalho = f.read(_CABECALHO.size)
+                if len(cabecalho) < _CABECALHO.size:
+                    break
+                tamanho, crc = _CABECALHO.unpack(cabecalho)
+                payload = f.read(tamanho)
+                if len(payload) < tamanho or zlib.crc32(payload) != crc:
+                    logger.warning(f"Journal: registro corrompido em {caminho.name}@{offset}. Segmento encerrado.")
+                    break
+                offset += _CABECALHO.size + tamanho
+                yield caminho.name, offset, payload
+
+
+def reprocessar_journal(
+    diretorio: Path, caminho_checkpoint: Path, salvar_a_cada: int = 500, compactar: bool = True
+) -> dict:
+    """Re-alimenta o journal pelo caminho do webhook. Idempotente.
+
+    Mensagens que ja estao no banco (mesmo message_id na conversa) sao
+    ignoradas; o checkpoint evita reler o que um replay anterior ja processou.
+    Com `compactar`, os segmentos anteriores ao do checkpoint (lidos por
+    inteiro e salvos) sao apagados no final.
+    """
+    checkpoint = Checkpoint.carregar(caminho_checkpoint)
+    resumo = {"lidos": 0, "salvos": 0, "duplicados": 0, "ignorados": 0, "segmentos_apagados": 0}
+
+    db = SessionLocal()
+    try:
+        for segmento, offset, payload in ler_registros(diretorio, checkpoint):
+            resumo["lidos"] += 1
+            mensagens = list(parsear_webhook_lote(decodificar_json(payload)))
+            if not mensagens:
+                resumo["ignorados"] += 1
+            for msg in mensagens:
+                resumo[_reprocessar_mensagem(db, msg)] += 1
+
+            checkpoint = Checkpoint(segmento=segmento, offset=offset)
+            if resumo["lidos"] % salvar_a_cada == 0:
+                checkpoint.salvar(caminho_checkpoint)
+    finally:
+        db.close()
+
+    checkpoint.salvar(caminho_checkpoint)
+    if compactar and checkpoint.segmento:
+        resumo["segmentos_apagados"] = len(compactar_journal(diretorio, antes_de=checkpoint.segmento))
+    return resumo
+
+
+def _reprocessar_mensagem(db: Session, msg: MensagemParseada) -> str:
+    """Roteia e salva uma mensagem do journal. Retorna a chave do resumo."""
+    rota = rotear_mensagem(db, msg)
+    if not isinstance(rota, Rota):
+        return "ignorados"
+    if not msg.message_id and mensagem_existe(
+        db, rota.conversa_id, rota.remetente, msg.timestamp, msg.conteudo
+    ):
+        return "duplicados"
+    mensagem = salvar_mensagem(
+        db, rota.conversa_id, rota.remetente, msg.conteudo,
+        tipo=msg.tipo, enviada_em=msg.timestamp, message_id=msg.message_id,
+    )
+    return "salvos" if mensagem is not None else "duplicados"
+
+
+journal = Journal(
+    diretorio=settings.journal_dir,
+    segmento_max_bytes=settings.journal_segmento_max_mb * 1024 * 1024,
+    intervalo_fsync_ms=settings.journal_fsync_intervalo_ms,
+    retencao_seg=settings.journal_retencao_horas * 3600,
+)
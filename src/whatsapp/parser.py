@@ -1,12 +1,19 @@
 """Parser para mensagens recebidas da Evolution API v2."""
 
+import json
 from dataclasses import dataclass
 from datetime import datetime
+from typing import Any, Iterator
 
+try:
+    import orjson
+except ImportError:  # orjson e opcional: sem ele usa o json da stdlib
+    orjson = None
 
-@dataclass
+
+@dataclass(slots=True)
 class MensagemParseada:
-    """Resultado do parse de uma mensagem do webhook."""
+    """Resultado do parse de uma mensagem do webhook (slots: sem __dict__)."""
 
     telefone_remetente: str  # numero de quem enviou
     telefone_destinatario: str  # numero de quem recebeu
@@ -20,27 +27,61 @@ class MensagemParseada:
     instance_phone: str  # telefone do dono da instancia
 
 
+def decodificar_json(corpo: bytes) -> Any:
+    """Decodifica o corpo do webhook com orjson (se instalado) ou json da stdlib."""
+    if orjson is not None:
+        return orjson.loads(corpo)
+    return json.loads(corpo)
+
+
 def parsear_webhook(payload: dict) -> MensagemParseada | None:
     """
     Transforma o payload do webhook da Evolution API em um objeto estruturado.
     Retorna None se a mensagem nao for processavel (ex: notificacao de status).
+
+    Em payloads em lote, retorna apenas a primeira mensagem processavel
+    (use parsear_webhook_lote para todas).
     """
-    evento = payload.get("event", "")
+    return next(parsear_webhook_lote(payload), None)
 
-    if evento != "messages.upsert":
-        return None
 
-    data = payload.get("data", {})
+def parsear_webhook_lote(payload: dict | list) -> Iterator[MensagemParseada]:
+    """Gera todas as mensagens processaveis de um payload da Evolution API.
+
+    Aceita os formatos enviados em sincronizacao de historico e reconexoes:
+    - um evento com `data` dict (formato normal)
+    - um evento com `data` lista de mensagens
+    - uma lista de eventos
+    """
+    eventos = payload if isinstance(payload, list) else [payload]
+    for evento in eventos:
+        if not isinstance(evento, dict) or evento.get("event", "") != "messages.upsert":
+            continue
+
+        instance_name = evento.get("instance", "")
+        # Extrair telefone do dono da instancia (campo sender do payload)
+        sender = evento.get("sender") or ""
+        instance_phone = sender.removesuffix("@s.whatsapp.net")
+
+        data = evento.get("data", {})
+        for item in data if isinstance(data, list) else [data]:
+            msg = _parsear_item(item, instance_name, instance_phone)
+            if msg is not None:
+                yield msg
+
+
+def _parsear_item(data: dict, instance_name: str, instance_phone: str) -> MensagemParseada | None:
+    """Parseia uma mensagem (`data`) de um evento messages.upsert."""
     key = data.get("key", {})
     message = data.get("message", {})
 
     # Extrair numero remoto (sem @s.whatsapp.net)
     remote_jid = key.get("remoteJid", "")
-    if not remote_jid or "@g.us" in remote_jid:
+    if not remote_jid or remote_jid.endswith("@g.us"):
         # Ignorar mensagens de grupo
         return None
 
-    telefone_remoto = remote_jid.replace("@s.whatsapp.net", "")
+    telefone_remoto = remote_jid.removesuffix("@s.whatsapp.net")
     enviada_por_mim = key.get("fromMe", False)
 
     # Extrair conteudo da mensagem
@@ -57,12 +98,6 @@ def parsear_webhook(payload: dict) -> MensagemParseada | None:
 
     # Se fromMe=True, o vendedor enviou (remetente = instancia, destinatario = remoto)
     # Se fromMe=False, o lead enviou (remetente = remoto, destinatario = instancia)
-    instance_name = payload.get("instance", "")
-
-    # Extrair telefone do dono da instancia (campo sender do payload)
-    sender = payload.get("sender", "")
-    instance_phone = sender.replace("@s.whatsapp.net", "") if sender else ""
-
     return MensagemParseada(
         telefone_remetente=telefone_remoto if not enviada_por_mim else "",
         telefone_destinatario=telefone_remoto if enviada_por_mim else "",
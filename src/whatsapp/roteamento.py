@@ -0,0 +1,159 @@
+"""Roteamento multi-tenant de mensagens: instancia -> empresa -> vendedor -> conversa."""
+
+import logging
+from dataclasses import dataclass
+
+from sqlalchemy.orm import Session
+
+from src.database import cache
+from src.database.models import Vendedor
+from src.database.queries import (
+    buscar_conversa_por_lead,
+    buscar_instancia_por_nome,
+    buscar_vendedor_ativo_por_chave,
+    upsert_conversa,
+)
+from src.whatsapp.parser import MensagemParseada
+from src.whatsapp.telefone import chave_telefone
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Rota:
+    """Destino de uma mensagem ja roteada."""
+
+    empresa_id: int
+    vendedor_id: int
+    conversa_id: int
+    remetente: str  # "vendedor" ou "lead"
+
+
+@dataclass
+class RotaIgnorada:
+    """Mensagem que nao pode ser roteada."""
+
+    motivo: str
+
+
+def rotear_mensagem(db: Session, msg: MensagemParseada) -> Rota | RotaIgnorada:
+    """Identifica empresa, vendedor e conversa de uma mensagem parseada.
+
+    Fluxo:
+    1. Identifica empresa pela instance_name do payload
+    2. Identifica vendedor dentro da empresa
+    3. Busca ou cria a conversa vendedor <-> lead (upsert, sem commit —
+       o commit vem junto com a mensagem)
+    """
+    # --- Identificar empresa pela instancia ---
+    empresa_id = _resolver_empresa(db, msg.instance_name)
+    if empresa_id is None:
+        logger.warning(f"Instancia '{msg.instance_name}' nao registrada. Mensagem ignorada.")
+        return RotaIgnorada("instancia nao registrada")
+
+    # --- Identificar quem eh vendedor e quem eh lead ---
+    if msg.enviada_por_mim:
+        lead_telefone = msg.telefone_destinatario
+        remetente = "vendedor"
+        nome_lead = ""
+    else:
+        lead_telefone = msg.telefone_remetente
+        remetente = "lead"
+        nome_lead = msg.nome_contato
+
+    # --- Identificar o vendedor DENTRO da empresa ---
+    vendedor_id = _resolver_vendedor(db, empresa_id, msg, lead_telefone)
+    if vendedor_id is None:
+        logger.warning(f"Nenhum vendedor na empresa {empresa_id}. Mensagem ignorada.")
+        return RotaIgnorada("nenhum vendedor na empresa")
+
+    # --- Buscar ou criar conversa ---
+    conversa_id = _resolver_conversa(db, vendedor_id, lead_telefone, nome_lead, empresa_id)
+
+    return Rota(
+        empresa_id=empresa_id,
+        vendedor_id=vendedor_id,
+        conversa_id=conversa_id,
+        remetente=remetente,
+    )
+
+
+# === Resolucao com cache em memoria ===
+
+
+def _resolver_empresa(db: Session, instance_name: str) -> int | None:
+    """instance_name -> empresa_id. Instancias nao registradas tambem sao cacheadas (None)."""
+    empresa_id = cache.instancias.get(instance_name)
+    if empresa_id is not cache.AUSENTE:
+        return empresa_id
+
+    instancia = buscar_instancia_por_nome(db, instance_name)
+    empresa_id = instancia.empresa_id if instancia else None
+    cache.instancias.set(instance_name, empresa_id)
+    return empresa_id
+
+
+def _resolver_vendedor(
+    db: Session, empresa_id: int, msg: MensagemParseada, lead_telefone: str
+) -> int | None:
+    """Identifica o vendedor dentro da empresa.
+
+    1. Telefone da instancia (chave normalizada p/ 9o digito BR)
+    2. Conversa existente com esse lead
+    3. Fallback: primeiro vendedor ativo da empresa
+
+    Os tres passos sao cacheados por empresa e invalidados juntos
+    (cache.invalidar_vendedores_empresa).
+    """
+    chave = chave_telefone(msg.instance_phone)
+    if chave:
+        vendedor_id = cache.vendedores.get((empresa_id, chave))
+        if vendedor_id is cache.AUSENTE:
+            vendedor = buscar_vendedor_ativo_por_chave(db, empresa_id, msg.instance_phone)
+            vendedor_id = vendedor.id if vendedor else None
+            cache.vendedores.set((empresa_id, chave), vendedor_id)
+        if vendedor_id is not None:
+            return vendedor_id
+
+    if not msg.enviada_por_mim:
+        chave_lead = chave_telefone(lead_telefone)
+        vendedor_id = cache.leads.get((empresa_id, chave_lead))
+        if vendedor_id is not cache.AUSENTE:
+            return vendedor_id
+        conversa_existente = buscar_conversa_por_lead(db, empresa_id, lead_telefone)
+        if conversa_existente:
+            cache.leads.set((empresa_id, chave_lead), conversa_existente.vendedor_id)
+            return conversa_existente.vendedor_id
+
+    vendedor_id = cache.vendedor_padrao.get(empresa_id)
+    if vendedor_id is cache.AUSENTE:
+        vendedor = (
+            db.query(Vendedor)
+            .filter(Vendedor.empresa_id == empresa_id, Vendedor.ativo.is_(True))
+            .first()
+        )
+        vendedor_id = vendedor.id if vendedor else None
+        cache.vendedor_padrao.set(empresa_id, vendedor_id)
+    return vendedor_id
+
+
+def _resolver_conversa(
+    db: Session, vendedor_id: int, lead_telefone: str, nome_lead: str, empresa_id: int
+) -> int:
+    """(vendedor_id, lead_telefone) -> conversa_id.
+
+    Um hit so e aproveitado se nao houver lead_nome a preencher, para que o
+    nome do lead continue sendo gravado na primeira mensagem dele.
+    """
+    chave = (vendedor_id, lead_telefone)
+    cacheado = cache.conversas.get(chave)
+    if cacheado is not cache.AUSENTE:
+        conversa_id, tem_nome = cacheado
+        if tem_nome or not nome_lead:
+            return conversa_id
+
+    conversa_id, tem_nome = upsert_conversa(
+        db, vendedor_id, lead_telefone, nome_lead, empresa_id=empresa_id
+    )
+    cache.conversas.set(chave, (conversa_id, tem_nome))
+    return conversa_id
@@ -0,0 +1,36 @@
+"""Normalizacao de telefones: formato E.164 e chave de match (contorna o 9o digito BR)."""
+
+import re
+
+_NAO_DIGITOS = re.compile(r"\D")
+
+
+def normalizar_e164(telefone: str | None) -> str | None:
+    """Converte um telefone em E.164 ('+5511988887777').
+
+    Aceita JIDs do WhatsApp ('5511...@s.whatsapp.net'), mascaras e numeros
+    brasileiros sem DDI (10 ou 11 digitos, assume +55).
+    """
+    if not telefone:
+        return None
+    digitos = _NAO_DIGITOS.sub("", telefone.split("@", 1)[0])
+    if not digitos:
+        return None
+    if len(digitos) in (10, 11):
+        digitos = "55" + digitos
+    return "+" + digitos
+
+
+def chave_telefone(telefone: str | None) -> str | None:
+    """Chave de match: DDI + DDD + ultimos 8 digitos para numeros BR.
+
+    '5511988887777' e '551188887777' (sem o 9o digito) geram a mesma chave
+    '551188887777'. Numeros de outros paises usam os digitos do E.164.
+    """
+    e164 = normalizar_e164(telefone)
+    if e164 is None:
+        return None
+    digitos = e164[1:]
+    if digitos.startswith("55") and len(digitos) in (12, 13):
+        return digitos[:4] + digitos[-8:]
+    return digitos
@@ -2,35 +2,26 @@
 
 import logging
 
-from fastapi import APIRouter, Depends, Header, HTTPException, Request
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Header, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 
 from src.config import settings
+from src.database import cache
 from src.database.connection import SessionLocal
-from src.database.models import Conversa, Vendedor
-from src.database.queries import (
-    buscar_instancia_por_nome,
-    buscar_ou_criar_conversa,
-    salvar_mensagem,
-)
-from src.whatsapp.parser import parsear_webhook
+from src.database.queries import salvar_mensagem
+from src.whatsapp.ingest import fila_ingestao, persistir_lote
+from src.whatsapp.journal import journal
+from src.whatsapp.parser import MensagemParseada, decodificar_json, parsear_webhook_lote
+from src.whatsapp.roteamento import RotaIgnorada, rotear_mensagem
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 @router.post("/webhook/messages")
 async def receber_mensagem(
     request: Request,
-    db: Session = Depends(get_db),
     apikey: str | None = Header(None),
 ):
     """
@@ -38,107 +29,90 @@ async def receber_mensagem(
 
     Fluxo:
     0. Valida webhook_secret (se configurado)
-    1. Parseia o payload
-    2. Identifica empresa pela instance_name do payload
-    3. Identifica vendedor dentro da empresa
-    4. Salva mensagem no banco com empresa_id
+    1. Parseia o payload (um evento, `data` em lista ou lista de eventos)
+    2. Descarta duplicatas recentes (LRU de message_id)
+    3. Grava o payload aceito no journal local (se aberto)
+    4. Enfileira as mensagens para o writer em lote e responde 202
+       (um lote inteiro ou nada: fila cheia responde 503)
+    5. Sem fila ativa, ou lote maior que a fila: roteia e salva na propria
+       requisicao, fora do event loop (varias mensagens num unico commit)
     """
     # Validar secret do webhook (se configurado)
     if settings.webhook_secret and apikey != settings.webhook_secret:
         logger.warning("Webhook rejeitado: apikey inválida")
         raise HTTPException(status_code=401, detail="Webhook não autorizado")
 
-    payload = await request.json()
+    corpo = await request.body()
+    payload = decodificar_json(corpo)
 
-    msg = parsear_webhook(payload)
-    if msg is None:
+    mensagens = list(parsear_webhook_lote(payload))
+    if not mensagens:
         return {"status": "ignorado", "motivo": "evento nao processavel"}
 
-    # --- Identificar empresa pela instancia ---
-    instancia = buscar_instancia_por_nome(db, msg.instance_name)
-    if not instancia:
-        logger.warning(f"Instancia '{msg.instance_name}' nao registrada. Mensagem ignorada.")
-        return {"status": "ignorado", "motivo": "instancia nao registrada"}
-
-    empresa_id = instancia.empresa_id
-
-    # --- Identificar quem eh vendedor e quem eh lead ---
-    if msg.enviada_por_mim:
-        lead_telefone = msg.telefone_destinatario
-        remetente = "vendedor"
-        nome_lead = ""
-    else:
-        lead_telefone = msg.telefone_remetente
-        remetente = "lead"
-        nome_lead = msg.nome_contato
-
-    # --- Identificar o vendedor DENTRO da empresa ---
-    vendedor = None
-
-    # 1. Buscar pelo telefone da instancia (match flexível p/ 9° dígito BR)
-    instance_phone = msg.instance_phone
-    if instance_phone:
-        # Buscar vendedores ativos da empresa e comparar últimos 8 dígitos
-        vendedores_ativos = (
-            db.query(Vendedor)
-            .filter(Vendedor.empresa_id == empresa_id, Vendedor.ativo.is_(True))
-            .all()
-        )
-        sufixo_inst = instance_phone[-8:]
-        for v in vendedores_ativos:
-            if v.telefone[-8:] == sufixo_inst:
-                vendedor = v
-                break
-
-    # 2. Buscar por conversa existente com esse lead (dentro da empresa)
-    if vendedor is None and not msg.enviada_por_mim:
-        conversa_existente = (
-            db.query(Conversa)
-            .join(Vendedor)
-            .filter(
-                Conversa.empresa_id == empresa_id,
-                Conversa.lead_telefone == lead_telefone,
-                Vendedor.ativo.is_(True),
-            )
-            .first()
+    # Retry/duplicata recente: descarta sem tocar no banco
+    mensagens = [
+        msg for msg in mensagens
+        if not (msg.message_id and cache.mensagens_recentes.contem((msg.instance_name, msg.message_id)))
+    ]
+    if not mensagens:
+        return {"status": "ignorado", "motivo": "mensagem duplicada"}
+
+    if journal.aberto:
+        await journal.gravar(corpo)
+
+    if fila_ingestao.ativa and len(mensagens) <= fila_ingestao.max_itens:
+        if not fila_ingestao.enfileirar_lote(mensagens):
+            logger.warning("Fila de ingestao cheia. Webhook recusado.")
+            raise HTTPException(status_code=503, detail="Fila de ingestao cheia")
+        conteudo = {"status": "enfileirado"}
+        if len(mensagens) > 1:
+            conteudo["recebidas"] = len(mensagens)
+        return JSONResponse(status_code=202, content=conteudo)
+
+    if len(mensagens) > 1:
+        # Lote (sincronizacao de historico/reconexao): um unico INSERT/commit
+        salvas = await run_in_threadpool(persistir_lote, mensagens)
+        return {"status": "salvo", "recebidas": len(mensagens), "salvas": salvas}
+
+    return await run_in_threadpool(_processar_mensagem, mensagens[0])
+
+
+def _processar_mensagem(msg: MensagemParseada) -> dict:
+    """Roteia e salva uma mensagem na hora (bloqueante)."""
+    db = SessionLocal()
+    try:
+        rota = rotear_mensagem(db, msg)
+        if isinstance(rota, RotaIgnorada):
+            return {"status": "ignorado", "motivo": rota.motivo}
+
+        mensagem = salvar_mensagem(
+            db,
+            conversa_id=rota.conversa_id,
+            remetente=rota.remetente,
+            conteudo=msg.conteudo,
+            tipo=msg.tipo,
+            enviada_em=msg.timestamp,
+            message_id=msg.message_id,
         )
-        if conversa_existente:
-            vendedor = db.get(Vendedor, conversa_existente.vendedor_id)
-
-    # 3. Fallback: primeiro vendedor ativo DA EMPRESA
-    if vendedor is None:
-        vendedor = (
-            db.query(Vendedor)
-            .filter(Vendedor.empresa_id == empresa_id, Vendedor.ativo.is_(True))
-            .first()
+        if msg.message_id:
+            cache.mensagens_recentes.adicionar((msg.instance_name, msg.message_id))
+        if mensagem is None:
+            return {"status": "ignorado", "motivo": "mensagem duplicada"}
+
+        logger.info(
+            f"Mensagem salva: empresa={rota.empresa_id} conversa={rota.conversa_id} "
+            f"remetente={rota.remetente} tipo={msg.tipo}"
         )
 
-    if vendedor is None:
-        logger.warning(f"Nenhum vendedor na empresa {empresa_id}. Mensagem ignorada.")
-        return {"status": "ignorado", "motivo": "nenhum vendedor na empresa"}
-
-    # --- Buscar ou criar conversa e salvar mensagem ---
-    conversa = buscar_ou_criar_conversa(
-        db, vendedor.id, lead_telefone, nome_lead, empresa_id=empresa_id
-    )
-
-    mensagem = salvar_mensagem(
-        db,
-        conversa_id=conversa.id,
-        remetente=remetente,
-        conteudo=msg.conteudo,
-        tipo=msg.tipo,
-        enviada_em=msg.timestamp,
-    )
-
-    logger.info(
-        f"Mensagem salva: empresa={empresa_id} conversa={conversa.id} "
-        f"remetente={remetente} tipo={msg.tipo}"
-    )
-
-    return {
-        "status": "salvo",
-        "empresa_id": empresa_id,
-        "conversa_id": conversa.id,
-        "mensagem_id": mensagem.id,
-    }
+        return {
+            "status": "salvo",
+            "empresa_id": rota.empresa_id,
+            "conversa_id": rota.conversa_id,
+            "mensagem_id": mensagem.id,
+        }
+    except Exception:
+        # Conversa criada pelo upsert pode ter sido cacheada sem commit
+        cache.conversas.limpar()
+        raise
+    finally:
+        db.close()
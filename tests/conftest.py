@@ -0,0 +1,11 @@
+import pytest
+
+from src.analysis.analyzer import clientes_openai
+
+
+@pytest.fixture(autouse=True)
+def _clientes_openai_novos():
+    """Cada teste monta os seus clientes (os testes trocam AsyncOpenAI por mock)."""
+    clientes_openai.descartar()
+    yield
+    clientes_openai.descartar()
@@ -103,6 +103,18 @@ MENSAGENS_TESTE = [
 ]
 
 
+def _resposta_mock(tokens: int = 150) -> MagicMock:
+    """Resposta do chat.completions.create com RESPOSTA_MOCK e uso de tokens."""
+    mock_message = MagicMock()
+    mock_message.content = json.dumps(RESPOSTA_MOCK)
+    mock_choice = MagicMock()
+    mock_choice.message = mock_message
+    mock_response = MagicMock()
+    mock_response.choices = [mock_choice]
+    mock_response.usage.total_tokens = tokens
+    return mock_response
+
+
 @pytest.mark.asyncio
 async def test_analisar_conversa_sucesso():
     """Testa fluxo completo com mock da OpenAI."""
@@ -149,11 +161,69 @@ async def test_analisar_conversa_erro_openai():
             await analisar_conversa(MENSAGENS_TESTE)
 
 
+@pytest.mark.asyncio
+async def test_clientes_openai_reaproveitados_por_chave():
+    """Mesma (api_key, base_url, timeout) reusa o cliente; fechar() encerra os pools."""
+    from src.analysis.analyzer import ClientesOpenAI
+
+    clientes = ClientesOpenAI(max_conexoes=4, max_conexoes_ociosas=2)
+    a = clientes.obter("sk-empresa-1")
+    assert clientes.obter("sk-empresa-1") is a
+    assert clientes.obter("sk-empresa-2") is not a
+    assert clientes.obter("sk-empresa-1", timeout=60.0) is not a
+
+    await clientes.fechar()
+    assert a.is_closed()
+    assert clientes.obter("sk-empresa-1") is not a
+    await clientes.fechar()
+
+
+def test_prompt_em_cache_com_fallback_e_checagem_de_versao(monkeypatch):
+    """Prompt por empresa com fallback global; salvar_prompt invalida, escrita externa aparece na checagem."""
+    from datetime import datetime
+
+    from src.analysis.analyzer import SYSTEM_PROMPT, _carregar_prompt_do_banco
+    from src.database import cache
+    from src.database.connection import SessionLocal, criar_tabelas
+    from src.database.models import ConfiguracaoPrompt, Empresa
+    from src.database.queries import salvar_prompt
+
+    criar_tabelas()
+    db = SessionLocal()
+    db.query(ConfiguracaoPrompt).delete()
+    empresa = Empresa(nome="Empresa Prompt")
+    db.add(empresa)
+    db.commit()
+    cache.invalidar_configuracoes()
+
+    assert _carregar_prompt_do_banco(empresa.id) == SYSTEM_PROMPT
+    salvar_prompt(db, "Prompt global")
+    assert _carregar_prompt_do_banco(empresa.id) == "Prompt global"
+    salvar_prompt(db, "Prompt da empresa", empresa_id=empresa.id)
+    assert _carregar_prompt_do_banco(empresa.id) == "Prompt da empresa"
+    assert _carregar_prompt_do_banco(None) == "Prompt global"
+
+    # Escrita de outro processo (sem invalidar): so aparece na checagem de versao
+    db.query(ConfiguracaoPrompt).filter(ConfiguracaoPrompt.empresa_id == empresa.id).update(
+        {"conteudo": "Editado no dashboard", "atualizado_em": datetime.now()}
+    )
+    db.commit()
+    monkeypatch.setattr(cache.configuracoes, "verificacao_seg", 3600)
+    assert _carregar_prompt_do_banco(empresa.id) == "Prompt da empresa"
+    monkeypatch.setattr(cache.configuracoes, "verificacao_seg", 0)
+    assert _carregar_prompt_do_banco(empresa.id) == "Editado no dashboard"
+
+    db.query(ConfiguracaoPrompt).delete()
+    db.commit()
+    db.close()
+    cache.invalidar_configuracoes()
+
+
 # === Testes do endpoint (integracao com mock) ===
 
 from fastapi.testclient import TestClient
 from src.database.connection import SessionLocal, criar_tabelas
-from src.database.models import Analise, Conversa, Mensagem, Vendedor
+from src.database.models import Analise, Conversa, Mensagem, MetricaHoraria, MetricaPendente, MetricaPeriodo, Vendedor
 from src.main import app
 
 
@@ -161,6 +231,9 @@ def _setup_conversa_teste():
     """Cria vendedor + conversa + mensagens para testes de endpoint."""
     criar_tabelas()
     db = SessionLocal()
+    db.query(MetricaPendente).delete()
+    db.query(MetricaHoraria).delete()
+    db.query(MetricaPeriodo).delete()
     db.query(Analise).delete()
     db.query(Mensagem).delete()
     db.query(Conversa).delete()
@@ -250,6 +323,158 @@ def test_endpoint_listar_analises():
     assert data[0]["score_qualidade"] == 8.0
 
 
+def test_endpoint_analisar_lote():
+    """POST /analisar/lote analisa as conversas do dia e soma os tokens."""
+    conversa_id = _setup_conversa_teste()
+    client = TestClient(app)
+
+    with patch("src.analysis.analyzer.AsyncOpenAI") as MockClient:
+        instance = MockClient.return_value
+        instance.chat.completions.create = AsyncMock(return_value=_resposta_mock())
+        response = client.post("/analisar/lote", params={"concorrencia": 2})
+
+    # Roda em segundo plano: 202 com o id, resumo consultado depois
+    assert response.status_code == 202
+    execucao_id = response.json()["execucao_id"]
+    execucao = client.get(f"/analisar/lote/{execucao_id}").json()
+    assert execucao["status"] == "concluida"
+    resumo = execucao["resumo"]
+    assert (resumo["total"], resumo["analisadas"], resumo["falhas"], resumo["tokens"]) == (1, 1, 0, 150)
+
+    db = SessionLocal()
+    conversa = db.get(Conversa, conversa_id)
+    assert conversa.ultima_classificacao == "mql"
+    assert conversa.ultima_analise.tokens_usados == 150
+    db.close()
+
+
+def test_endpoint_analisar_lote_valida_datas():
+    client = TestClient(app)
+    assert client.post("/analisar/lote", params={"data_fim": "2026-13-01"}).status_code == 422
+    r = client.post("/analisar/lote", params={"data_inicio": "2026-02-10", "data_fim": "2026-02-01"})
+    assert r.status_code == 422
+    assert client.get("/analisar/lote/nao-existe").status_code == 404
+
+
+def test_endpoint_analisar_reaproveita_cache():
+    """Conteudo ja analisado nao chama a OpenAI de novo, salvo com forcar=true."""
+    conversa_id = _setup_conversa_teste()
+    client = TestClient(app)
+
+    with patch("src.analysis.analyzer.AsyncOpenAI") as MockClient:
+        create = MockClient.return_value.chat.completions.create = AsyncMock(return_value=_resposta_mock())
+        primeira = client.post(f"/analisar/{conversa_id}").json()
+        segunda = client.post(f"/analisar/{conversa_id}").json()
+        assert create.await_count == 1
+        client.post(f"/analisar/{conversa_id}", params={"forcar": True})
+        assert create.await_count == 2
+
+    assert (primeira["em_cache"], segunda["em_cache"]) == (False, True)
+    assert segunda["analise_id"] == primeira["analise_id"]
+    assert segunda["score_qualidade"] == 8.0
+
+    db = SessionLocal()
+    analises = db.query(Analise).filter(Analise.conversa_id == conversa_id).all()
+    assert len(analises) == 2  # a resposta do cache nao grava linha repetida
+    assert len({a.hash_conteudo for a in analises}) == 1
+    db.close()
+
+
+def _analisar_pendentes(client: TestClient) -> dict:
+    """POST /analisar/pendentes e resumo da execucao (BackgroundTasks roda antes do post retornar)."""
+    response = client.post("/analisar/pendentes")
+    assert response.status_code == 202
+    execucao = client.get(f"/analisar/lote/{response.json()['execucao_id']}").json()
+    assert execucao["status"] == "concluida"
+    return execucao["resumo"]
+
+
+def test_endpoint_analisar_pendentes_so_conversas_com_mensagens_novas():
+    """POST /analisar/pendentes pega so o que mudou desde a ultima analise."""
+    from datetime import datetime, timedelta
+
+    from src.database.estado_conversa import recalcular_estado
+    from src.database.queries import recalcular_ultima_analise
+
+    conversa_id = _setup_conversa_teste()
+    client = TestClient(app)
+    db = SessionLocal()
+    uma_hora = datetime.now() - timedelta(hours=1)
+    for i, mensagem in enumerate(db.query(Mensagem).filter(Mensagem.conversa_id == conversa_id)):
+        mensagem.enviada_em = uma_hora + timedelta(minutes=i)
+    recalcular_estado(db, [conversa_id])
+    db.commit()
+
+    def nova_mensagem(enviada_em):
+        db.add(Mensagem(
+            conversa_id=conversa_id, remetente="lead", conteudo="E o plano mensal?", enviada_em=enviada_em,
+        ))
+        recalcular_estado(db, [conversa_id])
+        db.commit()
+
+    with patch("src.analysis.analyzer.AsyncOpenAI") as MockClient:
+        MockClient.return_value.chat.completions.create = AsyncMock(return_value=_resposta_mock())
+        primeira = _analisar_pendentes(client)
+        segunda = _analisar_pendentes(client)
+        # Como se a analise tivesse rodado logo depois da conversa
+        db.query(Analise).filter(Analise.conversa_id == conversa_id).update(
+            {"analisada_em": uma_hora + timedelta(minutes=10)}
+        )
+        recalcular_ultima_analise(db, [conversa_id])
+        nova_mensagem(datetime.now())  # conversa em andamento: espera a quietude
+        terceira = _analisar_pendentes(client)
+        db.query(Mensagem).filter(Mensagem.conteudo == "E o plano mensal?").delete()
+        nova_mensagem(datetime.now() - timedelta(minutes=30))
+        quarta = _analisar_pendentes(client)
+
+    assert [r["analisadas"] for r in (primeira, segunda, terceira, quarta)] == [1, 0, 0, 1]
+    assert db.query(Analise).filter(Analise.conversa_id == conversa_id).count() == 2
+    db.close()
+
+
+def test_pendentes_pega_mensagem_que_chegou_durante_a_analise():
+    """Mensagem gravada entre a leitura e o save (com enviada_em antigo) deixa a conversa pendente."""
+    from datetime import datetime, timedelta
+
+    from src.database.estado_conversa import recalcular_estado
+
+    conversa_id = _setup_conversa_teste()
+    client = TestClient(app)
+    db = SessionLocal()
+    uma_hora = datetime.now() - timedelta(hours=1)
+    for i, mensagem in enumerate(db.query(Mensagem).filter(Mensagem.conversa_id == conversa_id)):
+        mensagem.enviada_em = uma_hora + timedelta(minutes=i)
+    recalcular_estado(db, [conversa_id])
+    db.commit()
+
+    async def responder_e_receber_mensagem(*args, **kwargs):
+        # Chega enquanto a OpenAI responde (ex: atraso na fila), com horario anterior ao save
+        db.add(Mensagem(
+            conversa_id=conversa_id, remetente="lead", conteudo="Tem desconto?",
+            enviada_em=uma_hora + timedelta(minutes=20),
+        ))
+        recalcular_estado(db, [conversa_id])
+        db.commit()
+        return _resposta_mock()
+
+    with patch("src.analysis.analyzer.AsyncOpenAI") as MockClient:
+        create = MockClient.return_value.chat.completions.create = AsyncMock(
+            side_effect=responder_e_receber_mensagem
+        )
+        primeira = _analisar_pendentes(client)
+        create.side_effect = None
+        create.return_value = _resposta_mock()
+        segunda = _analisar_pendentes(client)
+        terceira = _analisar_pendentes(client)
+
+    assert [r["analisadas"] for r in (primeira, segunda, terceira)] == [1, 1, 0]
+    conversa = db.get(Conversa, conversa_id)
+    db.refresh(conversa)
+    assert conversa.ultima_analise_msgs == 5
+    db.close()
+
+
+
 if __name__ == "__main__":
     print("=" * 60)
     print("  TESTES DO ANALYZER - AGENTE COMERCIAL")
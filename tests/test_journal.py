@@ -0,0 +1,140 @@
+"""Testes do journal de webhooks: formato, rotacao, retencao, registro truncado e replay idempotente."""
+
+import asyncio
+import json
+import os
+import time
+
+import pytest
+
+from src.database.connection import SessionLocal
+from src.database.models import Mensagem
+from src.whatsapp.journal import (
+    Checkpoint,
+    Journal,
+    compactar_journal,
+    ler_registros,
+    listar_segmentos,
+    reprocessar_journal,
+)
+from tests.test_webhook import _payload_lead, setup
+
+
+def _gravar(journal: Journal, payloads: list[dict]):
+    async def _rodar():
+        journal.abrir()
+        await asyncio.gather(*(journal.gravar(json.dumps(p).encode()) for p in payloads))
+        await journal.fechar()
+
+    asyncio.run(_rodar())
+
+
+def test_journal_grava_e_le_em_ordem(tmp_path):
+    journal = Journal(str(tmp_path), segmento_max_bytes=1024 * 1024, intervalo_fsync_ms=1)
+    payloads = [_payload_lead(f"J{i}", f"Mensagem {i}") for i in range(5)]
+    _gravar(journal, payloads)
+
+    lidos = [json.loads(p) for _, _, p in ler_registros(tmp_path)]
+    assert [p["data"]["key"]["id"] for p in lidos] == ["J0", "J1", "J2", "J3", "J4"]
+
+
+def test_journal_rotaciona_segmentos(tmp_path):
+    journal = Journal(str(tmp_path), segmento_max_bytes=100, intervalo_fsync_ms=0)
+    for i in range(3):
+        _gravar(journal, [_payload_lead(f"R{i}")])
+
+    assert len(listar_segmentos(tmp_path)) == 4  # 3 cheios + 1 novo vazio
+    assert len(list(ler_registros(tmp_path))) == 3
+
+
+def test_journal_registro_truncado_e_ignorado(tmp_path):
+    journal = Journal(str(tmp_path), segmento_max_bytes=1024 * 1024, intervalo_fsync_ms=1)
+    _gravar(journal, [_payload_lead("T1"), _payload_lead("T2")])
+
+    segmento = listar_segmentos(tmp_path)[-1]
+    conteudo = segmento.read_bytes()
+    segmento.write_bytes(conteudo[:-10])  # simula queda no meio do write
+
+    lidos = list(ler_registros(tmp_path))
+    assert len(lidos) == 1
+
+
+def test_journal_continua_do_checkpoint(tmp_path):
+    journal = Journal(str(tmp_path), segmento_max_bytes=1024 * 1024, intervalo_fsync_ms=1)
+    _gravar(journal, [_payload_lead("C1"), _payload_lead("C2"), _payload_lead("C3")])
+
+    segmento, offset, _ = next(iter(ler_registros(tmp_path)))
+    restantes = list(ler_registros(tmp_path, Checkpoint(segmento, offset)))
+    assert [json.loads(p)["data"]["key"]["id"] for _, _, p in restantes] == ["C2", "C3"]
+
+
+def test_replay_idempotente(tmp_path):
+    setup()
+    journal = Journal(str(tmp_path), segmento_max_bytes=1024 * 1024, intervalo_fsync_ms=1)
+    _gravar(journal, [_payload_lead("P1", "Primeira"), _payload_lead("P2", "Segunda")])
+    checkpoint = tmp_path / "checkpoint.json"
+
+    resumo = reprocessar_journal(tmp_path, checkpoint)
+    assert resumo["salvos"] == 2
+
+    # Sem checkpoint: relê tudo, mas nada e duplicado
+    checkpoint.unlink()
+    resumo = reprocessar_journal(tmp_path, checkpoint)
+    assert resumo["salvos"] == 0
+    assert resumo["duplicados"] == 2
+
+    # Com checkpoint: nada a ler
+    resumo = reprocessar_journal(tmp_path, checkpoint)
+    assert resumo["lidos"] == 0
+
+    db = SessionLocal()
+    assert db.query(Mensagem).count() == 2
+    db.close()
+
+
+def test_replay_apaga_segmentos_ja_processados(tmp_path):
+    setup()
+    journal = Journal(str(tmp_path), segmento_max_bytes=100, intervalo_fsync_ms=0)
+    for i in range(3):
+        _gravar(journal, [_payload_lead(f"A{i}")])
+    checkpoint = tmp_path / "checkpoint.json"
+
+    resumo = reprocessar_journal(tmp_path, checkpoint)
+    assert (resumo["salvos"], resumo["segmentos_apagados"]) == (3, 2)
+    # Fica o segmento do checkpoint e o atual (vazio)
+    assert [p.name for p in listar_segmentos(tmp_path)] == ["journal-0000000003.log", "journal-0000000004.log"]
+    assert reprocessar_journal(tmp_path, checkpoint)["lidos"] == 0
+
+    resumo = reprocessar_journal(tmp_path, checkpoint, compactar=False)
+    assert resumo["segmentos_apagados"] == 0
+
+
+def test_journal_rotacao_apaga_segmentos_fora_da_retencao(tmp_path):
+    journal = Journal(str(tmp_path), segmento_max_bytes=100, intervalo_fsync_ms=0, retencao_seg=3600)
+    for i in range(2):
+        _gravar(journal, [_payload_lead(f"V{i}")])
+    antigo = time.time() - 7200
+    for caminho in listar_segmentos(tmp_path)[:2]:
+        os.utime(caminho, (antigo, antigo))
+
+    _gravar(journal, [_payload_lead("V2")])  # rotaciona e aplica a retencao
+    assert [p.name for p in listar_segmentos(tmp_path)] == ["journal-0000000003.log", "journal-0000000004.log"]
+
+    # Sem retencao, so o checkpoint libera segmentos; o atual nunca sai
+    assert compactar_journal(tmp_path, antes_de="journal-0000000009.log", atual="journal-0000000004.log") == [
+        "journal-0000000003.log"
+    ]
+
+
+@pytest.mark.asyncio
+async def test_journal_agrupa_fsync(tmp_path, monkeypatch):
+    journal = Journal(str(tmp_path), segmento_max_bytes=1024 * 1024, intervalo_fsync_ms=20)
+    chamadas = []
+    original = journal._escrever_e_sincronizar
+    monkeypatch.setattr(journal, "_escrever_e_sincronizar", lambda r: (chamadas.append(len(r)), original(r)))
+
+    journal.abrir()
+    await asyncio.gather(*(journal.gravar(b'{"n": %d}' % i) for i in range(10)))
+    await journal.fechar()
+
+    assert chamadas == [10]
@@ -1,21 +1,41 @@
 """Testes do motor de metricas com fixtures de timestamps controlados."""
 
-from datetime import datetime
+from datetime import date, datetime
 from unittest.mock import MagicMock
 
 import pytest
 from fastapi.testclient import TestClient
 
 from src.database.connection import SessionLocal, criar_tabelas
-from src.database.models import Analise, Conversa, Mensagem, MetricaDiaria, Vendedor
+from src.database.models import (
+    Analise,
+    Conversa,
+    Mensagem,
+    MetricaDiaria,
+    MetricaHoraria,
+    MetricaPendente,
+    MetricaPeriodo,
+    Vendedor,
+)
+from src.database.queries import (
+    buscar_conversas_do_dia,
+    buscar_metricas_horarias_periodo,
+    salvar_analise,
+    salvar_mensagem,
+)
 from src.main import app
 from src.metrics.calculator import (
     TemposResposta,
     _calcular_score_medio,
     _contar_funil,
     _contar_leads_sem_resposta,
+    calcular_metricas,
     calcular_tempos_resposta,
+    recalcular_pendentes,
 )
+from src.metrics.backfill import executar_backfill
+from src.metrics.rollups import agregar_periodo, fatiar_periodo
+from src.metrics.sketch import DDSketch, percentis_por_vendedor, sketch_de_valores
 
 
 # === Helpers ===
@@ -36,14 +56,8 @@ def _make_conversa(
     """Cria mock de Conversa com mensagens e analise opcional."""
     conversa = MagicMock(spec=Conversa)
     conversa.mensagens = mensagens
-    if classificacao is not None:
-        analise = MagicMock(spec=Analise)
-        analise.classificacao = classificacao
-        analise.score_qualidade = score
-        analise.analisada_em = datetime(2026, 2, 7, 12, 0, 0)
-        conversa.analises = [analise]
-    else:
-        conversa.analises = []
+    conversa.ultima_classificacao = classificacao
+    conversa.ultimo_score = score if classificacao is not None else None
     return conversa
 
 
@@ -178,6 +192,9 @@ def _setup_dados_metricas():
     """Cria vendedor + conversas + mensagens + analises para testes de endpoint."""
     criar_tabelas()
     db = SessionLocal()
+    db.query(MetricaPendente).delete()
+    db.query(MetricaHoraria).delete()
+    db.query(MetricaPeriodo).delete()
     db.query(MetricaDiaria).delete()
     db.query(Analise).delete()
     db.query(Mensagem).delete()
@@ -276,6 +293,294 @@ def test_endpoint_ranking():
     assert data[0]["posicao"] == 1
 
 
+def _setup_dados_motores():
+    """Dois vendedores: turnos multiplos, analises reclassificadas, historico de outro dia."""
+    criar_tabelas()
+    db = SessionLocal()
+    db.query(MetricaPendente).delete()
+    db.query(MetricaHoraria).delete()
+    db.query(MetricaPeriodo).delete()
+    db.query(MetricaDiaria).delete()
+    db.query(Analise).delete()
+    db.query(Mensagem).delete()
+    db.query(Conversa).delete()
+    db.query(Vendedor).delete()
+
+    v1 = Vendedor(nome="Vendedor Motor 1", telefone="5511900000011")
+    v2 = Vendedor(nome="Vendedor Motor 2 (sem conversas)", telefone="5511900000012")
+    db.add_all([v1, v2])
+    db.flush()
+
+    def conversa(lead: str, mensagens: list[tuple[str, datetime]], analises=()):
+        c = Conversa(vendedor_id=v1.id, lead_telefone=lead)
+        db.add(c)
+        db.flush()
+        for remetente, quando in mensagens:
+            db.add(Mensagem(conversa_id=c.id, remetente=remetente, conteudo="x", enviada_em=quando))
+        for classificacao, score, quando in analises:
+            db.add(Analise(conversa_id=c.id, classificacao=classificacao, score_qualidade=score, analisada_em=quando))
+
+    dia = datetime(2026, 2, 7)
+    # Dois turnos; o segundo com fracao de segundo (59.5s -> 59)
+    conversa("5511911110001", [
+        ("lead", dia.replace(hour=10)),
+        ("lead", dia.replace(hour=10, minute=1)),
+        ("vendedor", dia.replace(hour=10, minute=5)),
+        ("vendedor", dia.replace(hour=10, minute=6)),
+        ("lead", dia.replace(hour=10, minute=30, microsecond=700000)),
+        ("vendedor", dia.replace(hour=10, minute=31, microsecond=200000)),
+    ], analises=[("sql", 6.0, dia.replace(hour=9)), ("mql", 8.3, dia.replace(hour=12))])
+    # Lead sem resposta
+    conversa("5511911110002", [("lead", dia.replace(hour=14))], analises=[("cliente", 9.1, dia.replace(hour=15))])
+    # So no dia anterior: fora do dia
+    conversa("5511911110003", [("lead", datetime(2026, 2, 6, 9)), ("vendedor", datetime(2026, 2, 6, 9, 3))])
+    # Historico antigo ja respondido + lead pendente desde o dia anterior, respondido no dia
+    conversa("5511911110004", [
+        ("lead", datetime(2026, 2, 5, 8)),
+        ("vendedor", datetime(2026, 2, 5, 8, 2)),
+        ("lead", datetime(2026, 2, 6, 23, 50)),
+        ("lead", datetime(2026, 2, 6, 23, 55)),
+        ("vendedor", dia.replace(hour=11)),
+        ("lead", dia.replace(hour=11, minute=10)),
+        ("vendedor", dia.replace(hour=11, minute=12)),
+        ("lead", datetime(2026, 2, 8, 9)),
+    ], analises=[("frio", None, dia.replace(hour=12))])
+
+    db.commit()
+    ids = (v1.id, v2.id)
+    db.close()
+    return ids
+
+
+def test_motor_sql_igual_ao_motor_python():
+    v1, v2 = _setup_dados_motores()
+    db = SessionLocal()
+    resultados = {}
+    for motor in ("python", "sql"):
+        resultados[motor] = sorted(
+            ({k: v for k, v in m.items() if k != "metrica_id"} for m in calcular_metricas(db, "2026-02-07", motor=motor)),
+            key=lambda m: m["vendedor_id"],
+        )
+    db.close()
+
+    assert resultados["sql"] == resultados["python"]
+    m1, m2 = resultados["sql"]
+    assert (m1["vendedor_id"], m2["vendedor_id"]) == (v1, v2)
+    assert m1["total_atendimentos"] == 3
+    assert (m1["total_mql"], m1["total_sql"], m1["total_conversoes"]) == (1, 0, 1)
+    assert m1["score_medio"] == 8.7
+    assert m1["leads_sem_resposta"] == 1
+    assert m1["tempo_primeira_resp_seg"] == round((300 + 670 * 60) / 2)  # 10:00->10:05, 23:50->11:00
+    assert m2["total_atendimentos"] == 0 and m2["tempo_primeira_resp_seg"] is None
+
+
+def test_conversas_do_dia_carregam_so_a_janela_do_dia():
+    _setup_dados_motores()
+    db = SessionLocal()
+    conversas = buscar_conversas_do_dia(db, "2026-02-07")
+    pendente = next(c for c in conversas if c.lead_telefone == "5511911110004")
+
+    # Inicio do turno pendente (23:50) + mensagens do dia; sem historico antigo nem dia seguinte
+    assert [m.enviada_em for m in pendente.mensagens] == [
+        datetime(2026, 2, 6, 23, 50),
+        datetime(2026, 2, 7, 11),
+        datetime(2026, 2, 7, 11, 10),
+        datetime(2026, 2, 7, 11, 12),
+    ]
+    assert len(conversas) == 3
+    db.close()
+
+
+def test_recalculo_incremental_so_pares_pendentes():
+    v1, v2 = _setup_dados_motores()
+    db = SessionLocal()
+    db.query(MetricaPendente).delete()
+    db.commit()
+    conversa = db.query(Conversa).filter(Conversa.lead_telefone == "5511911110003").one()
+
+    # Mensagem nova marca (vendedor, dia); ja calculado e nao pendente fica intocado
+    salvar_mensagem(db, conversa.id, "lead", "voltei", enviada_em=datetime(2026, 2, 9, 8))
+    calcular_metricas(db, "2026-02-07")
+    antes = db.query(MetricaDiaria).filter(MetricaDiaria.data == "2026-02-07").count()
+
+    assert recalcular_pendentes(db) == 1
+    assert db.query(MetricaPendente).count() == 0
+    metrica = db.query(MetricaDiaria).filter_by(vendedor_id=v1, data="2026-02-09").one()
+    assert metrica.total_atendimentos == 1 and metrica.leads_sem_resposta == 1
+    assert metrica.calculada_em is not None
+    assert db.query(MetricaDiaria).filter(MetricaDiaria.data == "2026-02-07").count() == antes
+
+    # Analise nova marca todos os dias com mensagens da conversa
+    salvar_analise(db, conversa.id, 7.0, "mql", [], "neutro", "ok")
+    assert {p.data for p in db.query(MetricaPendente)} == {"2026-02-06", "2026-02-09"}
+    assert recalcular_pendentes(db) == 2
+    assert db.query(MetricaDiaria).filter_by(vendedor_id=v1, data="2026-02-09").one().total_mql == 1
+    db.close()
+
+
+def test_salvar_analise_aponta_a_mais_recente():
+    _setup_dados_motores()
+    db = SessionLocal()
+    conversa = db.query(Conversa).filter(Conversa.lead_telefone == "5511911110001").one()
+    assert (conversa.ultima_classificacao, conversa.ultimo_score) == ("mql", 8.3)  # historico reapontado
+    atualizada_em = conversa.atualizada_em
+
+    analise = salvar_analise(db, conversa.id, 4.5, "frio", [], "negativo", "ok")
+    db.refresh(conversa)
+    assert conversa.ultima_analise_id == analise.id
+    assert (conversa.ultima_classificacao, conversa.ultimo_score, conversa.ultimo_sentimento) == ("frio", 4.5, "negativo")
+    assert conversa.ultima_analise.feedback_ia == "ok"
+    assert conversa.atualizada_em == atualizada_em
+    db.close()
+
+
+def test_ddsketch_erro_relativo_e_mescla():
+    valores = [0, 1, 2] + [int(1.07 ** i) for i in range(200)]
+    exatos = sorted(valores)
+    inteiro = DDSketch()
+    metades = DDSketch(), DDSketch()
+    for i, valor in enumerate(valores):
+        inteiro.adicionar(valor)
+        metades[i % 2].adicionar(valor)
+    mesclado = DDSketch.de_bytes(metades[0].para_bytes()).mesclar(DDSketch.de_bytes(metades[1].para_bytes()))
+
+    assert mesclado.para_bytes() == inteiro.para_bytes()
+    for q in (0.01, 0.5, 0.9, 0.99):
+        exato = exatos[int(q * (len(exatos) - 1))]
+        assert abs(inteiro.quantil(q) - exato) <= 0.01 * exato
+    assert DDSketch().quantil(0.5) is None
+
+
+def test_percentis_mesclam_dias():
+    v1, _ = _setup_dados_motores()
+    db = SessionLocal()
+    calcular_metricas(db, "2026-02-06")
+    calcular_metricas(db, "2026-02-07")
+    dia7 = db.query(MetricaDiaria).filter_by(vendedor_id=v1, data="2026-02-07").one()
+    sketch_sql = (dia7.sketch_primeira_resp, dia7.sketch_resposta)
+    calcular_metricas(db, "2026-02-07", motor="python")
+    db.refresh(dia7)
+    assert (dia7.sketch_primeira_resp, dia7.sketch_resposta) == sketch_sql
+    db.close()
+
+    # 06/02: 180s; 07/02: 300, 59, 40200, 120 -> 5 respostas no periodo
+    response = TestClient(app).get("/metricas/percentis", params={"inicio": "2026-02-06", "fim": "2026-02-07"})
+    assert response.status_code == 200
+    resposta = response.json()["geral"]["resposta"]
+    assert resposta["amostras"] == 5
+    # Quantil pelo posto q * (n - 1): p99 de 5 amostras e a quarta (300s)
+    assert abs(resposta["p50"] - 180) <= 2 and abs(resposta["p99"] - 300) <= 3
+    assert percentis_por_vendedor([(v1, None, sketch_de_valores([60]))])["geral"]["resposta"]["p50"] == 60
+
+
+def test_endpoint_percentis_valida_datas():
+    client = TestClient(app)
+    assert client.get("/metricas/percentis", params={"inicio": "2026-02-30", "fim": "2026-03-01"}).status_code == 422
+    r = client.get("/metricas/percentis", params={"inicio": "2026-02-10", "fim": "2026-02-01"})
+    assert r.status_code == 422
+
+
+def test_rollup_horario():
+    _setup_dados_motores()
+    db = SessionLocal()
+    calcular_metricas(db, "2026-02-07")
+    calcular_metricas(db, "2026-02-07", motor="python")  # recalculo substitui, nao duplica
+    horas = {h["hora"]: h for h in buscar_metricas_horarias_periodo(db, "2026-02-07", "2026-02-07")}
+    db.close()
+
+    assert sorted(horas) == [10, 11, 14]
+    assert horas[10] == {
+        "hora": 10, "msgs_lead": 3, "msgs_vendedor": 3, "leads_novos": 1,
+        "respostas": 2, "respostas_no_sla": 2, "soma_resposta_seg": 300 + 59,
+    }
+    # 11h: resposta ao lead pendente desde 23:50 (fora do SLA) e ao turno das 11:10
+    assert (horas[11]["leads_novos"], horas[11]["respostas"], horas[11]["respostas_no_sla"]) == (0, 2, 1)
+    assert horas[11]["soma_resposta_seg"] == 40200 + 120
+    assert (horas[14]["msgs_lead"], horas[14]["leads_novos"], horas[14]["respostas"]) == (1, 1, 0)
+
+
+def test_rollups_batem_com_o_diario():
+    v1, _ = _setup_dados_motores()
+    db = SessionLocal()
+    calcular_metricas(db, "2026-02-06")
+    calcular_metricas(db, "2026-02-07")
+
+    # Mesmo total lido do mes, da semana (02-08/02) e dos dias avulsos
+    por_mes = agregar_periodo(db, "2026-02-01", "2026-02-28")
+    por_semana = agregar_periodo(db, "2026-02-02", "2026-02-08")
+    por_dia = agregar_periodo(db, "2026-02-06", "2026-02-07")
+    assert db.query(MetricaPeriodo).filter_by(vendedor_id=v1).count() == 2
+    db.close()
+
+    assert por_mes == por_semana == por_dia
+    vendedor = next(m for m in por_mes if m["vendedor_id"] == v1)
+    assert vendedor["total_atendimentos"] >= 2
+    assert percentis_por_vendedor(
+        [(v1, vendedor["sketch_primeira_resp"], vendedor["sketch_resposta"])]
+    )["geral"]["resposta"]["amostras"] == 5
+
+
+def test_fatiar_periodo_prefere_meses_e_semanas():
+    fatias = fatiar_periodo(date(2026, 1, 15), date(2026, 3, 10))
+    assert [f for f in fatias if f[0] != "dia"] == [
+        ("semana", date(2026, 1, 19)),
+        ("mes", date(2026, 2, 1)),
+        ("semana", date(2026, 3, 2)),
+    ]
+    # 15-18/01, 26-31/01 (semana invadiria fevereiro), 01/03 e 09-10/03
+    assert sum(1 for f in fatias if f[0] == "dia") == 13
+
+
+def test_recalculo_em_lote_atualiza_as_mesmas_linhas():
+    v1, v2 = _setup_dados_motores()
+    db = SessionLocal()
+    primeira = {m["vendedor_id"]: m["metrica_id"] for m in calcular_metricas(db, "2026-02-07")}
+    segunda = {m["vendedor_id"]: m["metrica_id"] for m in calcular_metricas(db, "2026-02-07", motor="python")}
+    assert primeira == segunda and set(primeira) == {v1, v2}
+    assert db.query(MetricaDiaria).filter_by(data="2026-02-07").count() == 2
+    db.close()
+
+
+def test_backfill_paralelo_retomavel(tmp_path):
+    v1, v2 = _setup_dados_motores()
+    db = SessionLocal()
+    calcular_metricas(db, "2026-02-07")
+    esperado = db.query(MetricaDiaria).filter_by(vendedor_id=v1, data="2026-02-07").one()
+    esperado = {c: getattr(esperado, c) for c in ("total_atendimentos", "score_medio", "tempo_primeira_resp_seg")}
+    db.query(MetricaDiaria).delete()
+    db.query(MetricaPeriodo).delete()
+    db.query(MetricaPendente).delete()
+    db.add_all([
+        MetricaPendente(vendedor_id=v1, data="2026-02-07"),
+        MetricaPendente(vendedor_id=v2, data="2026-02-06"),
+        MetricaPendente(vendedor_id=v1, data="2026-02-08"),  # fora do intervalo
+    ])
+    db.commit()
+
+    checkpoint = tmp_path / "backfill.json"
+    resumo = executar_backfill("2026-02-06", "2026-02-07", empresa_ids=[], workers=2, checkpoint=checkpoint)
+    assert (resumo["concluidas"], resumo["falhas"], resumo["vendedor_dias"]) == (2, 0, 4)
+
+    db.expire_all()
+    gravada = db.query(MetricaDiaria).filter_by(vendedor_id=v1, data="2026-02-07").one()
+    assert {c: getattr(gravada, c) for c in esperado} == esperado
+    assert db.query(MetricaDiaria).filter_by(vendedor_id=v2).count() == 2
+    assert db.query(MetricaPeriodo).filter_by(vendedor_id=v1, granularidade="semana").count() == 1
+    assert [(p.vendedor_id, p.data) for p in db.query(MetricaPendente)] == [(v1, "2026-02-08")]
+    db.close()
+
+    # Retomada: tudo ja esta no checkpoint
+    resumo = executar_backfill("2026-02-06", "2026-02-07", empresa_ids=[], workers=2, checkpoint=checkpoint)
+    assert (resumo["puladas"], resumo["concluidas"]) == (2, 0)
+
+
+def test_motor_invalido():
+    db = SessionLocal()
+    with pytest.raises(ValueError):
+        calcular_metricas(db, "2026-02-07", motor="planilha")
+    db.close()
+
+
 def test_endpoint_metricas_dia_inexistente():
     client = TestClient(app)
     response = client.get("/metricas/dia/2020-01-01")
@@ -0,0 +1,59 @@
+"""Testa as migracoes versionadas do schema."""
+
+from sqlalchemy import create_engine, inspect, text
+
+from src.database.connection import Base
+from src.database.migrations import MIGRACOES, aplicar_migracoes, migracoes_pendentes
+
+
+def _banco_legado(tmp_path):
+    """Banco criado antes dos indices: sem uq de metricas e com metricas duplicadas."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'legado.db'}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_mensagens_enviada_em"))
+        conn.execute(text("DROP TABLE metricas_diarias"))
+        conn.execute(text(
+            "CREATE TABLE metricas_diarias (id INTEGER PRIMARY KEY, vendedor_id INTEGER NOT NULL, "
+            "data VARCHAR(10) NOT NULL, total_atendimentos INTEGER)"
+        ))
+        for total in (3, 5):
+            conn.execute(
+                text("INSERT INTO metricas_diarias (vendedor_id, data, total_atendimentos) VALUES (1, '2026-02-07', :t)"),
+                {"t": total},
+            )
+    return engine
+
+
+def test_migracoes_criam_indices_e_deduplicam(tmp_path):
+    engine = _banco_legado(tmp_path)
+
+    assert aplicar_migracoes(engine) == [m.versao for m in MIGRACOES]
+
+    indices = {i["name"] for i in inspect(engine).get_indexes("mensagens")}
+    assert {"ix_mensagens_enviada_em", "ix_mensagens_conversa_enviada"} <= indices
+    unicos = {i["name"] for i in inspect(engine).get_indexes("metricas_diarias") if i["unique"]}
+    assert "uq_metricas_diarias_vendedor_data" in unicos
+    assert "calculada_em" in {c["name"] for c in inspect(engine).get_columns("metricas_diarias")}
+    with engine.connect() as conn:
+        # Fica a metrica mais recente
+        assert conn.execute(text("SELECT total_atendimentos FROM metricas_diarias")).scalars().all() == [5]
+
+
+def test_migracoes_idempotentes(tmp_path):
+    engine = _banco_legado(tmp_path)
+    aplicar_migracoes(engine)
+
+    assert migracoes_pendentes(engine) == []
+    assert aplicar_migracoes(engine) == []
+
+
+def test_migracoes_nao_duplicam_constraints_do_create_all(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'novo.db'}")
+    Base.metadata.create_all(bind=engine)
+    aplicar_migracoes(engine)
+
+    # uq_mensagens_conversa_message_id ja existe como constraint: nenhum indice extra
+    assert "uq_mensagens_conversa_message_id" not in {
+        i["name"] for i in inspect(engine).get_indexes("mensagens")
+    }
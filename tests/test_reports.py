@@ -7,7 +7,16 @@ import pytest
 from fastapi.testclient import TestClient
 
 from src.database.connection import SessionLocal, criar_tabelas
-from src.database.models import Analise, Conversa, Mensagem, MetricaDiaria, Vendedor
+from src.database.models import (
+    Analise,
+    Conversa,
+    Mensagem,
+    MetricaDiaria,
+    MetricaHoraria,
+    MetricaPendente,
+    MetricaPeriodo,
+    Vendedor,
+)
 from src.main import app
 from src.reports.daily import detectar_alertas, dividir_mensagens, gerar_e_enviar_relatorio
 from src.reports.templates import (
@@ -218,6 +227,9 @@ async def test_gerar_e_enviar_relatorio_com_mock():
     """Pipeline completo com sender mockado."""
     criar_tabelas()
     db = SessionLocal()
+    db.query(MetricaPendente).delete()
+    db.query(MetricaHoraria).delete()
+    db.query(MetricaPeriodo).delete()
     db.query(MetricaDiaria).delete()
     db.query(Analise).delete()
     db.query(Mensagem).delete()
@@ -1,25 +1,70 @@
 """Testa o fluxo completo: webhook -> parser -> banco."""
 
+import asyncio
+from datetime import datetime
+
+import pytest
 from fastapi.testclient import TestClient
 
+from src.config import settings
+from src.database import cache
 from src.database.connection import SessionLocal, criar_tabelas
-from src.database.models import Conversa, Mensagem, Vendedor
+from src.database.models import (
+    Analise,
+    Conversa,
+    Empresa,
+    InstanciaEvolution,
+    Mensagem,
+    MetricaDiaria,
+    MetricaHoraria,
+    MetricaPendente,
+    MetricaPeriodo,
+    Vendedor,
+)
+from src.database.estado_conversa import calcular_estado
+from src.database.queries import (
+    criar_instancia_evolution,
+    criar_vendedor,
+    desativar_vendedor,
+    listar_leads_aguardando,
+    salvar_mensagem,
+    salvar_mensagens_lote,
+    upsert_conversa,
+)
 from src.main import app
+from src.whatsapp.ingest import FilaIngestao, persistir_lote
+from src.whatsapp.journal import journal, ler_registros
+from src.whatsapp import parser
+from src.whatsapp.parser import decodificar_json, parsear_webhook, parsear_webhook_lote
+from src.whatsapp.telefone import chave_telefone, normalizar_e164
 
 
 def setup():
-    """Cria tabelas e insere vendedor de teste."""
+    """Cria tabelas e insere empresa, instancia e vendedor de teste."""
     criar_tabelas()
+    cache.invalidar_tudo()
     db = SessionLocal()
     # Limpar dados anteriores
+    db.query(MetricaPendente).delete()
+    db.query(MetricaHoraria).delete()
+    db.query(MetricaPeriodo).delete()
+    db.query(MetricaDiaria).delete()
+    db.query(Analise).delete()
     db.query(Mensagem).delete()
     db.query(Conversa).delete()
     db.query(Vendedor).delete()
-    # Inserir vendedor de teste
-    vendedor = Vendedor(nome="Carlos Vendedor", telefone="5511988887777")
+    db.query(InstanciaEvolution).delete()
+    # Inserir empresa, instancia e vendedor de teste
+    empresa = Empresa(nome="Empresa Webhook")
+    db.add(empresa)
+    db.flush()
+    db.add(InstanciaEvolution(empresa_id=empresa.id, nome_instancia="agente-comercial"))
+    vendedor = Vendedor(nome="Carlos Vendedor", telefone="5511988887777", empresa_id=empresa.id)
     db.add(vendedor)
     db.commit()
+    empresa_id = empresa.id
     db.close()
+    return empresa_id
 
 
 def test_webhook_mensagem_do_lead():
@@ -130,6 +175,466 @@ def test_webhook_evento_ignorado():
     print("\nEvento ignorado corretamente.")
 
 
+def _payload_lead(msg_id: str, texto: str = "Oi", instancia: str = "agente-comercial") -> dict:
+    return {
+        "event": "messages.upsert",
+        "instance": instancia,
+        "sender": "5511988887777@s.whatsapp.net",
+        "data": {
+            "key": {"remoteJid": "5511977776666@s.whatsapp.net", "fromMe": False, "id": msg_id},
+            "pushName": "Joana Lead",
+            "messageTimestamp": 1707300000,
+            "message": {"conversation": texto},
+        },
+    }
+
+
+def test_webhook_cache_roteamento_preenchido():
+    """Depois da primeira mensagem, instancia, vendedor e conversa ficam em cache."""
+    empresa_id = setup()
+    client = TestClient(app)
+
+    r1 = client.post("/webhook/messages", json=_payload_lead("CACHE001")).json()
+    assert r1["status"] == "salvo"
+
+    assert cache.instancias.get("agente-comercial") == empresa_id
+    vendedor_id = cache.vendedores.get((empresa_id, "551188887777"))
+    assert vendedor_id is not cache.AUSENTE and vendedor_id is not None
+    assert cache.conversas.get((vendedor_id, "5511977776666")) == (r1["conversa_id"], True)
+
+    r2 = client.post("/webhook/messages", json=_payload_lead("CACHE002", "Tudo bem?")).json()
+    assert r2["status"] == "salvo"
+    assert r2["conversa_id"] == r1["conversa_id"]
+
+
+def test_webhook_cache_instancia_nao_registrada():
+    """Instancia desconhecida e cacheada como None ate ser criada."""
+    empresa_id = setup()
+    client = TestClient(app)
+
+    r = client.post("/webhook/messages", json=_payload_lead("CACHE003", instancia="nova-inst")).json()
+    assert r["status"] == "ignorado"
+    assert cache.instancias.get("nova-inst") is None
+
+    db = SessionLocal()
+    criar_instancia_evolution(db, empresa_id, "nova-inst")
+    db.close()
+    assert cache.instancias.get("nova-inst") is cache.AUSENTE
+
+    r = client.post("/webhook/messages", json=_payload_lead("CACHE004", instancia="nova-inst")).json()
+    assert r["status"] == "salvo"
+
+
+def test_webhook_cache_invalidado_ao_criar_vendedor():
+    """Telefone sem vendedor fica em cache negativo ate criar_vendedor."""
+    empresa_id = setup()
+    cache.vendedores.set((empresa_id, "551112345678"), None)
+
+    db = SessionLocal()
+    criar_vendedor(db, "Nova Vendedora", "5511912345678", empresa_id=empresa_id)
+    db.close()
+
+    assert cache.vendedores.get((empresa_id, "551112345678")) is cache.AUSENTE
+
+
+def test_webhook_cache_conversa_do_lead_e_vendedor_padrao():
+    """Sem vendedor pelo telefone da instancia: conversa do lead e fallback ficam em cache."""
+    empresa_id = setup()
+    db = SessionLocal()
+    outro_id = criar_vendedor(db, "Outra Vendedora", "5511911112222", empresa_id=empresa_id).id
+    upsert_conversa(db, outro_id, "5511977776666", empresa_id=empresa_id)
+    db.commit()
+    db.close()
+    client = TestClient(app)
+
+    payload = _payload_lead("PADRAO001")
+    payload["sender"] = "5511900000000@s.whatsapp.net"  # nenhum vendedor com esse telefone
+    r = client.post("/webhook/messages", json=payload).json()
+    assert r["status"] == "salvo"
+    assert cache.leads.get((empresa_id, "551177776666")) == outro_id
+
+    payload = _payload_lead("PADRAO002")
+    payload["sender"] = "5511900000000@s.whatsapp.net"
+    payload["data"]["key"]["remoteJid"] = "5511955554444@s.whatsapp.net"  # lead sem conversa
+    r = client.post("/webhook/messages", json=payload).json()
+    assert r["status"] == "salvo"
+    padrao = cache.vendedor_padrao.get(empresa_id)
+    assert padrao is not cache.AUSENTE and padrao is not None
+
+    db = SessionLocal()
+    desativar_vendedor(db, outro_id, empresa_id)
+    db.close()
+    assert cache.leads.get((empresa_id, "551177776666")) is cache.AUSENTE
+    assert cache.vendedor_padrao.get(empresa_id) is cache.AUSENTE
+
+
+def test_telefone_normalizado():
+    assert normalizar_e164("5511988887777@s.whatsapp.net") == "+5511988887777"
+    assert normalizar_e164("(11) 98888-7777") == "+5511988887777"
+    assert normalizar_e164("") is None
+    # Com e sem o 9o digito geram a mesma chave
+    assert chave_telefone("5511988887777") == chave_telefone("551188887777") == "551188887777"
+    # DDD diferente nao casa
+    assert chave_telefone("5521988887777") != chave_telefone("5511988887777")
+
+
+def test_webhook_vendedor_casado_sem_nono_digito():
+    """Instancia envia o telefone sem o 9o digito — casa com o vendedor pela chave."""
+    empresa_id = setup()
+    db = SessionLocal()
+    outro = criar_vendedor(db, "Outra Vendedora", "5511911112222", empresa_id=empresa_id)
+    outro_id = outro.id
+    db.close()
+
+    payload = _payload_lead("CHAVE001")
+    payload["sender"] = "551111112222@s.whatsapp.net"
+    r = TestClient(app).post("/webhook/messages", json=payload).json()
+    assert r["status"] == "salvo"
+
+    db = SessionLocal()
+    conversa = db.get(Conversa, r["conversa_id"])
+    assert conversa.vendedor_id == outro_id
+    assert conversa.lead_telefone_chave == "551177776666"
+    db.close()
+
+
+@pytest.mark.asyncio
+async def test_fila_ingestao_persiste_em_lote():
+    """Writer drena a fila e grava todas as mensagens num lote."""
+    setup()
+    fila = FilaIngestao(max_itens=10, tamanho_lote=10, intervalo_ms=20)
+    await fila.iniciar()
+    for i in range(3):
+        assert fila.enfileirar(parsear_webhook(_payload_lead(f"FILA{i}", f"Mensagem {i}")))
+    await fila.parar()
+
+    status = fila.status()
+    assert status["persistidas"] == 3
+    assert status["lotes"] == 1
+    assert status["ultimo_lote"] == 3
+    assert status["profundidade"] == 0
+
+    db = SessionLocal()
+    assert db.query(Mensagem).count() == 3
+    assert db.query(Conversa).count() == 1
+    db.close()
+
+
+@pytest.mark.asyncio
+async def test_fila_ingestao_repete_lote_apos_erro_transitorio(monkeypatch):
+    """Banco fora do ar: o lote ja confirmado com 202 e repetido, nao descartado."""
+    from sqlalchemy.exc import OperationalError
+
+    from src.whatsapp import ingest
+
+    setup()
+    original = ingest.persistir_lote
+    falhas = iter([OperationalError("INSERT", {}, Exception("banco fora do ar"))])
+
+    def persistir_instavel(mensagens):
+        erro = next(falhas, None)
+        if erro is not None:
+            raise erro
+        return original(mensagens)
+
+    monkeypatch.setattr(ingest, "persistir_lote", persistir_instavel)
+    fila = FilaIngestao(max_itens=10, tamanho_lote=10, intervalo_ms=20)
+    await fila.iniciar()
+    for i in range(3):
+        fila.enfileirar(parsear_webhook(_payload_lead(f"RETRY{i}")))
+    await fila.parar()
+
+    status = fila.status()
+    assert (status["persistidas"], status["retentativas"], status["descartadas"]) == (3, 1, 0)
+    db = SessionLocal()
+    assert db.query(Mensagem).count() == 3
+    db.close()
+
+
+@pytest.mark.asyncio
+async def test_fila_ingestao_isola_mensagem_com_erro_de_dados(monkeypatch):
+    """Erro nao transitorio: reprocessa uma a uma e descarta so a mensagem problematica."""
+    from src.whatsapp import ingest
+
+    setup()
+    original = ingest.persistir_lote
+
+    def persistir_com_mensagem_ruim(mensagens):
+        if any(m.message_id == "RUIM" for m in mensagens):
+            raise ValueError("conteudo invalido")
+        return original(mensagens)
+
+    monkeypatch.setattr(ingest, "persistir_lote", persistir_com_mensagem_ruim)
+    fila = FilaIngestao(max_itens=10, tamanho_lote=10, intervalo_ms=20)
+    await fila.iniciar()
+    for mid in ("BOA1", "RUIM", "BOA2"):
+        fila.enfileirar(parsear_webhook(_payload_lead(mid)))
+    await fila.parar()
+
+    status = fila.status()
+    assert (status["persistidas"], status["descartadas"]) == (2, 1)
+    db = SessionLocal()
+    assert sorted(m.message_id for m in db.query(Mensagem)) == ["BOA1", "BOA2"]
+    db.close()
+
+
+@pytest.mark.asyncio
+async def test_fila_ingestao_cheia_rejeita():
+    fila = FilaIngestao(max_itens=1, tamanho_lote=10, intervalo_ms=20)
+    fila._fila = asyncio.Queue(maxsize=1)
+    msg = parsear_webhook(_payload_lead("CHEIA"))
+    assert fila.enfileirar(msg)
+    assert not fila.enfileirar(msg)
+    assert fila.status()["rejeitadas"] == 1
+
+
+def test_webhook_responde_202_com_fila_ativa(tmp_path, monkeypatch):
+    """Com o app iniciado (lifespan), o webhook grava no journal, enfileira e responde 202."""
+    setup()
+    monkeypatch.setattr(journal, "diretorio", tmp_path)
+    with TestClient(app) as client:
+        response = client.post("/webhook/messages", json=_payload_lead("ASYNC001"))
+        assert response.status_code == 202
+        assert response.json()["status"] == "enfileirado"
+
+        status = client.get("/admin/ingestao/status", headers={"x-admin-key": settings.admin_key}).json()
+        assert status["ativa"] is True
+        assert status["enfileiradas"] >= 1
+
+    # Shutdown drena a fila
+    db = SessionLocal()
+    assert db.query(Mensagem).count() == 1
+    db.close()
+
+    # Payload aceito ficou no journal
+    assert len(list(ler_registros(tmp_path))) == 1
+
+
+def test_webhook_mensagem_duplicada_ignorada():
+    """Retry da Evolution com o mesmo message_id nao cria outra Mensagem."""
+    setup()
+    client = TestClient(app)
+
+    r1 = client.post("/webhook/messages", json=_payload_lead("DUP001")).json()
+    assert r1["status"] == "salvo"
+
+    # Descartada pelo LRU, sem ir ao banco
+    r2 = client.post("/webhook/messages", json=_payload_lead("DUP001")).json()
+    assert r2 == {"status": "ignorado", "motivo": "mensagem duplicada"}
+
+    # Sem o LRU (ex: outro processo), o ON CONFLICT do banco garante
+    cache.mensagens_recentes.limpar()
+    r3 = client.post("/webhook/messages", json=_payload_lead("DUP001")).json()
+    assert r3 == {"status": "ignorado", "motivo": "mensagem duplicada"}
+
+    db = SessionLocal()
+    assert db.query(Mensagem).count() == 1
+    assert db.query(Mensagem).first().message_id == "DUP001"
+    db.close()
+
+
+def test_endpoints_admin_leem_pela_sessao_async():
+    """Mensagem salva pelo webhook aparece nos endpoints admin (AsyncSession)."""
+    empresa_id = setup()
+    client = TestClient(app)
+    headers = {"x-admin-key": settings.admin_key}
+
+    r = client.post("/webhook/messages", json=_payload_lead("ADM001", "Quero um orcamento")).json()
+    assert r["status"] == "salvo"
+
+    conversas = client.get(f"/conversas?empresa_id={empresa_id}", headers=headers).json()
+    assert [c["id"] for c in conversas] == [r["conversa_id"]]
+    assert conversas[0]["lead_nome"] == "Joana Lead"
+
+    mensagens = client.get(f"/conversas/{r['conversa_id']}/mensagens", headers=headers).json()
+    assert [m["conteudo"] for m in mensagens] == ["Quero um orcamento"]
+
+
+def test_parsear_webhook_lote_formatos():
+    """`data` em lista e lista de eventos geram todas as mensagens processaveis."""
+    evento = _payload_lead("B1")
+    evento["data"] = [_payload_lead(f"B{i}")["data"] for i in range(1, 4)]
+    evento["data"].append({"key": {"remoteJid": "123@g.us", "id": "GRUPO"}, "message": {"conversation": "x"}})
+    assert [m.message_id for m in parsear_webhook_lote(evento)] == ["B1", "B2", "B3"]
+
+    eventos = [_payload_lead("E1"), {"event": "connection.update"}, _payload_lead("E2")]
+    assert [m.message_id for m in parsear_webhook_lote(eventos)] == ["E1", "E2"]
+    # parsear_webhook continua devolvendo uma unica mensagem
+    assert parsear_webhook(evento).message_id == "B1"
+
+
+def test_parsear_webhook_sender_nulo():
+    payload = _payload_lead("SN1")
+    payload["sender"] = None
+    msg = parsear_webhook(payload)
+    assert (msg.message_id, msg.instance_phone) == ("SN1", "")
+
+
+def test_decodificar_json_sem_orjson(monkeypatch):
+    corpo = '{"event": "messages.upsert", "data": {"pushName": "Jo\u00e3o"}}'.encode()
+    esperado = decodificar_json(corpo)
+    monkeypatch.setattr(parser, "orjson", None)
+    assert decodificar_json(corpo) == esperado
+    assert esperado["data"]["pushName"] == "João"
+
+
+def test_cenarios_benchmark_parser():
+    """Payloads do benchmark geram o tipo esperado (ou sao descartados)."""
+    from scripts.benchmark_parser import CENARIOS
+
+    tipos = {
+        nome: [m.tipo for m in parsear_webhook_lote(payload)]
+        for nome, payload in CENARIOS.items()
+    }
+    assert tipos["texto"] == tipos["texto_estendido"] == ["texto"]
+    assert tipos["imagem_legenda"] == ["imagem"]
+    assert tipos["audio"] == ["audio"]
+    assert tipos["grupo"] == tipos["status"] == []
+    assert len(tipos["lote_historico_50"]) == 50
+    assert not hasattr(parsear_webhook(CENARIOS["texto"]), "__dict__")
+
+
+def test_webhook_lote_salva_num_unico_commit():
+    setup()
+    client = TestClient(app)
+    evento = _payload_lead("S1")
+    evento["data"] = [_payload_lead(f"S{i}", f"msg {i}")["data"] for i in range(1, 51)]
+
+    r = client.post("/webhook/messages", json=evento).json()
+    assert r == {"status": "salvo", "recebidas": 50, "salvas": 50}
+
+    # Reenvio do mesmo lote: tudo descartado pelo LRU
+    r = client.post("/webhook/messages", json=evento).json()
+    assert r == {"status": "ignorado", "motivo": "mensagem duplicada"}
+
+    db = SessionLocal()
+    assert db.query(Mensagem).count() == 50
+    assert db.query(Conversa).count() == 1
+    db.close()
+
+
+def test_webhook_lote_enfileirado_com_fila_ativa(tmp_path, monkeypatch):
+    """Com a fila ativa o lote tambem vai para o writer: 202 sem esperar o commit."""
+    setup()
+    monkeypatch.setattr(journal, "diretorio", tmp_path)
+    evento = _payload_lead("F1")
+    evento["data"] = [_payload_lead(f"F{i}", f"msg {i}")["data"] for i in range(1, 51)]
+    with TestClient(app) as client:
+        response = client.post("/webhook/messages", json=evento)
+        assert response.status_code == 202
+        assert response.json() == {"status": "enfileirado", "recebidas": 50}
+
+    # Shutdown drena a fila
+    db = SessionLocal()
+    assert db.query(Mensagem).count() == 50
+    assert db.query(Conversa).count() == 1
+    db.close()
+
+
+@pytest.mark.asyncio
+async def test_fila_ingestao_lote_tudo_ou_nada():
+    setup()
+    fila = FilaIngestao(max_itens=3, tamanho_lote=10, intervalo_ms=20)
+    await fila.iniciar()
+    msgs = [parsear_webhook(_payload_lead(f"TN{i}")) for i in range(3)]
+    assert fila.enfileirar(msgs[0])
+    assert not fila.enfileirar_lote(msgs[1:] + [parsear_webhook(_payload_lead("TN9"))])
+    assert fila.status()["rejeitadas"] == 3
+    assert fila.enfileirar_lote(msgs[1:])
+    await fila.parar()
+    assert fila.status()["persistidas"] == 3
+
+
+def test_lote_ignora_message_id_repetido():
+    setup()
+    msgs = [parsear_webhook(_payload_lead(mid)) for mid in ("L1", "L2", "L1")]
+    assert persistir_lote(msgs) == 2
+    assert persistir_lote(msgs) == 0
+    assert cache.mensagens_recentes.contem(("agente-comercial", "L2"))
+
+
+def test_lote_nao_marca_como_vista_mensagem_nao_roteada():
+    """Retry de mensagem de instancia ainda nao cadastrada e aceito depois do cadastro."""
+    empresa_id = setup()
+    msgs = [
+        parsear_webhook(_payload_lead("NR1", instancia="instancia-nova")),
+        parsear_webhook(_payload_lead("NR2")),
+    ]
+    assert persistir_lote(msgs) == 1
+    assert not cache.mensagens_recentes.contem(("instancia-nova", "NR1"))
+    assert cache.mensagens_recentes.contem(("agente-comercial", "NR2"))
+
+    db = SessionLocal()
+    criar_instancia_evolution(db, empresa_id, "instancia-nova")
+    db.close()
+    assert persistir_lote(msgs) == 1
+    assert cache.mensagens_recentes.contem(("instancia-nova", "NR1"))
+
+
+def test_upsert_conversa_idempotente():
+    setup()
+    db = SessionLocal()
+    vendedor_id = db.query(Vendedor.id).scalar()
+    conversa_id, tem_nome = upsert_conversa(db, vendedor_id, "5511966665555")
+    assert not tem_nome
+    mesmo_id, tem_nome = upsert_conversa(db, vendedor_id, "5511966665555", "Carla")
+    assert (mesmo_id, tem_nome) == (conversa_id, True)
+    # lead_nome ja preenchido nao e sobrescrito
+    upsert_conversa(db, vendedor_id, "5511966665555", "Outro Nome")
+    db.commit()
+    assert db.query(Conversa).count() == 1
+    assert db.get(Conversa, conversa_id).lead_nome == "Carla"
+    db.close()
+
+
+def test_estado_conversa_mantido_na_ingestao():
+    empresa_id = setup()
+    db = SessionLocal()
+    vendedor_id = db.query(Vendedor.id).scalar()
+    dia = datetime(2026, 2, 7, 10)
+    sequencia = [
+        ("lead", dia),
+        ("lead", dia.replace(minute=1)),
+        ("vendedor", dia.replace(minute=5)),
+        ("vendedor", dia.replace(minute=6)),
+        ("lead", dia.replace(minute=30, microsecond=700000)),
+        ("vendedor", dia.replace(minute=31, microsecond=200000)),
+        ("lead", dia.replace(hour=11)),
+    ]
+    # Uma mensagem por vez e o mesmo historico num lote fora de ordem
+    individual, _ = upsert_conversa(db, vendedor_id, "5511966660001", empresa_id=empresa_id)
+    for remetente, quando in sequencia:
+        salvar_mensagem(db, individual, remetente, "x", enviada_em=quando)
+    lote, _ = upsert_conversa(db, vendedor_id, "5511966660002", empresa_id=empresa_id)
+    salvar_mensagens_lote(db, [
+        {"conversa_id": lote, "remetente": remetente, "conteudo": "x", "tipo": "texto",
+         "enviada_em": quando, "message_id": f"E{i}"}
+        for i, (remetente, quando) in reversed(list(enumerate(sequencia)))
+    ])
+
+    esperado = calcular_estado(sequencia)
+    assert (esperado["primeira_resposta_seg"], esperado["soma_respostas_seg"]) == (300, 359)
+    for conversa_id in (individual, lote):
+        conversa = db.get(Conversa, conversa_id)
+        assert {campo: getattr(conversa, campo) for campo in esperado} == esperado
+    assert [c.id for c in listar_leads_aguardando(db, empresa_id=empresa_id)] == [individual, lote]
+    db.close()
+
+
+def test_cache_ttl_expira():
+    c = cache.CacheTTL(ttl_seg=0)
+    c.set("x", 1)
+    assert c.get("x") is cache.AUSENTE
+
+    c = cache.CacheTTL(ttl_seg=60, max_itens=2)
+    c.set("a", 1)
+    c.set("b", 2)
+    c.set("c", 3)
+    assert len(c) == 2
+    assert c.get("a") is cache.AUSENTE
+    assert c.get("c") == 3
+
+
 if __name__ == "__main__":
     print("=" * 60)
     print("  TESTES DO WEBHOOK - AGENTE COMERCIAL")